@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'store.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -50,6 +52,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'store.replicas.ReadYourWritesMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -86,6 +89,12 @@ DATABASES = {
     }
 }
 
+# Reads of the catalog and order history can be served by the read replicas listed in
+# STORE_READ_REPLICAS['ALIASES'] (see store/replicas.py). 'replica' stands in for one (point its HOST at
+# the replica to use it); it serves nothing until listed, and the tests of the routing run against it.
+DATABASES['replica'] = {**DATABASES['default'], 'TEST': {'NAME': 'test_ecommerce_db_replica'}}
+DATABASE_ROUTERS = ['store.replicas.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -134,11 +143,139 @@ AUTH_USER_MODEL = 'store.User'
 
 REST_FRAMEWORK = {
     'COERCE_DECIMAL_TO_STRING': False,
+    'DEFAULT_PAGINATION_CLASS': 'store.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'store.authentication.ClaimsJWTAuthentication',
     ),
 }
 
 SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('JWT',),
-}
\ No newline at end of file
+    'TOKEN_OBTAIN_SERIALIZER': 'store.authentication.ClaimsTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'store.authentication.DenyListTokenRefreshSerializer',
+}
+
+# The cache shared by the workers, holding the token deny-list and the catalog cache. Deployments point it at
+# Redis or Memcached through the environment, e.g. STORE_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+# and STORE_CACHE_LOCATION=redis://cache.internal:6379/0; the local-memory default only suits a single process.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('STORE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('STORE_CACHE_LOCATION', ''),
+    },
+}
+
+# Revoked JWTs (see store/authentication.py).
+# The cache must be shared by every worker (Redis, Memcached), `manage.py check --deploy` warns about a
+# per-process one, such as the local-memory default.
+STORE_TOKEN_DENY_LIST = {
+    'CACHE_ALIAS': 'default',
+}
+
+# Catalog read-through cache (see store/cache.py).
+# SHARED_ALIAS is the alias of `CACHES` sharing the entries and their versions across workers: point it at
+# memcached or Redis in production, or a write in one worker leaves the others serving the old payload
+# until TIMEOUT. None keeps both per process.
+STORE_CATALOG_CACHE = {
+    'MAX_ENTRIES': 2048,
+    'TIMEOUT': 300,
+    'SHARED_ALIAS': 'default',
+}
+
+# Build product, collection and cart read payloads from `.values()` rows instead of the
+# ModelSerializers (see store/fast_serializers.py). The JSON output is identical.
+STORE_FAST_READ_SERIALIZERS = False
+
+# Thread pool verifying passwords for the async sign-in (see store/passwords.py), per worker process.
+# Sign-ins beyond MAX_WORKERS running and MAX_QUEUE waiting are answered with a 503.
+STORE_PASSWORD_HASHING = {
+    'MAX_WORKERS': 4,
+    'MAX_QUEUE': 64,
+}
+
+# Resized, re-encoded copies of uploaded product images (see store/images.py), served with `?size=`.
+# SIZES are bounding boxes in pixels. They are rendered after the upload in a pool of MAX_WORKERS
+# processes per worker process (0 renders them in-process, after the upload's transaction commits);
+# `manage.py build_image_derivatives` renders those of older images.
+STORE_IMAGE_DERIVATIVES = {
+    'SIZES': {'thumbnail': 150, 'medium': 600, 'large': 1200},
+    'FORMATS': ['jpeg', 'webp'],
+    'QUALITY': 80,
+    'MAX_WORKERS': 2,
+}
+
+# Product search (see store/search.py). BACKEND is 'fulltext' (MySQL FULLTEXT indexes) or
+# 'inverted-index' (in-process, for SQLite test runs), picked from the database engine by default.
+# PRICE_BUCKETS are the bounds of the price facet.
+STORE_PRODUCT_SEARCH = {
+    'BACKEND': None,
+    'PRICE_BUCKETS': [10, 50, 100, 500],
+    'MAX_RESULTS': 10000,
+}
+
+# Expired cart reaper (see store/reaper.py): carts untouched for TTL_DAYS are deleted BATCH_SIZE at a time,
+# sleeping PAUSE seconds between batches. Run `manage.py reap_carts` (from cron, or with --every), or set
+# INTERVAL (seconds) to reap in a thread of every server process; concurrent reapers skip each other's carts.
+STORE_CART_REAPER = {
+    'TTL_DAYS': 14,
+    'BATCH_SIZE': 500,
+    'PAUSE': 0.1,
+    'INTERVAL': None,
+}
+
+# Per-request timings (see store/instrumentation.py): SQL count and time, serializers, rendering and total,
+# sent as a `Server-Timing` header and, with LOG, as a JSON line per request on the `store.instrumentation`
+# logger (off by default: deployments shipping their logs opt in).
+# PROFILE runs SAMPLE_RATE of the requests under cProfile and dumps the stats of those slower than SLOW_MS
+# to DIRECTORY/<route name>/, keeping the latest MAX_FILES_PER_ROUTE; it's off while DIRECTORY is None.
+STORE_INSTRUMENTATION = {
+    'SERVER_TIMING': True,
+    'LOG': False,
+    'PROFILE': {
+        'SAMPLE_RATE': 0.01,
+        'SLOW_MS': 500,
+        'DIRECTORY': None,
+        'MAX_FILES_PER_ROUTE': 20,
+    },
+}
+
+# Per-route request metrics (see store/metrics.py), served to staff in the Prometheus format at /metrics/.
+# MODE 'memory' keeps them per process; with several worker processes use 'file' and a DIRECTORY shared by
+# the workers (ideally on a tmpfs such as /dev/shm), emptied when the server starts. It holds one file per
+# thread a worker runs at once (an ended thread's file is carried on by the next one), and the files of
+# the workers that ended, whose counts stay part of the totals.
+STORE_METRICS = {
+    'ENABLED': True,
+    'MODE': 'memory',
+    'DIRECTORY': None,
+    'LATENCY_BUCKETS': [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+    'QUERY_BUCKETS': [0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89],
+}
+
+# Read replicas (see store/replicas.py): the safe requests of the product, collection and order viewsets
+# read from one of ALIASES (aliases of DATABASES), skipping any replica more than MAX_LAG seconds behind
+# (checked every LAG_CHECK_INTERVAL seconds) and, for RETRY_AFTER seconds, any that can't be reached.
+# A client that wrote something reads from the primary for the next STICKY_SECONDS, tracked by the
+# COOKIE_NAME cookie. With no ALIASES everything stays on the primary.
+# The catalog cache is filled from the replica too, except for the payloads written to within MAX_LAG,
+# which it reads from the primary (see store/cache.py).
+STORE_READ_REPLICAS = {
+    'ALIASES': [],
+    'MAX_LAG': 5,
+    'LAG_CHECK_INTERVAL': 2,
+    'RETRY_AFTER': 30,
+    'STICKY_SECONDS': 10,
+    'COOKIE_NAME': 'store_primary_until',
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'store.instrumentation': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
+
+# imported once the application has loaded the apps.
+from store.reaper import start_scheduled_reaper
+
+start_scheduled_reaper()
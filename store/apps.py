@@ -6,4 +6,5 @@ class StoreConfig(AppConfig):
     name = 'store'
 
     def ready(self):
-        import store.signals.handlers
\ No newline at end of file
+        import store.signals.handlers
+        import store.checks
@@ -0,0 +1,157 @@
+import json
+from django.db.models import F
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from .cache import catalog_cache
+from .conditional import CART_LAST_MODIFIED, get_validator_rows, make_etag, make_scope_etag, get_not_modified, set_validators
+from .instrumentation import measure
+from .fast_serializers import ProductValuesSerializer, CollectionValuesSerializer, CartValuesSerializer
+from .models import User, Collection, Product, Cart
+from .pagination import KeysetPagination
+from .passwords import HashingPoolFull, password_hashing_pool
+from .serializers import SignInSerializer, UserToken
+
+
+@csrf_exempt
+@require_POST
+async def sign_in(request):
+    """
+    The sign-in of `SignInViewSet` as a native async view (run it under config/asgi.py).
+
+    The password is verified in `password_hashing_pool`, so a burst of sign-ins waits on the pool
+    instead of holding the workers that serve the catalog. A hash made with an outdated hasher or
+    iteration count is replaced by a current one on a successful sign-in.
+    """
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({'detail': 'JSON parse error'}, status=400)
+    # only the fields are validated here, `SignInSerializer.create` would authenticate synchronously.
+    serializer = SignInSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+
+    email = serializer.validated_data['email']
+    password = serializer.validated_data['password']
+    # the customer id is fetched along, for the token claims.
+    user = await User.objects.annotate(customer_id=F('customer__id')).filter(email=email).afirst()
+    try:
+        valid, upgraded = await password_hashing_pool.verify(password, user.password if user is not None else None)
+    except HashingPoolFull:
+        return JsonResponse({'detail': 'Too many sign-ins in progress, try again shortly.'}, status=503, headers={'Retry-After': '1'})
+    if not valid or not user.is_active:
+        return JsonResponse(['Invalid email or password!!'], safe=False, status=400)
+
+    if upgraded is not None:
+        # `update()` skips the signal revoking tokens on password changes, the password is the same one.
+        # the filter on the old hash keeps a password changed in the meantime.
+        await User.objects.filter(pk=user.pk, password=user.password).aupdate(password=upgraded)
+    return JsonResponse(UserToken().create_user_token(user), status=201)
+
+
+# Async variants of the catalog reads (and the cart detail), for ASGI deployments.
+# They render the same JSON as the DRF viewsets, through the `.values()` serializers, and are cached
+# under the same scopes, so the catalog invalidation covers them. Every write still goes through the
+# synchronous viewsets.
+
+def render(data, status=200):
+    with measure('render'):
+        content = JSONRenderer().render(data)
+    return HttpResponse(content, status=status, content_type='application/json')
+
+
+async def read_list(request, queryset, values_serializer_class, last_modified, cache_scope=None):
+    # a DRF request only for `query_params`, nothing is authenticated.
+    request = Request(request)
+    paginator = KeysetPagination()
+    scopes = [f'{cache_scope}-list']
+    if cache_scope:
+        # validated by the versions of its cache scope, without a query (see `ConditionalGetMixin`).
+        etag = make_scope_etag(request, await catalog_cache.aget_version_tag(scopes), JSONRenderer.format)
+    else:
+        try:
+            rows = [row async for row in paginator.get_page_queryset(get_validator_rows(queryset, last_modified), request)]
+        except NotFound as error:
+            return render({'detail': error.detail}, status=404)
+        etag = make_etag(request, rows, JSONRenderer.format)
+    if (response := get_not_modified(request, etag)) is not None:
+        return response
+
+    key = request.build_absolute_uri()
+    if cache_scope and (data := await catalog_cache.aget(key, scopes)) is not None:
+        return set_validators(render(data), etag)
+
+    try:
+        # `?fields=` is validated by the serializer.
+        serializer = values_serializer_class(request)
+        page = await paginator.apaginate_queryset(serializer.get_rows(queryset), request)
+        data = {'next': paginator.get_next_link(), 'results': await serializer.aserialize(page)}
+    except ValidationError as error:
+        return render(error.detail, status=400)
+    except NotFound as error:
+        return render({'detail': error.detail}, status=404)
+    if cache_scope:
+        await catalog_cache.aset(key, scopes, data)
+    return set_validators(render(data), etag)
+
+
+async def read_detail(request, queryset, values_serializer_class, pk, last_modified, cache_scope=None):
+    request = Request(request)
+    scopes = [f'{cache_scope}:{pk}']
+    if cache_scope:
+        etag, last_modified_at = make_scope_etag(request, await catalog_cache.aget_version_tag(scopes), JSONRenderer.format), None
+    else:
+        validator = await get_validator_rows(queryset.filter(pk=pk), last_modified).afirst()
+        if validator is None:
+            return render({'detail': f'No {queryset.model._meta.object_name} matches the given query.'}, status=404)
+        etag, last_modified_at = make_etag(request, [validator], JSONRenderer.format), validator[1]
+    if (response := get_not_modified(request, etag, last_modified_at)) is not None:
+        return response
+
+    key = request.build_absolute_uri()
+    if cache_scope and (data := await catalog_cache.aget(key, scopes)) is not None:
+        return set_validators(render(data), etag, last_modified_at)
+
+    try:
+        serializer = values_serializer_class(request)
+    except ValidationError as error:
+        return render(error.detail, status=400)
+    row = await serializer.get_rows(queryset.filter(pk=pk)).afirst()
+    if row is None:
+        return render({'detail': f'No {queryset.model._meta.object_name} matches the given query.'}, status=404)
+    try:
+        data = (await serializer.aserialize([row]))[0]
+    except ValidationError as error:
+        return render(error.detail, status=400)
+    if cache_scope:
+        await catalog_cache.aset(key, scopes, data)
+    return set_validators(render(data), etag, last_modified_at)
+
+
+@require_GET
+async def product_list(request):
+    return await read_list(request, Product.objects.all(), ProductValuesSerializer, 'last_updated_at', 'product')
+
+
+@require_GET
+async def product_detail(request, pk):
+    return await read_detail(request, Product.objects.all(), ProductValuesSerializer, pk, 'last_updated_at', 'product')
+
+
+@require_GET
+async def collection_list(request):
+    return await read_list(request, Collection.objects.all(), CollectionValuesSerializer, 'last_updated_at', 'collection')
+
+
+@require_GET
+async def collection_detail(request, pk):
+    return await read_detail(request, Collection.objects.all(), CollectionValuesSerializer, pk, 'last_updated_at', 'collection')
+
+
+@require_GET
+async def cart_detail(request, pk):
+    return await read_detail(request, Cart.objects.all(), CartValuesSerializer, pk, CART_LAST_MODIFIED)
@@ -0,0 +1,175 @@
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from . import models
+
+
+# claims copied from the user into every token, and read back by `TokenUser`.
+USER_CLAIMS = ('is_staff', 'customer_id')
+
+
+def get_token_for_user(user):
+    """Return a refresh token carrying the `USER_CLAIMS`; its access tokens inherit them."""
+    refresh = RefreshToken.for_user(user)
+    set_user_claims(refresh, user)
+    return refresh
+
+
+def set_user_claims(token, user):
+    for claim in USER_CLAIMS:
+        token[claim] = getattr(user, claim)
+
+
+class TokenDenyList:
+    """
+    Revoked tokens, kept in a Django cache for as long as the tokens could still be used.
+
+    A single token is revoked by its `jti`, and every token of a user issued up to now with
+    `revoke_user()`. Checking a token costs one `get_many()` on the cache and no query.
+    `CACHE_ALIAS` must name a cache shared by every worker (Redis, Memcached) in production, see `is_shared()`.
+    """
+    # backends keeping the entries in the worker process, where a revocation wouldn't reach the other workers.
+    local_backends = (
+        'django.core.cache.backends.locmem.LocMemCache',
+        'django.core.cache.backends.dummy.DummyCache',
+    )
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    @classmethod
+    def from_settings(cls):
+        options = getattr(settings, 'STORE_TOKEN_DENY_LIST', {})
+        return cls(options.get('CACHE_ALIAS', 'default'))
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def is_shared(self):
+        """Whether the cache is shared by the worker processes, rather than local to each (see store/checks.py)."""
+        backend = settings.CACHES.get(self.alias, {}).get('BACKEND')
+        return backend is not None and backend not in self.local_backends
+
+    def revoke(self, token):
+        remaining = int(token['exp'] - time.time())
+        if remaining > 0:
+            self.cache.set(f'token-deny:jti:{token[api_settings.JTI_CLAIM]}', True, remaining)
+
+    def revoke_user(self, user_id):
+        # no token issued before now can outlive the refresh token lifetime.
+        timeout = int(api_settings.REFRESH_TOKEN_LIFETIME.total_seconds())
+        self.cache.set(f'token-deny:user:{user_id}', int(time.time()), timeout)
+
+    def is_revoked(self, token):
+        jti_key = f'token-deny:jti:{token.get(api_settings.JTI_CLAIM)}'
+        user_key = f'token-deny:user:{token.get(api_settings.USER_ID_CLAIM)}'
+        denied = self.cache.get_many([jti_key, user_key])
+        if jti_key in denied:
+            return True
+        # `iat` has a one second resolution: tokens issued in the second of the revocation stay valid,
+        # so a sign-in that rehashes the password doesn't revoke the token it's about to return.
+        return user_key in denied and token.get('iat', 0) < denied[user_key]
+
+
+deny_list = TokenDenyList.from_settings()
+
+
+class TokenUser:
+    """
+    The request user built from the claims of the access token.
+
+    `id`, `pk` and the `USER_CLAIMS` are read from the token; any other attribute (`is_active` included)
+    loads the `User` row on first access (once per request), so most requests never query it. Deactivating
+    a user revokes their tokens instead (see `store.signals.handlers.revoke_stale_tokens`).
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, token):
+        # simplejwt stores the id as a string.
+        self.id = self.pk = models.User._meta.pk.to_python(token[api_settings.USER_ID_CLAIM])
+        for claim in USER_CLAIMS:
+            if claim in token:
+                setattr(self, claim, token[claim])
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name == '_user':
+            raise AttributeError(name)
+        if name == 'customer_id':
+            # a token issued before the claim existed.
+            self.customer_id = models.Customer.objects.filter(user_id=self.id).values_list('id', flat=True).first()
+            return self.customer_id
+        if '_user' not in self.__dict__:
+            try:
+                self._user = models.User.objects.get(pk=self.id)
+            except models.User.DoesNotExist:
+                raise AuthenticationFailed('User not found', code='user_not_found')
+        return getattr(self._user, name)
+
+    def __eq__(self, other):
+        return isinstance(other, (TokenUser, models.User)) and self.pk == other.pk
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def __str__(self):
+        return f'TokenUser {self.id}'
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    `JWTAuthentication` without the per-request `User` query: the user is a lazy `TokenUser`,
+    and revoked tokens are rejected through the `deny_list`.
+    """
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken('Token contained no recognizable user identification')
+        if deny_list.is_revoked(validated_token):
+            raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+        return TokenUser(validated_token)
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        return get_token_for_user(user)
+
+
+class DenyListTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Refresh the tokens that aren't revoked, of active users only, with the `USER_CLAIMS` minted again
+    from the user row (one query) rather than copied from the refresh token, so the new access token
+    carries a change of `is_staff` or of the customer.
+    """
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        if deny_list.is_revoked(refresh):
+            raise InvalidToken('Token has been revoked')
+
+        user = models.User.objects \
+            .filter(**{api_settings.USER_ID_FIELD: refresh.get(api_settings.USER_ID_CLAIM)}) \
+            .annotate(customer_pk=F('customer__id')) \
+            .first()
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        # spares `User.customer_id` its query.
+        user.customer_id = user.customer_pk
+        set_user_claims(refresh, user)
+
+        data = {'access': str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                deny_list.revoke(refresh)
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data['refresh'] = str(refresh)
+        return data
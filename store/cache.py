@@ -0,0 +1,228 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+from .replicas import current_read_alias, primary_reads, read_replicas
+
+
+class LRUCache:
+    """
+    A bounded, thread-safe, in-process cache.
+    Entries are evicted least-recently-used first once `max_entries` is reached.
+    """
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class CatalogCache:
+    """
+    Read-through cache for rendered catalog payloads.
+
+    Every entry is stored under its key plus the current version of each scope it depends on
+    (e.g. `product:12`, `product-list`), so invalidation is a matter of bumping a version and
+    stale entries simply stop being addressed and age out.
+    The versions live in the shared tier when one is configured, so all workers agree on them. Without
+    one they are per process and bounded like the entries: an evicted or expired version is reissued
+    fresh, never reused, which only costs misses.
+    A version is the time (in ns) it was issued or bumped at, which tells how long ago a scope last changed.
+    """
+    key_prefix = 'store:catalog'
+
+    def __init__(self, max_entries=2048, timeout=300, shared_alias=None):
+        self.timeout = timeout
+        self.shared_alias = shared_alias
+        self.local = LRUCache(max_entries, timeout)
+        self._versions = LRUCache(max_entries, timeout)
+        self._versions_lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        options = getattr(settings, 'STORE_CATALOG_CACHE', {})
+        return cls(
+            max_entries=options.get('MAX_ENTRIES', 2048),
+            timeout=options.get('TIMEOUT', 300),
+            shared_alias=options.get('SHARED_ALIAS', 'default'),
+        )
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    def version_key(self, scope):
+        return f'{self.key_prefix}:version:{scope}'
+
+    def get_versions(self, scopes):
+        keys = [self.version_key(scope) for scope in scopes]
+        if self.shared is None:
+            with self._versions_lock:
+                return tuple(self.get_local_version(key) for key in keys)
+
+        versions = self.shared.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                # a fresh (never reused) version, so an evicted version key can't resurrect stale entries.
+                self.shared.add(key, time.time_ns(), timeout=None)
+                versions[key] = self.shared.get(key)
+        return tuple(versions[key] for key in keys)
+
+    def get_local_version(self, key):
+        version = self._versions.get(key)
+        if version is None:
+            version = time.time_ns()
+            self._versions.set(key, version)
+        return version
+
+    def bump(self, *scopes):
+        for scope in scopes:
+            key = self.version_key(scope)
+            if self.shared is None:
+                with self._versions_lock:
+                    self._versions.set(key, max(time.time_ns(), self.get_local_version(key) + 1))
+                continue
+            # set rather than incremented: two concurrent bumps both leave a version never issued before.
+            self.shared.set(key, time.time_ns(), timeout=None)
+
+    def bump_on_commit(self, *scopes):
+        """
+        `bump()` once the current transaction commits (right away outside one). Bumped earlier, a concurrent
+        read would cache the rows from before the write under the new versions.
+        """
+        transaction.on_commit(lambda: self.bump(*scopes))
+
+    def is_settled(self, scopes, seconds):
+        """
+        Whether none of `scopes` changed (or had its version reissued) in the last `seconds`, by the clock
+        of this worker: the workers' clocks must agree to well within `seconds`.
+        """
+        return time.time_ns() - max(self.get_versions(['all', *scopes])) > seconds * 1e9
+
+    def get_version_tag(self, scopes):
+        """The versions an entry depending on `scopes` is stored under, as a string: it changes with any of them."""
+        # every entry depends on the `all` scope too, which `clear()` bumps.
+        return '.'.join(str(version) for version in self.get_versions(['all', *scopes]))
+
+    def make_key(self, key, scopes):
+        digest = hashlib.md5(f'{key}|{self.get_version_tag(scopes)}'.encode('utf-8')).hexdigest()
+        return f'{self.key_prefix}:entry:{digest}'
+
+    def get(self, key, scopes):
+        cache_key = self.make_key(key, scopes)
+        value = self.local.get(cache_key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(cache_key)
+            if value is not None:
+                self.local.set(cache_key, value)
+        return value
+
+    def set(self, key, scopes, value):
+        cache_key = self.make_key(key, scopes)
+        self.local.set(cache_key, value)
+        if self.shared is not None:
+            self.shared.set(cache_key, value, timeout=self.timeout)
+
+    async def aget_version_tag(self, scopes):
+        if self.shared is None:
+            return self.get_version_tag(scopes)
+        return await sync_to_async(self.get_version_tag, thread_sensitive=False)(scopes)
+
+    async def aget(self, key, scopes):
+        if self.shared is None:
+            # the in-process tier never blocks the event loop.
+            return self.get(key, scopes)
+        return await sync_to_async(self.get, thread_sensitive=False)(key, scopes)
+
+    async def aset(self, key, scopes, value):
+        if self.shared is None:
+            return self.set(key, scopes, value)
+        return await sync_to_async(self.set, thread_sensitive=False)(key, scopes, value)
+
+    def clear(self):
+        """Drop every entry, in all the workers sharing the tier."""
+        self.local.clear()
+        if self.shared is None:
+            with self._versions_lock:
+                self._versions.clear()
+        else:
+            self.bump('all')
+
+
+catalog_cache = CatalogCache.from_settings()
+
+
+class CatalogCacheMixin:
+    """
+    Serve `list` and `retrieve` from the catalog cache.
+    `cache_scope` names the resource; the list depends on `<scope>-list`, each object on `<scope>:<pk>`.
+    """
+    cache_scope = None
+
+    def get_cache_scopes(self):
+        """The scopes the payload of the current `list` or `retrieve` is cached under."""
+        if self.action == 'list':
+            return [f'{self.cache_scope}-list']
+        return [f'{self.cache_scope}:{self.kwargs[self.lookup_url_kwarg or self.lookup_field]}']
+
+    def get_fill_context(self, scopes):
+        """
+        Where a cache miss is read from: the replica serving the request, unless one of `scopes` changed
+        within MAX_LAG. The replica may not have that write yet, and its rows would be cached (and
+        validated by ETag) under the version the write bumped, outliving the lag.
+        """
+        if current_read_alias.get() is None or catalog_cache.is_settled(scopes, read_replicas.max_lag):
+            return nullcontext()
+        return primary_reads()
+
+    def list(self, request, *args, **kwargs):
+        scopes = self.get_cache_scopes()
+        key = request.build_absolute_uri()
+        if (data := catalog_cache.get(key, scopes)) is not None:
+            return Response(data)
+        with self.get_fill_context(scopes):
+            response = super().list(request, *args, **kwargs)
+        if response.status_code == 200:
+            catalog_cache.set(key, scopes, response.data)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        scopes = self.get_cache_scopes()
+        key = request.build_absolute_uri()
+        if (data := catalog_cache.get(key, scopes)) is not None:
+            return Response(data)
+        with self.get_fill_context(scopes):
+            response = super().retrieve(request, *args, **kwargs)
+        if response.status_code == 200:
+            catalog_cache.set(key, scopes, response.data)
+        return response
@@ -0,0 +1,15 @@
+from django.core.checks import Tags, Warning, register
+from .authentication import deny_list
+
+
+@register(Tags.caches, Tags.security, deploy=True)
+def check_deny_list_cache(app_configs, **kwargs):
+    """The token deny-list must reach every worker, see `TokenDenyList`."""
+    if deny_list.is_shared():
+        return []
+    return [Warning(
+        f'STORE_TOKEN_DENY_LIST["CACHE_ALIAS"] ({deny_list.alias!r}) is not a cache shared by the workers: '
+        'a token revoked in one worker stays valid in the others.',
+        hint='Point the cache at Redis or Memcached, e.g. with the STORE_CACHE_BACKEND and STORE_CACHE_LOCATION environment variables.',
+        id='store.W001',
+    )]
@@ -0,0 +1,120 @@
+import hashlib
+from django.core.exceptions import ValidationError
+from django.db.models import Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from . import models
+from .cache import catalog_cache
+
+
+# The payload of a cart changes with its items (which touch `updated_at`) and with the names and
+# prices of their products, which don't touch the cart.
+# A correlated subquery rather than a join and GROUP BY, which would sort the carts without their index.
+CART_LAST_MODIFIED = Greatest('updated_at', Coalesce(Subquery(
+    models.CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart').annotate(latest=Max('product__last_updated_at')).values('latest')
+), 'updated_at'))
+
+
+def get_validator_rows(queryset, last_modified):
+    """`(pk, last modified)` rows of `queryset`, `last_modified` being a field name or an expression."""
+    queryset = queryset.prefetch_related(None)
+    if isinstance(last_modified, str):
+        return queryset.values_list('pk', last_modified)
+    return queryset.annotate(validator_modified_at=last_modified).values_list('pk', 'validator_modified_at')
+
+
+def make_etag(request, rows, renderer_format):
+    """
+    A weak ETag of the representation of `rows` at the request's URL: it changes when a row is
+    modified, enters or leaves them, and differs per query string and renderer.
+    """
+    validator = '|'.join(f'{pk}@{modified_at.isoformat()}' for pk, modified_at in rows)
+    digest = hashlib.md5(f'{request.get_full_path()}|{renderer_format}|{validator}'.encode('utf-8')).hexdigest()
+    return f'W/"{digest}"'
+
+
+def make_scope_etag(request, version_tag, renderer_format):
+    """
+    A weak ETag of a payload of the catalog cache, from the `version_tag` of the scopes it's cached under
+    (see `CatalogCache.get_version_tag()`): every write to its rows bumps one of them, so it takes no query.
+    """
+    digest = hashlib.md5(f'{request.get_full_path()}|{renderer_format}|{version_tag}'.encode('utf-8')).hexdigest()
+    return f'W/"{digest}"'
+
+
+def get_not_modified(request, etag, last_modified=None):
+    """The `304 Not Modified` (or `412`, for a failed `If-Match`) the conditional headers call for, or None."""
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified.timestamp()) if last_modified else None,
+    )
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    Answer `list` and `retrieve` with an `ETag` (and, for a single object, `Last-Modified`), and answer
+    `If-None-Match` / `If-Modified-Since` with a `304` from a query on the rows' timestamps alone,
+    before the serializers or the catalog cache run.
+
+    `last_modified` (a field name or an expression) must change whenever the payload of a row does,
+    nested rows included. A list is validated by the requested page of rows plus the one after it, which
+    decides `next`; it carries no `Last-Modified`, as a row leaving the page doesn't move the newest timestamp.
+
+    The resources of the catalog cache (see `CatalogCacheMixin`) are validated by the versions of their cache
+    scopes instead, without a query, so a cache hit stays query-free; they carry no `Last-Modified` either.
+    """
+    last_modified = None
+
+    def get_scope_etag(self, request):
+        if getattr(self, 'cache_scope', None) is None:
+            return None
+        version_tag = catalog_cache.get_version_tag(self.get_cache_scopes())
+        return make_scope_etag(request, version_tag, request.accepted_renderer.format)
+
+    def list(self, request, *args, **kwargs):
+        if (etag := self.get_scope_etag(request)) is not None:
+            if (response := get_not_modified(request, etag)) is not None:
+                return response
+            response = super().list(request, *args, **kwargs)
+            return set_validators(response, etag) if response.status_code == 200 else response
+
+        rows = get_validator_rows(self.filter_queryset(self.get_queryset()), self.last_modified)
+        if self.paginator is not None:
+            rows = self.paginator.get_page_queryset(rows, request)
+        etag = make_etag(request, list(rows), request.accepted_renderer.format)
+        if (response := get_not_modified(request, etag)) is not None:
+            return response
+        response = super().list(request, *args, **kwargs)
+        return set_validators(response, etag) if response.status_code == 200 else response
+
+    def retrieve(self, request, *args, **kwargs):
+        if (etag := self.get_scope_etag(request)) is not None:
+            if (response := get_not_modified(request, etag)) is not None:
+                return response
+            response = super().retrieve(request, *args, **kwargs)
+            return set_validators(response, etag) if response.status_code == 200 else response
+
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        rows = get_validator_rows(self.filter_queryset(self.get_queryset()), self.last_modified)
+        try:
+            row = rows.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]}).first()
+        except (TypeError, ValueError, ValidationError):
+            row = None
+        if row is None:
+            # the 404 is left to the view.
+            return super().retrieve(request, *args, **kwargs)
+        etag = make_etag(request, [row], request.accepted_renderer.format)
+        if (response := get_not_modified(request, etag, row[1])) is not None:
+            return response
+        response = super().retrieve(request, *args, **kwargs)
+        return set_validators(response, etag, row[1]) if response.status_code == 200 else response
@@ -0,0 +1,74 @@
+import csv
+from collections import defaultdict
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from . import models
+from .pagination import keyset_filter
+
+
+EXPORT_FIELDS = ['id', 'name', 'slug', 'description', 'price', 'stock', 'collection_id', 'collection_name', 'last_updated_at', 'images']
+
+
+class Echo:
+    """A file-like object whose `write` hands the value back, so `csv.writer` can feed a stream."""
+    def write(self, value):
+        return value
+
+
+def iter_products(queryset, request=None, ordering=('pk',), chunk_size=1000):
+    """
+    Yield every product of `queryset` as a flat dict with its collection name and image URLs.
+
+    The rows are read in `ordering` (which must end with the primary key), one bounded chunk per query
+    seeking past the last row (keyset, not OFFSET), so memory stays flat whatever the catalog size,
+    even on MySQL where the driver buffers whole result sets.
+    """
+    storage = models.ProductImage._meta.get_field('image').storage
+    queryset = queryset.prefetch_related(None).order_by(*ordering).values(
+        'id', 'name', 'slug', 'description', 'price', 'stock', 'collection_id', 'last_updated_at',
+        collection_name=F('collection__name'),
+    )
+    keys = ['id' if field == 'pk' else field for field in ordering]
+    chunk = queryset
+    while True:
+        products = list(chunk[:chunk_size])
+        if not products:
+            return
+        chunk = queryset.filter(keyset_filter(ordering, [products[-1][key] for key in keys]))
+
+        images = defaultdict(list)
+        image_rows = models.ProductImage.objects \
+            .filter(product_id__in=[product['id'] for product in products]) \
+            .values_list('product_id', 'image')
+        for product_id, name in image_rows:
+            if name:
+                url = storage.url(name)
+                images[product_id].append(request.build_absolute_uri(url) if request is not None else url)
+
+        for product in products:
+            product['images'] = images[product['id']]
+            yield {field: product[field] for field in EXPORT_FIELDS}
+
+
+def render_ndjson(rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(row) + '\n'
+
+
+def render_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow([
+            row['last_updated_at'].isoformat() if field == 'last_updated_at'
+            else ' '.join(row['images']) if field == 'images'
+            else row[field]
+            for field in EXPORT_FIELDS
+        ])
+
+
+EXPORT_FORMATS = {
+    'ndjson': (render_ndjson, 'application/x-ndjson'),
+    'csv': (render_csv, 'text/csv'),
+}
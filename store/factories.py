@@ -0,0 +1,58 @@
+from django.utils import timezone
+from .models import User, Customer, Collection, Product, ProductImage, Cart, CartItem, Order, OrderItem
+from .sales import rebuild_sales
+
+
+# Throwaway data for the tests (store/tests.py) and the benchmark commands. The rows are written in bulk,
+# then what the bulk writes skip is repaired: collection counts, cart totals and sales rollups.
+
+def create_catalog(prefix, products, collections=1, images=0, stock=100, description=None):
+    """`(collections, products)`, the products spread over the collections with `images` images each."""
+    collections = [Collection.objects.create(name=f'{prefix} collection {i}', description=description) for i in range(collections)]
+    Product.objects.bulk_create([
+        Product(
+            name=f'{prefix} product {i}', slug=f'{prefix}-product-{i}', description=description,
+            price=f'{10 + i % 1000}.{i % 100:02}', stock=stock, collection=collections[i % len(collections)],
+        )
+        for i in range(products)
+    ])
+    # `bulk_create()` skips the signals that maintain `products_count`.
+    Collection.objects.recount_products([collection.pk for collection in collections])
+    # MySQL doesn't return the primary keys of bulk inserts, so the rows are read back.
+    products = list(Product.objects.filter(slug__startswith=f'{prefix}-product-').order_by('pk'))
+    ProductImage.objects.bulk_create([
+        ProductImage(product=product, image=f'store/images/products/{prefix}-{product.pk}-{i}.jpg')
+        for product in products for i in range(images)
+    ])
+    return collections, products
+
+
+def create_carts(count, get_lines):
+    """`count` carts, holding the `(product, quantity)` lines `get_lines(index)` returns for each."""
+    carts = Cart.objects.bulk_create([Cart() for _ in range(count)])
+    CartItem.objects.bulk_create([
+        CartItem(cart=cart, product=product, quantity=quantity)
+        for index, cart in enumerate(carts) for product, quantity in get_lines(index)
+    ])
+    # `bulk_create()` bypasses the cart item paths that maintain the totals.
+    Cart.objects.filter(pk__in=[cart.pk for cart in carts]).refresh_totals()
+    return carts
+
+
+def create_customers(prefix, count):
+    """`count` users who can't sign in, with their customers."""
+    User.objects.bulk_create([User(username=f'{prefix}-{i}', email=f'{prefix}-{i}@example.com', password='!') for i in range(count)])
+    users = list(User.objects.filter(username__startswith=f'{prefix}-'))
+    Customer.objects.bulk_create([Customer(user=user) for user in users])
+    return list(Customer.objects.filter(user__in=users))
+
+
+def create_orders(customer, products, count):
+    """`count` orders of one unit of each of `products`, placed today, with their sales rollups."""
+    orders = [Order.objects.create(customer=customer, cost=sum(product.price for product in products)) for _ in range(count)]
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=product, unit_price=product.price, quantity=1) for order in orders for product in products
+    ])
+    today = timezone.localdate()
+    list(rebuild_sales(today, today))
+    return orders
@@ -0,0 +1,228 @@
+from collections import defaultdict
+from operator import itemgetter
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from rest_framework.generics import get_object_or_404
+from rest_framework.response import Response
+from .images import get_requested_variant, select_image
+from .instrumentation import timed_serializer
+from .serializers import ProductSerializer
+from . import models
+
+
+def fast_serializers_enabled():
+    return getattr(settings, 'STORE_FAST_READ_SERIALIZERS', False)
+
+
+class ValuesSerializer:
+    """
+    Read-only serializer that builds payloads straight from `.values()` rows, skipping the
+    `ModelSerializer` field graph. Each subclass renders exactly what its `ModelSerializer`
+    counterpart renders, key order included, so the JSON output is byte-identical.
+
+    `fields` maps every output key to the `.values()` lookup it is read from, in output order;
+    `get_fields()` may render fewer of them.
+    """
+    fields = {}
+
+    def __init__(self, request=None):
+        self.request = request
+        fields = self.get_fields()
+        self.keys = tuple(fields)
+        self.lookups = tuple(fields.values())
+        # the accessor is compiled once and returns a tuple even for a single field.
+        if len(self.lookups) > 1:
+            self.getter = itemgetter(*self.lookups)
+        else:
+            self.getter = (lambda row: (row[self.lookups[0]],)) if self.lookups else (lambda row: ())
+
+    def get_fields(self):
+        return self.fields
+
+    def get_rows(self, queryset):
+        # the ordering fields and the primary key are selected too, so the keyset paginator
+        # can read the position of a row and the related rows can be attached to it.
+        ordering = [field.lstrip('-') for field in queryset.query.order_by or queryset.model._meta.ordering]
+        extra = [field for field in [*ordering, queryset.model._meta.pk.name] if field not in self.lookups and field != 'pk']
+        return queryset.prefetch_related(None).values(*self.lookups, *dict.fromkeys(extra))
+
+    def build(self, row):
+        return dict(zip(self.keys, self.getter(row)))
+
+    @timed_serializer
+    def serialize(self, rows):
+        return [self.build(row) for row in rows]
+
+    @timed_serializer
+    async def aserialize(self, rows):
+        """`serialize` for async views; subclasses reading related rows fetch them with the async ORM."""
+        return self.serialize(rows)
+
+
+class ProductValuesSerializer(ValuesSerializer):
+    """`ProductSerializer`, `?fields=` and `?expand=` included."""
+    fields = {
+        'id': 'id',
+        'name': 'name',
+        'slug': 'slug',
+        'description': 'description',
+        'price': 'price',
+        'stock': 'stock',
+        'collection': 'collection_id',
+    }
+
+    def __init__(self, request=None):
+        self.fieldset = ProductSerializer.get_fieldset(request)
+        super().__init__(request)
+
+    def get_fields(self):
+        if self.fieldset is None:
+            return self.fields
+        return {key: lookup for key, lookup in self.fields.items() if key in self.fieldset}
+
+    def includes(self, field):
+        return field == 'images' if self.fieldset is None else field in self.fieldset
+
+    def expands(self, relation):
+        return self.fieldset is None or self.fieldset.expands(relation)
+
+    @timed_serializer
+    def serialize(self, rows):
+        rows = list(rows)
+        ids = [row['id'] for row in rows]
+        return self.attach_images(super().serialize(rows), ids, *self.get_image_rows(ids))
+
+    @timed_serializer
+    async def aserialize(self, rows):
+        ids = [row['id'] for row in rows]
+        images, first_images = self.get_image_rows(ids)
+        images = [row async for row in images] if images is not None else None
+        first_images = [row async for row in first_images] if first_images is not None else None
+        return self.attach_images(super().serialize(rows), ids, images, first_images)
+
+    def get_image_rows(self, ids):
+        """The rows of the images and of the first images of the products `ids`, None for those not asked for."""
+        images = first_images = None
+        queryset = models.ProductImage.objects.filter(product_id__in=ids)
+        if ids and self.includes('images'):
+            # `(product_id, id)` alone for the collapsed images.
+            images = queryset.values_list('product_id', 'id', *(('image', 'derivatives') if self.expands('images') else ()))
+        if ids and self.includes('image'):
+            first_images = queryset \
+                .annotate(position=Window(RowNumber(), partition_by=F('product_id'), order_by=F('pk').asc())) \
+                .filter(position=1) \
+                .values_list('product_id', 'id', 'image', 'derivatives')
+        return images, first_images
+
+    def attach_images(self, products, ids, image_rows, first_image_rows):
+        storage = models.ProductImage._meta.get_field('image').storage
+        variant = get_requested_variant(self.request)
+        if image_rows is not None:
+            images = defaultdict(list)
+            for product_id, image_id, *image in image_rows:
+                images[product_id].append(self.build_image(storage, variant, image_id, *image) if image else image_id)
+            for product, product_id in zip(products, ids):
+                product['images'] = images[product_id]
+        if first_image_rows is not None:
+            first_images = {product_id: self.build_image(storage, variant, *image) for product_id, *image in first_image_rows}
+            for product, product_id in zip(products, ids):
+                product['image'] = first_images.get(product_id)
+        return products
+
+    def build_image(self, storage, variant, image_id, name, derivatives):
+        return {'id': image_id, 'image': self.get_url(storage, select_image(name, derivatives, variant))}
+
+    def get_url(self, storage, name):
+        if not name:
+            return None
+        url = storage.url(name)
+        return self.request.build_absolute_uri(url) if self.request is not None else url
+
+
+class CollectionValuesSerializer(ValuesSerializer):
+    fields = {
+        'id': 'id',
+        'name': 'name',
+        'description': 'description',
+        'products_count': 'products_count',
+    }
+
+
+class CartItemValuesSerializer(ValuesSerializer):
+    fields = {
+        'id': 'id',
+        'product_id': 'product_id',
+        'product_name': 'product__name',
+        'product_price': 'product__price',
+        'quantity': 'quantity',
+    }
+
+    def build(self, row):
+        item_id, product_id, name, price, quantity = self.getter(row)
+        return {
+            'id': item_id,
+            'product': {'id': product_id, 'name': name, 'price': price},
+            'quantity': quantity,
+            'total_price': price * quantity,
+        }
+
+
+class CartValuesSerializer(ValuesSerializer):
+    fields = {
+        'id': 'id',
+        'total_price': 'subtotal',
+        'items_count': 'items_count',
+    }
+
+    @timed_serializer
+    def serialize(self, rows):
+        carts = super().serialize(rows)
+        return self.attach_items(carts, self.get_item_rows(carts) if carts else [])
+
+    @timed_serializer
+    async def aserialize(self, rows):
+        carts = super().serialize(rows)
+        return self.attach_items(carts, [row async for row in self.get_item_rows(carts)] if carts else [])
+
+    def get_item_rows(self, carts):
+        return models.CartItem.objects \
+            .filter(cart_id__in=[cart['id'] for cart in carts]) \
+            .values('cart_id', *CartItemValuesSerializer.fields.values())
+
+    def attach_items(self, carts, item_rows):
+        item_serializer = CartItemValuesSerializer(self.request)
+        items = defaultdict(list)
+        for row in item_rows:
+            items[row['cart_id']].append(item_serializer.build(row))
+        return [
+            {'id': str(cart['id']), 'items': items[cart['id']], 'total_price': cart['total_price'], 'items_count': cart['items_count']}
+            for cart in carts
+        ]
+
+
+class FastReadMixin:
+    """
+    Serve `list` and `retrieve` through `values_serializer_class` when `STORE_FAST_READ_SERIALIZERS` is on.
+    Writes, and reads while the setting is off, go through the regular serializers.
+    """
+    values_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        if not fast_serializers_enabled():
+            return super().list(request, *args, **kwargs)
+        serializer = self.values_serializer_class(request)
+        rows = serializer.get_rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(serializer.serialize(page))
+        return Response(serializer.serialize(rows))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not fast_serializers_enabled():
+            return super().retrieve(request, *args, **kwargs)
+        serializer = self.values_serializer_class(request)
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        rows = serializer.get_rows(self.filter_queryset(self.get_queryset()))
+        row = get_object_or_404(rows, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return Response(serializer.serialize([row])[0])
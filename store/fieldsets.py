@@ -0,0 +1,105 @@
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+
+class Fieldset:
+    """
+    The fields (`?fields=a,b`) and expanded relations (`?expand=items.product`) a read asks for.
+
+    `fields` are top-level field names, every non-optional field by default. `expand` are the relation
+    paths rendered as nested objects, a path expanding its prefixes too; the relations left out of it are
+    rendered as primary keys. Without `?expand=` every relation is expanded, as without a fieldset.
+    """
+    def __init__(self, fields, expand):
+        self.fields = fields
+        self.expand = expand
+
+    def __contains__(self, field):
+        return field in self.fields
+
+    def expands(self, path):
+        return path in self.expand
+
+    def only(self, queryset):
+        """`queryset` loading only the columns of the requested fields, and those it's ordered by."""
+        model = queryset.model
+        columns = {field.name for field in model._meta.concrete_fields}
+        ordering = [field.lstrip('-') for field in queryset.query.order_by or model._meta.ordering]
+        return queryset.only(*[name for name in dict.fromkeys([*self.fields, *ordering]) if name in columns])
+
+
+def split_names(value):
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def get_fieldset(request, fields, expandable=(), optional_fields=()):
+    """
+    The `Fieldset` a safe request asks for among `fields` and `optional_fields` (only rendered when named),
+    with the `expandable` relation paths. None for a write, or a read naming neither parameter.
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    # a plain Django request too, e.g. one a serializer is given outside a view.
+    params = getattr(request, 'query_params', request.GET)
+    if 'fields' not in params and 'expand' not in params:
+        return None
+
+    known = [*fields, *optional_fields]
+    requested = split_names(params['fields']) if 'fields' in params else fields
+    if not requested:
+        raise ValidationError({'fields': ['Name at least one field.']})
+    if unknown := [name for name in requested if name not in known]:
+        raise ValidationError({'fields': [f'Unknown fields {", ".join(unknown)}, choose among {", ".join(known)}.']})
+
+    if 'expand' not in params:
+        return Fieldset([name for name in known if name in requested], frozenset(expandable))
+    expand = set()
+    for path in split_names(params['expand']):
+        if path not in expandable:
+            raise ValidationError({'expand': [f'{path} can not be expanded, choose among {", ".join(expandable)}.']})
+        parts = path.split('.')
+        expand.update('.'.join(parts[:length]) for length in range(1, len(parts) + 1))
+    return Fieldset([name for name in known if name in requested], frozenset(expand))
+
+
+class SparseFieldsetMixin:
+    """
+    Render the fields of the request's `Fieldset` alone, and the relations it doesn't expand as primary keys.
+
+    The root serializer declares the `expandable` relation paths and the `optional_fields`; the nested
+    serializers with the mixin collapse their relations by their path from the root. The viewset is
+    expected to load only what the fieldset renders (see `Fieldset.only()`).
+    """
+    expandable = ()
+    optional_fields = ()
+
+    @classmethod
+    def get_fieldset(cls, request):
+        fields = [name for name in cls.Meta.fields if name not in cls.optional_fields]
+        return get_fieldset(request, fields, cls.expandable, cls.optional_fields)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        path, root = [], self
+        while root.parent is not None:
+            if root.field_name:
+                path.insert(0, root.field_name)
+            root = root.parent
+        if isinstance(root, serializers.ListSerializer):
+            root = root.child
+        if not isinstance(root, SparseFieldsetMixin):
+            return fields
+
+        fieldset = type(root).get_fieldset(root.context.get('request'))
+        if not path:
+            requested = fieldset.fields if fieldset is not None else [name for name in fields if name not in self.optional_fields]
+            fields = {name: field for name, field in fields.items() if name in requested}
+        if fieldset is None:
+            return fields
+        for name, field in fields.items():
+            relation = '.'.join([*path, name])
+            if relation in root.expandable and not fieldset.expands(relation):
+                many = isinstance(field, serializers.ListSerializer)
+                fields[name] = serializers.PrimaryKeyRelatedField(many=many, read_only=True, source=field.source)
+        return fields
@@ -0,0 +1,184 @@
+import logging
+import multiprocessing
+import posixpath
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from .cache import catalog_cache
+from .imaging import render_derivatives
+from . import models
+
+
+logger = logging.getLogger(__name__)
+
+ORIGINAL_SIZE = 'original'
+
+
+class ImageDerivativePipeline:
+    """
+    Render resized, re-encoded copies (derivatives) of product images in a process pool.
+
+    Uploads are `schedule()`d once their transaction commits; the rendering runs in up to `max_workers`
+    spawned processes, so it neither blocks the request nor competes with it for the GIL, and the
+    derivatives are saved next to the original and recorded in `ProductImage.derivatives` as
+    `{size: {format: storage name}}`. The pool is per process and created on first use; with no
+    `max_workers` the derivatives are rendered and recorded in-process instead (e.g. in the tests).
+    """
+    def __init__(self, sizes, formats, quality, max_workers):
+        self.sizes = sizes
+        self.formats = formats
+        self.quality = quality
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        options = getattr(settings, 'STORE_IMAGE_DERIVATIVES', {})
+        return cls(
+            sizes=options.get('SIZES', {'thumbnail': 150, 'medium': 600, 'large': 1200}),
+            formats=options.get('FORMATS', ['jpeg', 'webp']),
+            quality=options.get('QUALITY', 80),
+            max_workers=options.get('MAX_WORKERS', 2),
+        )
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawned, a forked worker would inherit the server's threads and database connections.
+                self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def schedule(self, image):
+        """Render the derivatives of `image` in the background once the current transaction commits."""
+        image_id, name = image.pk, image.image.name
+        transaction.on_commit(lambda: self.render(image_id, name))
+
+    def render(self, image_id, name):
+        future = self.submit(image_id, name)
+        if self.max_workers:
+            future.add_done_callback(lambda future: self.record_in_background(image_id, name, future))
+            return
+        try:
+            self.record(image_id, name, future.result())
+        except Exception:
+            logger.exception('Could not render the derivatives of product image %s (%s).', image_id, name)
+
+    def submit(self, image_id, name):
+        storage = models.ProductImage._meta.get_field('image').storage
+        try:
+            # the workers read local files themselves, only remote storages are read here.
+            source = storage.path(name)
+        except NotImplementedError:
+            with storage.open(name) as file:
+                source = file.read()
+        if not self.max_workers:
+            future = Future()
+            try:
+                future.set_result(render_derivatives(source, self.sizes, self.formats, self.quality))
+            except Exception as error:
+                future.set_exception(error)
+            return future
+        try:
+            return self.executor.submit(render_derivatives, source, self.sizes, self.formats, self.quality)
+        except BrokenProcessPool:
+            # a worker died (e.g. killed for its memory use), which leaves the pool unusable, so it's replaced.
+            with self._lock:
+                self._executor = None
+            return self.executor.submit(render_derivatives, source, self.sizes, self.formats, self.quality)
+
+    def record_in_background(self, image_id, name, future):
+        # runs in the pool's result thread, which has a database connection of its own.
+        try:
+            self.record(image_id, name, future.result())
+        except Exception:
+            logger.exception('Could not render the derivatives of product image %s (%s).', image_id, name)
+        finally:
+            connections.close_all()
+
+    def record(self, image_id, name, rendered):
+        """Save the `rendered` derivatives of `name` and record them, unless the image was replaced meanwhile."""
+        storage = models.ProductImage._meta.get_field('image').storage
+        stem = posixpath.splitext(posixpath.basename(name))[0]
+        directory = posixpath.join(posixpath.dirname(name), 'derivatives')
+        derivatives = {
+            size: {
+                fmt: storage.save(posixpath.join(directory, f'{stem}-{size}.{extension}'), ContentFile(content))
+                for fmt, (extension, content) in encoded.items()
+            }
+            for size, encoded in rendered.items()
+        }
+
+        with transaction.atomic():
+            current = models.ProductImage.objects.select_for_update() \
+                .filter(pk=image_id, image=name) \
+                .values_list('product_id', 'derivatives') \
+                .first()
+            if current is not None:
+                models.ProductImage.objects.filter(pk=image_id).update(derivatives=derivatives)
+                models.Product.objects.filter(pk=current[0]).update(last_updated_at=timezone.now())
+        if current is None:
+            delete_derivatives(derivatives)
+            return False
+
+        product_id, previous = current
+        # a backfill re-rendering the image leaves the previous files behind otherwise.
+        delete_derivatives(previous)
+        if product_id is not None:
+            catalog_cache.bump(f'product:{product_id}', 'product-list')
+        return True
+
+    def process(self, images):
+        """Render and record the derivatives of `images` in the pool, waiting for them. Return how many were recorded."""
+        futures = [(image_id, name, self.submit(image_id, name)) for image_id, name in images]
+        recorded = 0
+        for image_id, name, future in futures:
+            try:
+                recorded += self.record(image_id, name, future.result())
+            except Exception:
+                logger.exception('Could not render the derivatives of product image %s (%s).', image_id, name)
+        return recorded
+
+
+def delete_derivatives(derivatives):
+    storage = models.ProductImage._meta.get_field('image').storage
+    for names in derivatives.values():
+        for name in names.values():
+            storage.delete(name)
+
+
+def get_requested_variant(request):
+    """
+    Read the `?size=` (one of the derivative sizes, or `original`) and `?image_format=` query parameters
+    selecting which file the product image URLs point at. Return `(size, format)`, or None for the original.
+    """
+    if request is None:
+        return None
+    size = request.GET.get('size', ORIGINAL_SIZE)
+    if size == ORIGINAL_SIZE:
+        return None
+    pipeline = derivative_pipeline
+    if size not in pipeline.sizes:
+        raise ValidationError({'size': f'Must be one of: {", ".join([ORIGINAL_SIZE, *pipeline.sizes])}.'})
+    # `format` is taken by DRF's renderer selection.
+    fmt = request.GET.get('image_format', pipeline.formats[0])
+    if fmt not in pipeline.formats:
+        raise ValidationError({'image_format': f'Must be one of: {", ".join(pipeline.formats)}.'})
+    return size, fmt
+
+
+def select_image(name, derivatives, variant):
+    """The storage name of the requested variant of an image, the original until its derivatives are rendered."""
+    if variant is None or not name:
+        return name
+    size, fmt = variant
+    return derivatives.get(size, {}).get(fmt, name)
+
+
+derivative_pipeline = ImageDerivativePipeline.from_settings()
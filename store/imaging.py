@@ -0,0 +1,48 @@
+"""
+Image rendering run in the worker processes of `store.images.ImageDerivativePipeline`.
+
+This module only depends on Pillow: the workers are spawned, not forked, and unpickling
+`render_derivatives` must not import Django or the project settings.
+"""
+from io import BytesIO
+from PIL import Image, ImageOps
+
+
+# Pillow's encoder names and the extensions their output is saved under.
+FORMATS = {
+    'jpeg': ('JPEG', 'jpg'),
+    'png': ('PNG', 'png'),
+    'webp': ('WEBP', 'webp'),
+}
+
+
+def render_derivatives(source, sizes, formats, quality):
+    """
+    Render `source` (a file path or the bytes of the image) fitted in each bounding box of
+    `sizes` ({size name: pixels}) and encoded in each of `formats`.
+    Return `{size name: {format: (extension, bytes)}}`. An image smaller than a box isn't enlarged.
+    """
+    with Image.open(source if isinstance(source, str) else BytesIO(source)) as original:
+        original.draft('RGB', (max(sizes.values()),) * 2)
+        image = ImageOps.exif_transpose(original)
+        has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    rendered = {}
+    # largest box first, each smaller one is resized from the previous result instead of the original.
+    for name, pixels in sorted(sizes.items(), key=lambda item: -item[1]):
+        image = image.copy()
+        image.thumbnail((pixels, pixels), Image.Resampling.LANCZOS)
+        rendered[name] = {fmt: encode(image, fmt, quality, has_alpha) for fmt in formats}
+    return rendered
+
+
+def encode(image, fmt, quality, has_alpha):
+    # JPEG has no alpha channel, transparent images are encoded as PNG instead.
+    if fmt == 'jpeg' and has_alpha:
+        fmt = 'png'
+    encoder, extension = FORMATS[fmt]
+    buffer = BytesIO()
+    options = {'optimize': True} if encoder == 'PNG' else {'quality': quality}
+    image.save(buffer, encoder, **options)
+    return extension, buffer.getvalue()
@@ -0,0 +1,312 @@
+import csv
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from itertools import islice
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX, identify_hasher
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction, IntegrityError
+from django.db.models import Q
+from django.utils import timezone
+from .cache import catalog_cache
+from .search import product_search
+from . import models
+
+
+IMPORT_FIELDS = ['name', 'slug', 'description', 'price', 'stock']
+USER_IMPORT_FIELDS = ['username', 'email', 'first_name', 'last_name']
+CUSTOMER_IMPORT_FIELDS = ['phone', 'address']
+
+
+def read_csv(stream):
+    for line, row in enumerate(csv.DictReader(stream), start=2):
+        yield line, row
+
+
+def read_ndjson(stream):
+    for line, text in enumerate(stream, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError as error:
+            row = error
+        yield line, row
+
+
+READERS = {
+    'csv': read_csv,
+    'ndjson': read_ndjson,
+}
+
+
+class Importer(ABC):
+    """
+    Import rows from an iterable of `(line, row)` pairs, one chunk of `chunk_size` rows at a time.
+    Subclasses implement `import_chunk()`; rows that fail validation are reported with their
+    line number instead of aborting the load.
+    """
+    max_reported_errors = 1000
+
+    def __init__(self, chunk_size=1000):
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self.imported = 0
+        self.rejected = 0
+        self.errors = []
+        self.elapsed = 0
+
+    def run(self, rows):
+        started = time.perf_counter()
+        rows = iter(rows)
+        while chunk := list(islice(rows, self.chunk_size)):
+            self.rows += len(chunk)
+            self.import_chunk(chunk)
+        self.elapsed = time.perf_counter() - started
+        return self.report()
+
+    def report(self):
+        return {
+            'rows': self.rows,
+            'imported': self.imported,
+            'rejected': self.rejected,
+            'seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows / self.elapsed, 1) if self.elapsed else None,
+            'errors': self.errors,
+        }
+
+    def reject(self, line, errors):
+        self.rejected += 1
+        if len(self.errors) < self.max_reported_errors:
+            self.errors.append({'line': line, 'errors': errors})
+
+    @abstractmethod
+    def import_chunk(self, chunk):
+        """Import the `(line, row)` pairs of `chunk`, counting them as imported or rejected."""
+
+    def clean_field(self, field, value):
+        # the validators are run one by one as `validate_product_price` raises a dict-style error,
+        # which `Field.clean()` can't collect.
+        value = field.to_python(value)
+        field.validate(value, None)
+        for validator in field.validators:
+            validator(value)
+        return value
+
+
+class ProductImporter(Importer):
+    """
+    Upsert products by `slug`.
+
+    Each row is validated with the rules of the `Product` model fields (`validate_product_price`
+    included). A chunk costs one query to resolve its collection names, one to find the products it replaces,
+    one upsert, one update of the collection counts and, when prices changed, one repricing of the carts,
+    whatever its size.
+    """
+    def __init__(self, chunk_size=1000):
+        super().__init__(chunk_size)
+        self.fields = {name: models.Product._meta.get_field(name) for name in IMPORT_FIELDS}
+
+    def import_chunk(self, chunk):
+        names = {row.get('collection') for _, row in chunk if isinstance(row, dict) and isinstance(row.get('collection'), str)}
+        collection_ids = {}
+        # collection names aren't unique, the oldest collection wins.
+        for name, collection_id in models.Collection.objects.filter(name__in=names).order_by('-id').values_list('name', 'id'):
+            collection_ids[name] = collection_id
+
+        products = {}
+        for line, row in chunk:
+            product, errors = self.build_product(row, collection_ids)
+            if not errors and product.slug in products:
+                errors = {'slug': ['Duplicate slug earlier in the same chunk.']}
+            if errors:
+                self.reject(line, errors)
+                continue
+            products[product.slug] = product
+
+        if not products:
+            return
+        self.upsert(list(products.values()))
+        self.imported += len(products)
+
+    def build_product(self, row, collection_ids):
+        if not isinstance(row, dict):
+            return None, {'row': [str(row) if isinstance(row, Exception) else 'Each row must be an object.']}
+
+        values, errors = {}, {}
+        for name, field in self.fields.items():
+            value = row.get(name)
+            if value == '' and field.null:
+                value = None
+            try:
+                values[name] = self.clean_field(field, value)
+            except ValidationError as error:
+                errors[name] = error.messages
+
+        collection_id = collection_ids.get(row.get('collection')) if isinstance(row.get('collection'), str) else None
+        if collection_id is None:
+            errors['collection'] = [f'No collection named {row.get("collection")!r}.']
+        if errors:
+            return None, errors
+        return models.Product(collection_id=collection_id, **values), {}
+
+    def upsert(self, products):
+        # MySQL picks the conflicting unique key itself and refuses an explicit target.
+        unique_fields = ['slug'] if connection.features.supports_update_conflicts_with_target else None
+        now = timezone.now()
+        for product in products:
+            product.last_updated_at = now
+        with transaction.atomic():
+            # the products being replaced, and the collections they may be moving out of.
+            existing = list(
+                models.Product.objects
+                .filter(slug__in=[product.slug for product in products])
+                .values_list('id', 'slug', 'collection_id', 'price')
+            )
+            models.Product.objects.bulk_create(
+                products,
+                update_conflicts=True,
+                unique_fields=unique_fields,
+                update_fields=[*[name for name in IMPORT_FIELDS if name != 'slug'], 'collection', 'last_updated_at'],
+            )
+            # `bulk_create()` skips the model signals, so the new and moved products are counted here.
+            previous_collection_ids = {slug: collection_id for _, slug, collection_id, _ in existing}
+            deltas = Counter()
+            for product in products:
+                previous_collection_id = previous_collection_ids.get(product.slug)
+                if previous_collection_id != product.collection_id:
+                    deltas[product.collection_id] += 1
+                    deltas[previous_collection_id] -= 1
+            models.Collection.objects.adjust_products_count(deltas)
+            # and the carts holding a product whose price changed are repriced.
+            previous_prices = {slug: price for _, slug, _, price in existing}
+            repriced_slugs = [product.slug for product in products if previous_prices.get(product.slug, product.price) != product.price]
+            if repriced_slugs:
+                models.Cart.objects \
+                    .filter(pk__in=models.CartItem.objects.filter(product__slug__in=repriced_slugs).values('cart_id')) \
+                    .refresh_totals()
+
+        # `bulk_create()` skips the signals updating the search index as well.
+        slugs = [product.slug for product in products]
+        transaction.on_commit(lambda: product_search.refresh(models.Product.objects.filter(slug__in=slugs)))
+        # and the cached payloads are invalidated here.
+        collection_ids = {product.collection_id for product in products} | {collection_id for _, _, collection_id, _ in existing}
+        catalog_cache.bump_on_commit(
+            *[f'product:{product_id}' for product_id, _, _, _ in existing], 'product-list',
+            *[f'collection:{collection_id}' for collection_id in collection_ids], 'collection-list',
+        )
+
+
+class UserImporter(Importer):
+    """
+    Create users and their `Customer` from rows whose `password` is already hashed (by one of the
+    `PASSWORD_HASHERS`, or unusable with the `!` prefix), so nothing is hashed during the import.
+
+    Usernames and emails already taken are rejected, existing accounts are never overwritten.
+    A chunk costs one query to find the taken usernames and emails, then one insert of the users
+    (plus one to read their ids back where the database doesn't return them) and one of the customers
+    in a single transaction. `bulk_create()` sends no `post_save`, so `create_cutomer_for_new_user`
+    doesn't run and the customers are created here instead.
+    """
+    def __init__(self, chunk_size=1000):
+        super().__init__(chunk_size)
+        self.user_fields = {name: models.User._meta.get_field(name) for name in USER_IMPORT_FIELDS}
+        self.customer_fields = {name: models.Customer._meta.get_field(name) for name in CUSTOMER_IMPORT_FIELDS}
+
+    def import_chunk(self, chunk):
+        accounts = []
+        usernames, emails = set(), set()
+        for line, row in chunk:
+            user, customer, errors = self.build_account(row)
+            if not errors and user.username in usernames:
+                errors = {'username': ['Duplicate username earlier in the same chunk.']}
+            elif not errors and user.email in emails:
+                errors = {'email': ['Duplicate email earlier in the same chunk.']}
+            if errors:
+                self.reject(line, errors)
+                continue
+            usernames.add(user.username)
+            emails.add(user.email)
+            accounts.append((line, user, customer))
+        if not accounts:
+            return
+
+        taken_usernames, taken_emails = set(), set()
+        taken = models.User.objects.filter(Q(username__in=usernames) | Q(email__in=emails)).values_list('username', 'email')
+        for username, email in taken:
+            taken_usernames.add(username)
+            taken_emails.add(email)
+        new_accounts = []
+        for line, user, customer in accounts:
+            if user.username in taken_usernames:
+                self.reject(line, {'username': ['A user with that username already exists.']})
+            elif user.email in taken_emails:
+                self.reject(line, {'email': ['A user with that email already exists.']})
+            else:
+                new_accounts.append((line, user, customer))
+        if not new_accounts:
+            return
+
+        try:
+            with transaction.atomic():
+                self.create(new_accounts)
+        except IntegrityError as error:
+            # a sign-up took one of the usernames or emails since they were checked, the chunk is rolled back.
+            for line, _, _ in new_accounts:
+                self.reject(line, {'row': [f'Not imported, its chunk conflicted with a concurrent sign-up: {error}']})
+            return
+        self.imported += len(new_accounts)
+
+    def create(self, accounts):
+        users = models.User.objects.bulk_create([user for _, user, _ in accounts])
+        if any(user.pk is None for user in users):
+            # MySQL doesn't return the primary keys of bulk inserts, so they're read back.
+            ids = dict(models.User.objects.filter(username__in=[user.username for user in users]).values_list('username', 'id'))
+            for user in users:
+                user.pk = ids[user.username]
+        for _, user, customer in accounts:
+            customer.user_id = user.pk
+        models.Customer.objects.bulk_create([customer for _, _, customer in accounts])
+
+    def build_account(self, row):
+        if not isinstance(row, dict):
+            return None, None, {'row': [str(row) if isinstance(row, Exception) else 'Each row must be an object.']}
+
+        values, errors = {}, {}
+        for name, field in self.user_fields.items():
+            value = row.get(name)
+            if value is None and field.blank:
+                value = ''
+            try:
+                values[name] = self.clean_field(field, value)
+            except ValidationError as error:
+                errors[name] = error.messages
+
+        password = row.get('password')
+        if not self.is_password_hash(password):
+            errors['password'] = ['Must be a hash made by one of the PASSWORD_HASHERS, raw passwords are not accepted.']
+
+        # the customer details may be missing, as for the customers created at sign-up.
+        customer_values = {}
+        for name, field in self.customer_fields.items():
+            value = row.get(name) or ''
+            try:
+                customer_values[name] = self.clean_field(field, value) if value else ''
+            except ValidationError as error:
+                errors[name] = error.messages
+
+        if errors:
+            return None, None, errors
+        return models.User(password=password, **values), models.Customer(**customer_values), {}
+
+    def is_password_hash(self, password):
+        if not isinstance(password, str) or not password:
+            return False
+        if password.startswith(UNUSABLE_PASSWORD_PREFIX):
+            return True
+        try:
+            identify_hasher(password)
+        except ValueError:
+            return False
+        return True
@@ -0,0 +1,223 @@
+import cProfile
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, suppress
+from contextvars import ContextVar
+from functools import wraps
+from uuid import uuid4
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from .metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+current_timings = ContextVar('current_timings', default=None)
+
+# one profiler per thread at a time, cProfile hooks the whole thread.
+_profiling = threading.local()
+
+
+class RequestTimings:
+    """
+    Where the time of one request went: the SQL statements run (count and time), the serializers
+    (`to_representation()` of the timed serializers, by class) and the rendering of the response.
+    The phases overlap: the queries a serializer runs count as serializer time too.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total = None
+        self.queries = 0
+        self.db = 0.0
+        self.phases = defaultdict(float)
+        self.serializers = defaultdict(float)
+        self._depth = defaultdict(int)
+
+    @contextmanager
+    def measure(self, phase, name=None):
+        # only the outermost measure of a phase counts, a nested serializer is part of its parent.
+        self._depth[phase] += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._depth[phase] -= 1
+            if not self._depth[phase]:
+                elapsed = time.perf_counter() - started
+                self.phases[phase] += elapsed
+                if name is not None:
+                    self.serializers[name] += elapsed
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+
+    def server_timing(self):
+        metrics = [f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries"']
+        metrics += [f'{phase};dur={seconds * 1000:.1f}' for phase, seconds in self.phases.items()]
+        metrics.append(f'total;dur={self.total * 1000:.1f}')
+        return ', '.join(metrics)
+
+    def as_dict(self):
+        return {
+            'total_ms': round(self.total * 1000, 2),
+            'db_ms': round(self.db * 1000, 2),
+            'db_queries': self.queries,
+            **{f'{phase}_ms': round(seconds * 1000, 2) for phase, seconds in self.phases.items()},
+            'serializers_ms': {name: round(seconds * 1000, 2) for name, seconds in self.serializers.items()},
+        }
+
+
+@contextmanager
+def measure(phase, name=None):
+    """Count the block as `phase` time of the current request, if it's instrumented."""
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    with timings.measure(phase, name):
+        yield
+
+
+def record_query(execute, sql, params, many, context):
+    """A database execute wrapper counting the statements of the current request and their time."""
+    timings = current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries += 1
+        timings.db += time.perf_counter() - started
+
+
+def timed_serializer(method):
+    """Count a `serialize()` / `aserialize()` method of a `.values()` serializer as serializer time."""
+    if iscoroutinefunction(method):
+        @wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            with measure('serialize', type(self).__name__):
+                return await method(self, *args, **kwargs)
+    else:
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with measure('serialize', type(self).__name__):
+                return method(self, *args, **kwargs)
+    return wrapper
+
+
+class TimedSerializerMixin:
+    """Count the `to_representation()` of a DRF serializer as serializer time, under the serializer's class name."""
+    def to_representation(self, instance):
+        with measure('serialize', type(self).__name__):
+            return super().to_representation(instance)
+
+
+class InstrumentationMiddleware:
+    """
+    Time every request and report it as a `Server-Timing` header, a JSON log line on the
+    `store.instrumentation` logger (STORE_INSTRUMENTATION['LOG']) and in the route's metrics (see store/metrics.py), keyed by
+    route name (see store/urls.py).
+
+    In profiling mode (STORE_INSTRUMENTATION['PROFILE']), a sample of the synchronous requests runs
+    under cProfile and the stats of those slower than SLOW_MS are dumped to `DIRECTORY/<route>/`.
+    Goes first in MIDDLEWARE, so the total covers the other middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        options = getattr(settings, 'STORE_INSTRUMENTATION', {})
+        self.server_timing = options.get('SERVER_TIMING', True)
+        self.log = options.get('LOG', False)
+        self.metrics = getattr(settings, 'STORE_METRICS', {}).get('ENABLED', True)
+        profile = options.get('PROFILE') or {}
+        self.sample_rate = profile.get('SAMPLE_RATE', 0)
+        self.slow = profile.get('SLOW_MS', 500) / 1000
+        self.directory = profile.get('DIRECTORY')
+        self.max_files = profile.get('MAX_FILES_PER_ROUTE', 20)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        profile = self.start_profile()
+        try:
+            response = self.get_response(request)
+        finally:
+            if profile is not None:
+                profile.disable()
+                _profiling.active = False
+            current_timings.reset(token)
+        return self.report(request, response, timings, profile)
+
+    async def __acall__(self, request):
+        # not profiled: the event loop thread interleaves the other requests.
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.report(request, response, timings)
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered by the handler after the view, and before this middleware regains control.
+        timings = current_timings.get()
+        if timings is not None:
+            started = time.perf_counter()
+
+            def record_render(rendered):
+                timings.phases['render'] += time.perf_counter() - started
+
+            response.add_post_render_callback(record_render)
+        return response
+
+    def start_profile(self):
+        if not self.sample_rate or not self.directory or getattr(_profiling, 'active', False):
+            return None
+        if random.random() >= self.sample_rate:
+            return None
+        _profiling.active = True
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def report(self, request, response, timings, profile=None):
+        timings.finish()
+        route = request.resolver_match.url_name if request.resolver_match is not None else None
+        if self.metrics:
+            metrics.observe_request(route, request.method, response.status_code, timings.total, timings.queries)
+        if self.server_timing:
+            response['Server-Timing'] = timings.server_timing()
+        if self.log:
+            logger.info(json.dumps({
+                'route': route, 'method': request.method, 'path': request.path, 'status': response.status_code,
+                **timings.as_dict(),
+            }, separators=(',', ':')))
+        if profile is not None and timings.total >= self.slow:
+            self.dump_profile(profile, route or 'unresolved', request.method, timings.total)
+        return response
+
+    def dump_profile(self, profile, route, method, total):
+        directory = os.path.join(self.directory, route)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{method}-{total * 1000:.0f}ms-{uuid4().hex[:8]}.prof')
+        profile.dump_stats(path)
+        logger.warning('Profiled a slow %s %s request (%.0f ms): %s', method, route, total * 1000, path)
+        # only the latest profiles of a route are kept.
+        dumps = sorted((entry for entry in os.scandir(directory) if entry.name.endswith('.prof')), key=lambda entry: entry.stat().st_mtime)
+        for entry in dumps[:-self.max_files]:
+            # another worker may have removed it already.
+            with suppress(FileNotFoundError):
+                os.remove(entry.path)
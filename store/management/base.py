@@ -0,0 +1,40 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from store.imports import READERS
+
+
+class ImportCommand(BaseCommand):
+    """
+    Stream a CSV or NDJSON feed through `importer_class` (see store/imports.py) and report the result.
+    `imported_name` names what a row becomes in the summary, e.g. 'products'.
+    """
+    importer_class = None
+    imported_name = 'rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Path of the feed, or '-' to read it from stdin.")
+        parser.add_argument('--type', choices=list(READERS), help='Feed format, guessed from the file extension by default.')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        feed_type = options['type'] or path.rsplit('.', 1)[-1].lower()
+        if feed_type not in READERS:
+            raise CommandError(f'Can not guess the feed format of {path!r}, use --type.')
+
+        importer = self.importer_class(chunk_size=options['chunk_size'])
+        stream = sys.stdin if path == '-' else open(path, encoding='utf-8', newline='')
+        try:
+            report = importer.run(READERS[feed_type](stream))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for error in report['errors']:
+            self.stderr.write(f'line {error["line"]}: {error["errors"]}')
+        if report['rejected'] > len(report['errors']):
+            self.stderr.write(f'... {report["rejected"] - len(report["errors"])} more rejected rows not listed.')
+        self.stdout.write(self.style.SUCCESS(
+            f'{report["imported"]} {self.imported_name} imported, {report["rejected"]} rows rejected, '
+            f'{report["rows"]} rows in {report["seconds"]}s ({report["rows_per_second"]} rows/sec).'
+        ))
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Load the catalog reads of a WSGI and an ASGI deployment of this project with 100-1000 concurrent '
+        'keep-alive clients and compare requests/sec and tail latency. The WSGI deployment is sent the DRF '
+        'endpoints, the ASGI one their async variants under /async/. Start both beforehand, e.g. '
+        '`gunicorn config.wsgi -w 4 --threads 8 -b :8000` and `uvicorn config.asgi:application --workers 4 --port 8001`.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wsgi-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--asgi-url', default='http://127.0.0.1:8001')
+        parser.add_argument('--clients', type=int, nargs='+', default=[100, 250, 500, 1000], help='Concurrency levels.')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds per deployment and concurrency level.')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds before a request counts as failed.')
+
+    def handle(self, *args, **options):
+        deployments = [('wsgi', options['wsgi_url'], ''), ('asgi', options['asgi_url'], '/async')]
+        self.stdout.write(f'{"server":6} {"clients":>7} {"requests":>9} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>7}')
+        for name, base_url, prefix in deployments:
+            paths = asyncio.run(self.discover_paths(base_url, prefix))
+            for clients in options['clients']:
+                latencies, errors, elapsed = asyncio.run(self.load(base_url, paths, clients, options['duration'], options['timeout']))
+                cuts = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else (latencies or [0]) * 99
+                self.stdout.write(
+                    f'{name:6} {clients:>7} {len(latencies):>9} {len(latencies) / elapsed:>8.1f} '
+                    f'{cuts[49]:>8.1f} {cuts[94]:>8.1f} {cuts[98]:>8.1f} {errors:>7}'
+                )
+
+    async def discover_paths(self, base_url, prefix):
+        # one product, one collection and a fresh cart (created through the sync API) to read.
+        connection = await self.connect(base_url)
+        try:
+            responses = []
+            for method, path, body in [
+                ('GET', f'{prefix}/products/?page_size=1', b''),
+                ('GET', f'{prefix}/collections/?page_size=1', b''),
+                ('POST', '/carts/', b'{}'),
+            ]:
+                status, content, keep_alive = await self.request(connection, method, path, body)
+                if status >= 300:
+                    raise CommandError(f'{method} {base_url}{path} responded with {status}.')
+                responses.append(content)
+                if not keep_alive:
+                    connection[1].close()
+                    connection = await self.connect(base_url)
+        finally:
+            connection[1].close()
+        products, collections, cart = json.loads(responses[0])['results'], json.loads(responses[1])['results'], json.loads(responses[2])
+        if not products or not collections:
+            raise CommandError(f'{base_url} has no product or collection to read.')
+        return [
+            f'{prefix}/products/',
+            f'{prefix}/products/{products[0]["id"]}/',
+            f'{prefix}/collections/',
+            f'{prefix}/collections/{collections[0]["id"]}/',
+            f'{prefix}/carts/{cart["id"]}/',
+        ]
+
+    async def load(self, base_url, paths, clients, duration, timeout):
+        latencies = []
+        errors = 0
+        deadline = time.perf_counter() + duration
+
+        async def client(index):
+            nonlocal errors
+            connection = None
+            sent = index
+            while time.perf_counter() < deadline:
+                path = paths[sent % len(paths)]
+                sent += 1
+                started = time.perf_counter()
+                try:
+                    if connection is None:
+                        connection = await asyncio.wait_for(self.connect(base_url), timeout)
+                    status, _, keep_alive = await asyncio.wait_for(self.request(connection, 'GET', path), timeout)
+                except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError, IndexError):
+                    errors += 1
+                    if connection is not None:
+                        connection[1].close()
+                    connection = None
+                    continue
+                if not keep_alive:
+                    connection[1].close()
+                    connection = None
+                if status != 200:
+                    errors += 1
+                    continue
+                latencies.append((time.perf_counter() - started) * 1000)
+            if connection is not None:
+                connection[1].close()
+
+        started = time.perf_counter()
+        await asyncio.gather(*[client(index) for index in range(clients)])
+        return latencies, errors, time.perf_counter() - started
+
+    async def connect(self, base_url):
+        url = urlsplit(base_url)
+        reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+        return reader, writer, url.netloc
+
+    async def request(self, connection, method, path, body=b''):
+        """A minimal HTTP/1.1 exchange on a keep-alive connection, return the status, the body and whether the connection stays open."""
+        reader, writer, host = connection
+        headers = f'{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n'
+        writer.write(headers.encode('latin-1') + body)
+        await writer.drain()
+
+        status = int((await reader.readline()).split()[1])
+        response_headers = {}
+        while (line := await reader.readline()) not in (b'\r\n', b''):
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+        keep_alive = response_headers.get('connection', '').lower() != 'close'
+        if 'content-length' in response_headers:
+            return status, await reader.readexactly(int(response_headers['content-length'])), keep_alive
+        chunks = []
+        while size := int((await reader.readline()).split(b';')[0], 16):
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        await reader.readline()
+        return status, b''.join(chunks), keep_alive
@@ -0,0 +1,66 @@
+import re
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from rest_framework.test import APIClient
+from store.factories import create_catalog, create_carts
+from store.models import User, Product, Order, OrderItem
+
+
+SAVEPOINT_RE = re.compile(r'^\s*(SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b', re.IGNORECASE)
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark POST /orders/ end to end and report p50/p95/p99 latency and queries per checkout '
+        'for carts of different sizes. The data it creates is removed afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, nargs='+', default=[1, 10, 100], help='Cart sizes to benchmark.')
+        parser.add_argument('--iterations', type=int, default=100, help='Checkouts per cart size.')
+        parser.add_argument('--warmup', type=int, default=5, help='Untimed checkouts per cart size.')
+
+    def handle(self, *args, **options):
+        tag = f'bench-{int(time.time())}'
+        (collection,), products = create_catalog(tag, max(options['lines']), stock=10 ** 9)
+        user = User.objects.create_user(username=tag, email=f'{tag}@example.com')
+
+        setup_test_environment()
+        client = APIClient()
+        client.force_authenticate(user)
+        self.stdout.write(f'{"lines":>6} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"queries":>8}')
+        try:
+            for lines in options['lines']:
+                carts = [cart.pk for cart in create_carts(options['warmup'] + options['iterations'], lambda index: [(product, 1) for product in products[:lines]])]
+                for cart_id in carts[:options['warmup']]:
+                    self.checkout(client, cart_id)
+                timings, queries = zip(*[self.checkout(client, cart_id) for cart_id in carts[options['warmup']:]])
+                p50, p95, p99 = self.percentiles(timings)
+                self.stdout.write(f'{lines:>6} {p50:>9.2f} {p95:>9.2f} {p99:>9.2f} {statistics.mean(queries):>8.1f}')
+        finally:
+            teardown_test_environment()
+            orders = Order.objects.filter(customer__user=user)
+            OrderItem.objects.filter(order__in=orders).delete()
+            orders.delete()
+            Product.objects.filter(collection=collection).delete()
+            collection.delete()
+            user.delete()
+
+    def checkout(self, client, cart_id):
+        with CaptureQueriesContext(connection) as recorded:
+            started = time.perf_counter()
+            response = client.post(reverse('order-list'), {'cart_id': str(cart_id)}, format='json')
+            elapsed = (time.perf_counter() - started) * 1000
+        assert response.status_code == 201, response.content
+        queries = [query for query in recorded.captured_queries if not SAVEPOINT_RE.match(query['sql'])]
+        return elapsed, len(queries)
+
+    def percentiles(self, timings):
+        if len(timings) < 2:
+            return timings[0], timings[0], timings[0]
+        cuts = statistics.quantiles(timings, n=100, method='inclusive')
+        return cuts[49], cuts[94], cuts[98]
@@ -0,0 +1,113 @@
+import random
+import resource
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from rest_framework.test import APIClient
+from store.cache import catalog_cache
+from store.models import Collection, Product
+from store.search import product_search
+
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'pa', 'de', 'gu', 'ho', 'ji', 'bu', 'fe']
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark GET /products/search/ against a catalog of synthetic products (1M by default) and report '
+        'p50/p95/p99 latency per kind of query, with the index build time for the in-process index. '
+        'Word frequencies follow a Zipf law, so there are both very common and rare words. '
+        'The products are committed (InnoDB only indexes committed rows) and deleted afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1_000_000)
+        parser.add_argument('--collections', type=int, default=50)
+        parser.add_argument('--vocabulary', type=int, default=20000, help='Distinct words in names and descriptions.')
+        parser.add_argument('--queries', type=int, default=100, help='Searches per kind of query.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        tag = f'bench-search-{int(time.time())}'
+        words = self.make_vocabulary(rng, options['vocabulary'])
+        # Zipf weights, the first words are the most frequent.
+        cumulative_weights = []
+        total = 0
+        for rank in range(1, len(words) + 1):
+            total += 1 / rank
+            cumulative_weights.append(total)
+
+        def text(count):
+            return ' '.join(rng.choices(words, cum_weights=cumulative_weights, k=count))
+
+        collections = [Collection.objects.create(name=f'{tag} {i}') for i in range(options['collections'])]
+        started = time.perf_counter()
+        try:
+            for offset in range(0, options['products'], options['batch_size']):
+                Product.objects.bulk_create([
+                    Product(
+                        name=text(3), slug=f'{tag}-{i}', description=text(12), price=rng.randint(100, 100000) / 100,
+                        stock=rng.choice([0, 1, 10, 100]), collection=rng.choice(collections),
+                    )
+                    for i in range(offset, min(offset + options['batch_size'], options['products']))
+                ])
+            self.stdout.write(f'{options["products"]} products inserted in {time.perf_counter() - started:.1f}s')
+
+            backend = type(product_search).__name__
+            started = time.perf_counter()
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # `bulk_create()` skips the signals updating the search index.
+            product_search.rebuild()
+            self.stdout.write(
+                f'{backend}: index built in {time.perf_counter() - started:.1f}s, '
+                f'max RSS +{(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - max_rss) / 1024:.0f} MB'
+            )
+
+            cases = [
+                ('common word', lambda: {'q': words[rng.randrange(10)]}),
+                ('rare word', lambda: {'q': words[rng.randrange(len(words) // 2, len(words))]}),
+                ('two words', lambda: {'q': f'{words[rng.randrange(10)]} {words[rng.randrange(100, 1000)]}'}),
+                ('word + filters', lambda: {
+                    'q': words[rng.randrange(100)], 'collection': rng.choice(collections).pk,
+                    'min_price': 10, 'max_price': 500, 'in_stock': 'true',
+                }),
+                ('filters only', lambda: {'collection': rng.choice(collections).pk, 'max_price': 50, 'in_stock': 'true'}),
+            ]
+            self.benchmark(cases, options['queries'])
+        finally:
+            products = Product.objects.filter(collection__in=collections)
+            # deleted with a plain DELETE: going through the signals would take one query per product.
+            products._raw_delete(products.db)
+            Collection.objects.filter(pk__in=[collection.pk for collection in collections]).delete()
+            product_search.reset()
+
+    def make_vocabulary(self, rng, size):
+        words = set()
+        while len(words) < size:
+            words.add(''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))))
+        return sorted(words, key=lambda word: rng.random())
+
+    def benchmark(self, cases, queries):
+        setup_test_environment()
+        client = APIClient()
+        url = reverse('product-search')
+        self.stdout.write(f'\n{"query":16} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"avg count":>10}')
+        try:
+            for name, make_params in cases:
+                timings, counts = [], []
+                for _ in range(queries):
+                    params = make_params()
+                    catalog_cache.clear()
+                    started = time.perf_counter()
+                    response = client.get(url, params)
+                    timings.append((time.perf_counter() - started) * 1000)
+                    assert response.status_code == 200, response.content
+                    counts.append(response.json()['count'])
+                cuts = statistics.quantiles(timings, n=100, method='inclusive') if len(timings) > 1 else timings * 99
+                self.stdout.write(f'{name:16} {cuts[49]:>9.2f} {cuts[94]:>9.2f} {cuts[98]:>9.2f} {statistics.mean(counts):>10.0f}')
+        finally:
+            teardown_test_environment()
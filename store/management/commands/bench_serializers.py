@@ -0,0 +1,63 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from store.factories import create_catalog, create_carts
+from store.fast_serializers import ProductValuesSerializer, CollectionValuesSerializer, CartValuesSerializer
+from store.serializers import ProductSerializer, CollectionSerializer, CartSerializer
+from store.views import ProductViewSet, CollectionViewSet, CartViewSet
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the throughput in rows/sec of the `.values()` read serializers and the ModelSerializers '
+        'for products, collections and carts (their output is compared by store.tests.FastSerializerParityTests). '
+        'All the data is created inside a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000, help='Products (and carts) to serialize.')
+        parser.add_argument('--images', type=int, default=3, help='Images per product.')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        try:
+            with transaction.atomic():
+                self.create_fixture(options['rows'], options['images'])
+                self.benchmark(options['repeat'])
+                transaction.set_rollback(True)
+        finally:
+            teardown_test_environment()
+
+    def create_fixture(self, rows, images):
+        _, products = create_catalog('bench', rows, collections=10, images=images, description='x' * 200)
+        create_carts(rows // 10 or 1, lambda index: [(products[(index * 7 + j) % len(products)], j + 1) for j in range(5)])
+
+    def benchmark(self, repeat):
+        # the request the serializers get from a view.
+        request = Request(APIRequestFactory().get('/'))
+        cases = [
+            ('product', ProductViewSet.queryset, ProductSerializer, ProductValuesSerializer),
+            ('collection', CollectionViewSet.queryset, CollectionSerializer, CollectionValuesSerializer),
+            ('cart', CartViewSet.queryset, CartSerializer, CartValuesSerializer),
+        ]
+        self.stdout.write(f'\n{"resource":12} {"rows":>7} {"serializer rows/s":>18} {"values rows/s":>14} {"speedup":>8}')
+        for name, queryset, serializer_class, values_serializer_class in cases:
+            rows = queryset.count()
+            slow = self.throughput(
+                rows, repeat, lambda: serializer_class(queryset.all(), many=True, context={'request': request}).data
+            )
+            values_serializer = values_serializer_class(request)
+            fast = self.throughput(rows, repeat, lambda: values_serializer.serialize(values_serializer.get_rows(queryset.all())))
+            self.stdout.write(f'{name:12} {rows:>7} {slow:>18.0f} {fast:>14.0f} {fast / slow:>7.1f}x')
+
+    def throughput(self, rows, repeat, serialize):
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            serialize()
+            best = min(best, time.perf_counter() - started)
+        return rows / best
@@ -0,0 +1,75 @@
+import asyncio
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from store.cache import catalog_cache
+from store.models import User, Collection, Product
+from store.passwords import password_hashing_pool
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure sign-ins/sec and the latency of concurrent catalog reads through the ASGI handler, '
+        'once with the synchronous sign-in (/signin/) and once with the async one (/signin/async/). '
+        'The data it needs is created, then deleted, in the configured database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=200, help='Sign-ins per run.')
+        parser.add_argument('--concurrency', type=int, default=16, help='Sign-ins in flight at once.')
+        parser.add_argument('--readers', type=int, default=4, help='Clients reading the catalog in a loop meanwhile.')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        tag = f'bench-signin-{int(time.time())}'
+        user = User.objects.create_user(username=tag, email=f'{tag}@example.com', password='Bench-pass-123')
+        collection = Collection.objects.create(name=tag)
+        for i in range(20):
+            Product.objects.create(name=f'{tag} product {i}', slug=f'{tag}-product-{i}', price=10, stock=10, collection=collection)
+        try:
+            self.stdout.write(f'{"sign-in":8} {"logins/s":>9} {"reads/s":>8} {"read p50 ms":>12} {"read p95 ms":>12}')
+            for name, route in (('sync', 'sign-in-list'), ('async', 'sign-in-async')):
+                catalog_cache.clear()
+                reads, elapsed = asyncio.run(self.run(reverse(route), user.email, options))
+                cuts = statistics.quantiles(reads, n=100, method='inclusive') if len(reads) > 1 else reads * 99
+                p50, p95 = cuts[49], cuts[94]
+                self.stdout.write(
+                    f'{name:8} {options["logins"] / elapsed:>9.1f} {len(reads) / elapsed:>8.1f} {p50:>12.2f} {p95:>12.2f}'
+                )
+            self.stdout.write(f'\nhashing pool: {password_hashing_pool.metrics()}')
+        finally:
+            Product.objects.filter(collection=collection).delete()
+            collection.delete()
+            user.delete()
+            teardown_test_environment()
+
+    async def run(self, url, email, options):
+        done = asyncio.Event()
+        remaining = iter(range(options['logins']))
+        reads = []
+
+        async def sign_in():
+            client = AsyncClient()
+            for _ in remaining:
+                response = await client.post(url, {'email': email, 'password': 'Bench-pass-123'}, content_type='application/json')
+                assert response.status_code == 201, response.content
+
+        async def read_catalog():
+            client = AsyncClient()
+            urls = [reverse('product-list'), reverse('collection-list')]
+            while not done.is_set():
+                started = time.perf_counter()
+                response = await client.get(urls[len(reads) % len(urls)])
+                assert response.status_code == 200, response.content
+                reads.append((time.perf_counter() - started) * 1000)
+
+        readers = [asyncio.create_task(read_catalog()) for _ in range(options['readers'])]
+        started = time.perf_counter()
+        await asyncio.gather(*[sign_in() for _ in range(options['concurrency'])])
+        elapsed = time.perf_counter() - started
+        done.set()
+        await asyncio.gather(*readers)
+        return reads, elapsed
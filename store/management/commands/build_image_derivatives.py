@@ -0,0 +1,37 @@
+import time
+from django.core.management.base import BaseCommand
+from store.images import derivative_pipeline
+from store.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = (
+        'Render the resized derivatives (STORE_IMAGE_DERIVATIVES) of the product images uploaded before the '
+        'pipeline existed, or of every image with --all (e.g. after changing the sizes). Images are read in '
+        'batches by id and rendered in the process pool; a failed image is logged and skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Re-render images that already have derivatives.')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, help='Size of the process pool, MAX_WORKERS by default.')
+
+    def handle(self, *args, **options):
+        if options['workers']:
+            derivative_pipeline.max_workers = options['workers']
+        queryset = ProductImage.objects.exclude(image='').order_by('pk')
+        if not options['all']:
+            queryset = queryset.filter(derivatives={})
+
+        started = time.perf_counter()
+        last_id, seen, recorded = 0, 0, 0
+        while batch := list(queryset.filter(pk__gt=last_id).values_list('pk', 'image')[:options['batch_size']]):
+            last_id = batch[-1][0]
+            seen += len(batch)
+            recorded += derivative_pipeline.process(batch)
+            self.stdout.write(f'{seen} images rendered...')
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{recorded} of {seen} images rendered in {elapsed:.1f}s'
+            f'{f" ({seen / elapsed:.1f} images/sec)" if seen else ""}, {seen - recorded} failed or replaced meanwhile.'
+        ))
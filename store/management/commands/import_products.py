@@ -0,0 +1,11 @@
+from store.imports import ProductImporter
+from store.management.base import ImportCommand
+
+
+class Command(ImportCommand):
+    help = (
+        'Upsert products by slug from a CSV or NDJSON feed (columns/keys: name, slug, description, price, stock, '
+        'collection). The feed is streamed and imported in chunks; invalid rows are reported and skipped.'
+    )
+    importer_class = ProductImporter
+    imported_name = 'products'
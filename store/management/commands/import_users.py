@@ -0,0 +1,12 @@
+from store.imports import UserImporter
+from store.management.base import ImportCommand
+
+
+class Command(ImportCommand):
+    help = (
+        'Create users and their customers from a CSV or NDJSON feed (columns/keys: username, email, password, '
+        'first_name, last_name, phone, address). Passwords must already be hashed by one of the PASSWORD_HASHERS. '
+        'The feed is streamed and imported in chunks; invalid rows and taken usernames or emails are reported and skipped.'
+    )
+    importer_class = UserImporter
+    imported_name = 'users'
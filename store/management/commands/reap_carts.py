@@ -0,0 +1,54 @@
+import signal
+import threading
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from store.reaper import CartReaper, cart_reaper
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete the carts (and their items) nobody touched for longer than the TTL (STORE_CART_REAPER), in small '
+        'batches walked in (updated_at, id) order, each in a short transaction of its own. '
+        'Stopping it (Ctrl-C or SIGTERM) finishes the current batch; running it again resumes where it stopped. '
+        'With --every it keeps running and reaps periodically.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl-days', type=float, help='Idle days before a cart expires, TTL_DAYS by default.')
+        parser.add_argument('--batch-size', type=int, help='Carts deleted per transaction, BATCH_SIZE by default.')
+        parser.add_argument('--pause', type=float, help='Seconds to sleep between batches, PAUSE by default.')
+        parser.add_argument('--max-batches', type=int, help='Stop after this many batches.')
+        parser.add_argument('--every', type=float, help='Keep running and reap every this many seconds.')
+
+    def handle(self, *args, **options):
+        reaper = CartReaper(
+            ttl=timedelta(days=options['ttl_days']) if options['ttl_days'] is not None else cart_reaper.ttl,
+            batch_size=options['batch_size'] or cart_reaper.batch_size,
+            pause=options['pause'] if options['pause'] is not None else cart_reaper.pause,
+        )
+        if reaper.batch_size < 1:
+            raise CommandError('--batch-size must be at least 1.')
+
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop.set())
+        while True:
+            self.reap(reaper, stop, options['max_batches'], options['verbosity'])
+            if not options['every'] or stop.wait(options['every']):
+                break
+
+    def reap(self, reaper, stop, max_batches, verbosity):
+        started = time.perf_counter()
+        carts = items = 0
+        for batch_carts, batch_items, (updated_at, _) in reaper.run(stop, max_batches):
+            carts += batch_carts
+            items += batch_items
+            if verbosity > 1:
+                self.stdout.write(f'{batch_carts} carts and {batch_items} items deleted, up to carts idle since {updated_at:%Y-%m-%d %H:%M:%S}')
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{carts} expired carts and {items} items deleted in {elapsed:.1f}s'
+            f'{f" ({(carts + items) / elapsed:.0f} rows/sec)" if carts else ""}'
+            f'{", interrupted" if stop.is_set() else ""}.'
+        ))
@@ -0,0 +1,42 @@
+import time
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from store.models import Order
+from store.sales import rebuild_sales
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the daily sales rollups (per day, product and collection, by order status) of a range of days '
+        'from the orders, e.g. after backfilling orders or to repair drifted rollups. The days are rebuilt a batch '
+        'at a time, each batch in its own transaction, so orders can keep coming in meanwhile.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help='First day (YYYY-MM-DD), the day of the first order by default.')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day (YYYY-MM-DD), today by default.')
+        parser.add_argument('--batch-days', type=int, default=7, help='Days rebuilt per transaction.')
+
+    def handle(self, *args, **options):
+        end = options['end'] or timezone.localdate()
+        start = options['start']
+        if start is None:
+            first_order = Order.objects.order_by('placed_at').values_list('placed_at', flat=True).first()
+            if first_order is None:
+                self.stdout.write(self.style.SUCCESS('There are no orders.'))
+                return
+            start = timezone.localdate(first_order)
+        if start > end:
+            raise CommandError('--start must not be after --end.')
+        if options['batch_days'] < 1:
+            raise CommandError('--batch-days must be at least 1.')
+
+        started = time.perf_counter()
+        written = 0
+        for first, last, rows in rebuild_sales(start, end, options['batch_days']):
+            written += rows
+            self.stdout.write(f'{first} to {last}: {rows} rollup rows')
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt the sales rollups from {start} to {end} ({written} rows) in {time.perf_counter() - started:.1f}s.'
+        ))
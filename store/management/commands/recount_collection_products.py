@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from store.cache import catalog_cache
+from store.models import Collection
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the denormalized `products_count` of every collection from the products table '
+        'and repair the ones that drifted (e.g. after raw SQL or `bulk_create()` writes).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the drifted collections.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            drifted = list(Collection.objects.drifted().select_for_update().values_list('id', 'name', 'products_count', 'actual'))
+            for collection_id, name, stored, actual in drifted:
+                self.stdout.write(f'{collection_id:>8} {name[:40]:40} stored {stored:>8} actual {actual:>8}')
+            if options['dry_run'] or not drifted:
+                self.stdout.write(self.style.SUCCESS(f'{len(drifted)} collections drifted.'))
+                return
+            Collection.objects.recount_products([collection_id for collection_id, *_ in drifted])
+        catalog_cache.bump(*[f'collection:{collection_id}' for collection_id, *_ in drifted], 'collection-list')
+        self.stdout.write(self.style.SUCCESS(f'{len(drifted)} collections repaired.'))
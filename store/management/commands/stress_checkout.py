@@ -0,0 +1,100 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, DatabaseError
+from django.db.models import Sum
+from rest_framework import serializers
+from store.factories import create_catalog, create_carts, create_customers
+from store.models import User, Product, Cart, Order, OrderItem
+from store.serializers import CreateOrderSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Run concurrent checkouts against a few hot products and verify that stock never goes negative '
+        'and that every reserved unit belongs to a placed order. Reports orders per second. '
+        'Needs a database with row locking (MySQL); the data it creates is removed afterwards unless --keep is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--checkouts', type=int, default=500)
+        parser.add_argument('--products', type=int, default=5)
+        parser.add_argument('--stock', type=int, default=300, help='Initial stock of every product.')
+        parser.add_argument('--lines', type=int, default=3, help='Maximum number of lines per cart.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep', action='store_true', help='Keep the generated data.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        tag = f'stress-{int(time.time())}'
+        (collection,), products = create_catalog(tag, options['products'], stock=options['stock'])
+        customers = create_customers(tag, options['threads'])
+        users = [customer.user_id for customer in customers]
+        checkouts = self.create_carts(rng, products, [customer.pk for customer in customers], options)
+
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+                results = list(executor.map(self.checkout, checkouts))
+            elapsed = time.perf_counter() - started
+            self.report(results, elapsed, products, options['stock'])
+        finally:
+            if not options['keep']:
+                orders = Order.objects.filter(customer__in=[customer.pk for customer in customers])
+                OrderItem.objects.filter(order__in=orders).delete()
+                orders.delete()
+                Cart.objects.filter(pk__in=[cart_id for cart_id, _ in checkouts]).delete()
+                Product.objects.filter(collection=collection).delete()
+                collection.delete()
+                User.objects.filter(pk__in=users).delete()
+
+    def create_carts(self, rng, products, customer_ids, options):
+        carts = create_carts(options['checkouts'], lambda index: [
+            (product, rng.randint(1, 3)) for product in rng.sample(products, rng.randint(1, min(options['lines'], len(products))))
+        ])
+        return [(cart.pk, customer_ids[i % len(customer_ids)]) for i, cart in enumerate(carts)]
+
+    def checkout(self, checkout):
+        cart_id, customer_id = checkout
+        try:
+            serializer = CreateOrderSerializer(data={'cart_id': cart_id}, context={'customer_id': customer_id})
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            return 'placed'
+        except serializers.ValidationError:
+            return 'rejected'
+        except DatabaseError as error:
+            return f'error: {error}'
+        finally:
+            connection.close()
+
+    def report(self, results, elapsed, products, initial_stock):
+        placed = results.count('placed')
+        rejected = results.count('rejected')
+        errors = [result for result in results if result.startswith('error')]
+
+        stock = dict(Product.objects.filter(pk__in=[p.pk for p in products]).values_list('pk', 'stock'))
+        ordered = dict(
+            OrderItem.objects.filter(product__in=products).values('product_id')
+            .annotate(total=Sum('quantity')).values_list('product_id', 'total')
+        )
+
+        self.stdout.write(f'{placed} orders placed, {rejected} rejected for lack of stock, {len(errors)} errors')
+        self.stdout.write(f'{len(results) / elapsed:.1f} checkouts/sec, {placed / elapsed:.1f} orders/sec over {elapsed:.2f}s')
+        for error in sorted(set(errors))[:5]:
+            self.stdout.write(self.style.WARNING(error))
+
+        problems = []
+        for product in products:
+            remaining = stock[product.pk]
+            if remaining < 0:
+                problems.append(f'{product.name} has negative stock ({remaining})')
+            if initial_stock - remaining != ordered.get(product.pk, 0):
+                problems.append(
+                    f'{product.name} lost {initial_stock - remaining} units but orders hold {ordered.get(product.pk, 0)}'
+                )
+        if problems:
+            raise CommandError('\n'.join(problems))
+        self.stdout.write(self.style.SUCCESS('Stock is consistent with the placed orders.'))
@@ -0,0 +1,262 @@
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+import weakref
+from bisect import bisect_left
+from collections import defaultdict
+from functools import lru_cache
+from itertools import count
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer
+
+
+DEFAULT_LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+DEFAULT_QUERY_BUCKETS = [0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89]
+
+HTTP_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+# name: (type, help)
+METRICS = {
+    'store_http_requests_total': ('counter', 'Requests served, by route name and method.'),
+    'store_http_errors_total': ('counter', 'Requests answered with a 5xx status, by route name and method.'),
+    'store_http_request_duration_seconds': ('histogram', 'Time to produce the response, by route name and method.'),
+    'store_http_request_db_queries': ('histogram', 'SQL statements run per request, by route name and method.'),
+}
+
+
+class MemoryShard:
+    """The counts of one thread, in a plain dict only that thread writes to."""
+    def __init__(self):
+        self.values = defaultdict(float)
+
+    def add(self, key, amount):
+        self.values[key] += amount
+
+    def items(self):
+        # copied in one step, the owning thread may be adding keys meanwhile.
+        return list(self.values.items())
+
+
+class FileShard:
+    """
+    The counts of one thread of one process, in a memory-mapped file only that thread writes to
+    (put the directory on a tmpfs such as /dev/shm to keep it in memory).
+
+    The file starts with the number of bytes in use, followed by `(key length, key, padding, float64 value)`
+    records. A record is complete before the header counts it, so readers never see half of one.
+    """
+    HEADER = struct.Struct('<I4x')
+    LENGTH = struct.Struct('<I')
+    VALUE = struct.Struct('<d')
+    INITIAL_SIZE = 64 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a+b')
+        if os.fstat(self.file.fileno()).st_size < self.INITIAL_SIZE:
+            self.file.truncate(self.INITIAL_SIZE)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        # a file left by a process of the same id is carried on.
+        self.used = self.HEADER.unpack_from(self.map, 0)[0] or self.HEADER.size
+        self.offsets = {key: offset for key, offset, _ in self.parse(self.map)}
+
+    @classmethod
+    def parse(cls, data):
+        """`(key, value offset, value)` of the records of a shard's bytes."""
+        used = cls.HEADER.unpack_from(data, 0)[0] if len(data) >= cls.HEADER.size else 0
+        position = cls.HEADER.size
+        while position < used:
+            length = cls.LENGTH.unpack_from(data, position)[0]
+            key = bytes(data[position + cls.LENGTH.size:position + cls.LENGTH.size + length]).decode('utf-8')
+            offset = align(position + cls.LENGTH.size + length)
+            yield key, offset, cls.VALUE.unpack_from(data, offset)[0]
+            position = offset + cls.VALUE.size
+
+    def add(self, key, amount):
+        offset = self.offsets.get(key)
+        if offset is None:
+            offset = self.append(key)
+        self.VALUE.pack_into(self.map, offset, self.VALUE.unpack_from(self.map, offset)[0] + amount)
+
+    def append(self, key):
+        encoded = key.encode('utf-8')
+        offset = align(self.used + self.LENGTH.size + len(encoded))
+        end = offset + self.VALUE.size
+        if end > len(self.map):
+            size = max(end, 2 * len(self.map))
+            self.map.close()
+            self.file.truncate(size)
+            self.map = mmap.mmap(self.file.fileno(), 0)
+        self.LENGTH.pack_into(self.map, self.used, len(encoded))
+        self.map[self.used + self.LENGTH.size:self.used + self.LENGTH.size + len(encoded)] = encoded
+        self.VALUE.pack_into(self.map, offset, 0.0)
+        self.used = end
+        self.HEADER.pack_into(self.map, 0, self.used)
+        self.offsets[key] = offset
+        return offset
+
+
+def align(position):
+    return (position + 7) & ~7
+
+
+class ShardLease:
+    """Holds a shard for the thread it's stored in; the thread ending drops it and frees the shard."""
+    def __init__(self, shard):
+        self.shard = shard
+
+
+class MetricsRegistry:
+    """
+    Request counters and fixed-bucket histograms of latency and SQL statements per route.
+
+    Every thread records into a shard of its own, so recording takes no lock; `collect()` sums the
+    shards. In 'memory' mode the shards are dicts of this process. In 'file' mode they are memory-mapped
+    files in `directory`, one per thread of each worker process, and `collect()` sums those of every
+    process, so any worker answers the scrape with the totals of the deployment.
+
+    The shard of a thread that ended is carried on by the next new thread of the process, so a process
+    holds as many shards as it ran threads at once, however many it starts over its life. The files of
+    a process that ended stay (its counts are part of the totals) until the directory is emptied.
+    """
+    def __init__(self, mode='memory', directory=None, latency_buckets=DEFAULT_LATENCY_BUCKETS, query_buckets=DEFAULT_QUERY_BUCKETS):
+        if mode not in ('memory', 'file'):
+            raise ValueError(f'Unknown metrics mode {mode!r}.')
+        if mode == 'file' and not directory:
+            raise ValueError("The 'file' metrics mode needs a DIRECTORY.")
+        self.mode = mode
+        self.directory = directory
+        self.buckets = {
+            'store_http_request_duration_seconds': sorted(latency_buckets),
+            'store_http_request_db_queries': sorted(query_buckets),
+        }
+        self.reset_shards()
+        # a forked worker records into shards of its own, not the parent's.
+        os.register_at_fork(after_in_child=self.reset_shards)
+
+    def reset_shards(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+        self._free_shards = []
+        self._file_numbers = count()
+
+    @classmethod
+    def from_settings(cls):
+        options = getattr(settings, 'STORE_METRICS', {})
+        return cls(
+            mode=options.get('MODE', 'memory'),
+            directory=options.get('DIRECTORY'),
+            latency_buckets=options.get('LATENCY_BUCKETS', DEFAULT_LATENCY_BUCKETS),
+            query_buckets=options.get('QUERY_BUCKETS', DEFAULT_QUERY_BUCKETS),
+        )
+
+    @property
+    def shard(self):
+        lease = getattr(self._local, 'lease', None)
+        if lease is None:
+            # only once per thread.
+            with self._lock:
+                shard = self._free_shards.pop() if self._free_shards else self.create_shard()
+            lease = self._local.lease = ShardLease(shard)
+            # bound to this list rather than to `self`: after a fork, the parent's threads end in the child
+            # and must not hand their shards to the child's, see `reset_shards()`.
+            weakref.finalize(lease, self._free_shards.append, shard)
+        return lease.shard
+
+    def create_shard(self):
+        if self.mode == 'memory':
+            shard = MemoryShard()
+            self._shards.append(shard)
+            return shard
+        os.makedirs(self.directory, exist_ok=True)
+        # numbered rather than named after the thread, whose id a new thread may reuse while the shard is carried on.
+        return FileShard(os.path.join(self.directory, f'metrics-{os.getpid()}-{next(self._file_numbers)}.db'))
+
+    def observe_request(self, route, method, status, seconds, queries):
+        shard = self.shard
+        # the label values are bounded: route names, not paths, and the methods the API answers.
+        labels = (route or 'unresolved', method if method in HTTP_METHODS else 'other')
+        shard.add(get_key('store_http_requests_total', labels), 1)
+        if status >= 500:
+            shard.add(get_key('store_http_errors_total', labels), 1)
+        for name, value in (('store_http_request_duration_seconds', seconds), ('store_http_request_db_queries', queries)):
+            # counted in the first bucket holding the value, the buckets are made cumulative on export.
+            index = bisect_left(self.buckets[name], value)
+            shard.add(get_key(name, labels, index), 1)
+            shard.add(get_key(name, labels, 'sum'), value)
+
+    def collect(self):
+        """`{key: value}` summed over every shard."""
+        totals = defaultdict(float)
+        if self.mode == 'file':
+            for path in glob.glob(os.path.join(self.directory, 'metrics-*.db')):
+                with open(path, 'rb') as file:
+                    data = file.read()
+                for key, _, value in FileShard.parse(data):
+                    totals[key] += value
+        else:
+            with self._lock:
+                shards = list(self._shards)
+            for shard in shards:
+                for key, value in shard.items():
+                    totals[key] += value
+        return totals
+
+    def render(self):
+        """The collected metrics in the Prometheus text exposition format (version 0.0.4)."""
+        samples = defaultdict(dict)
+        for key, value in self.collect().items():
+            name, labels, *part = json.loads(key)
+            samples[name].setdefault(tuple(labels), {})[part[0] if part else None] = value
+
+        lines = []
+        for name, (metric_type, description) in METRICS.items():
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for (route, method), parts in sorted(samples[name].items()):
+                labels = f'route="{escape(route)}",method="{escape(method)}"'
+                if metric_type == 'counter':
+                    lines.append(f'{name}{{{labels}}} {format_value(parts[None])}')
+                    continue
+                count = 0
+                for index, bound in enumerate([*self.buckets[name], float('inf')]):
+                    count += parts.get(index, 0)
+                    lines.append(f'{name}_bucket{{{labels},le="{format_value(bound)}"}} {format_value(count)}')
+                lines.append(f'{name}_sum{{{labels}}} {format_value(parts.get("sum", 0))}')
+                lines.append(f'{name}_count{{{labels}}} {format_value(count)}')
+        return '\n'.join(lines) + '\n'
+
+
+@lru_cache(maxsize=4096)
+def get_key(name, labels, part=None):
+    # the routes are a fixed set, so building the keys once each keeps json out of the request path.
+    return json.dumps([name, labels] if part is None else [name, labels, part], separators=(',', ':'))
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class PrometheusRenderer(BaseRenderer):
+    # negotiated as plain text, a parameter in the media type would only match Accept headers naming it.
+    media_type = 'text/plain'
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # errors (e.g. a 403) are rendered as JSON text.
+        return (data if isinstance(data, str) else json.dumps(data)).encode(self.charset)
+
+
+metrics = MetricsRegistry.from_settings()
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.4 on 2026-10-18 04:43
+
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def compute_totals(apps, schema_editor):
+    Cart = apps.get_model('store', 'Cart')
+    CartItem = apps.get_model('store', 'CartItem')
+    items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+    subtotal = items.annotate(total=Sum(F('quantity') * F('product__price'))).values('total')
+    items_count = items.annotate(count=Count('pk')).values('count')
+    Cart.objects.update(
+        subtotal=Coalesce(Subquery(subtotal, output_field=models.DecimalField(max_digits=12, decimal_places=2)), Value(0)),
+        items_count=Coalesce(Subquery(items_count, output_field=models.PositiveIntegerField()), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_collection_products_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.RunPython(compute_totals, migrations.RunPython.noop),
+    ]
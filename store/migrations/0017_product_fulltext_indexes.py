@@ -0,0 +1,38 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:10
+
+from django.db import migrations
+
+
+# FULLTEXT indexes can't be declared in `Meta.indexes`, and only MySQL has them; on other databases
+# product search falls back to an in-process inverted index (see store/search.py).
+FULLTEXT_INDEXES = {
+    'store_product_search_idx': ['name', 'description'],
+    'store_product_search_name_idx': ['name'],
+}
+
+
+def add_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    quote = schema_editor.quote_name
+    for name, columns in FULLTEXT_INDEXES.items():
+        schema_editor.execute(f'CREATE FULLTEXT INDEX {quote(name)} ON {quote("store_product")} ({", ".join(map(quote, columns))})')
+
+
+def remove_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    quote = schema_editor.quote_name
+    for name in FULLTEXT_INDEXES:
+        schema_editor.execute(f'DROP INDEX {quote(name)} ON {quote("store_product")}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_product_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_fulltext_indexes, remove_fulltext_indexes),
+    ]
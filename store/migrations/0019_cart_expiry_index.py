@@ -0,0 +1,17 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['updated_at', 'id'], name='store_cart_updated_00e2f1_idx'),
+        ),
+    ]
@@ -1,9 +1,14 @@
-from django.db import models
+from django.db import models, connections
+from django.db.models import Case, When, Value, F, Count, Sum, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator
 from django.contrib import admin
 from django.core.validators import MinValueValidator
 from django.contrib import admin
+from django.contrib.auth.hashers import check_password
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
+from django.utils.functional import cached_property
 from uuid import uuid4
 from .validators import validate_product_price
 from uuid import uuid4
@@ -15,22 +20,88 @@ class User(AbstractUser):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'password']
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # serves the `Customer` ordering (user__first_name, user__last_name).
+            models.Index(fields=['first_name', 'last_name']),
+        ]
+
+    @cached_property
+    def customer_id(self):
+        # the same attribute the token claims give `store.authentication.TokenUser`.
+        return Customer.objects.filter(user_id=self.pk).values_list('id', flat=True).first()
+
+    def check_password(self, raw_password):
+        # a rehash (by a newer hasher, or with more iterations) is written with an UPDATE, as the async sign-in
+        # does: `save()` would tell the signals the password changed and revoke the user's tokens.
+        def setter(raw_password):
+            previous = self.password
+            self.set_password(raw_password)
+            self._password = None
+            type(self)._default_manager.filter(pk=self.pk, password=previous).update(password=self.password)
+        return check_password(raw_password, self.password, setter)
+
     def __str__(self) -> str:
         return self.username
 
 
+class CollectionManager(models.Manager):
+    def adjust_products_count(self, deltas):
+        """
+        Apply `deltas` ({collection_id: change}) to `products_count` with a single UPDATE.
+        The counts are changed relative to their current value, so concurrent writers never lose an update.
+        """
+        deltas = {collection_id: delta for collection_id, delta in deltas.items() if delta and collection_id is not None}
+        if not deltas:
+            return 0
+        whens = []
+        for collection_id, delta in deltas.items():
+            if delta > 0:
+                whens.append(When(pk=collection_id, then=F('products_count') + delta))
+            else:
+                # a count that already drifted below the change stops at zero instead of failing the write,
+                # `recount_collection_products` puts it right.
+                whens.append(When(pk=collection_id, products_count__gte=-delta, then=F('products_count') - (-delta)))
+                whens.append(When(pk=collection_id, then=Value(0)))
+        # `last_updated_at` is touched too, it validates the cached payloads holding the count.
+        return self.filter(pk__in=deltas.keys()).update(
+            products_count=Case(*whens, default=F('products_count'), output_field=models.PositiveIntegerField()),
+            last_updated_at=timezone.now(),
+        )
+
+    def drifted(self):
+        """Collections whose `products_count` disagrees with the products table, annotated with the `actual` count."""
+        actual = Product.objects.filter(collection=OuterRef('pk')).order_by().values('collection').annotate(count=Count('pk')).values('count')
+        return self.annotate(actual=Coalesce(Subquery(actual, output_field=models.IntegerField()), 0)) \
+            .exclude(products_count=F('actual'))
+
+    def recount_products(self, collection_ids=None):
+        """Recompute `products_count` of the drifted collections (all of them, or only `collection_ids`), return how many were repaired."""
+        queryset = self.drifted()
+        if collection_ids is not None:
+            queryset = queryset.filter(pk__in=collection_ids)
+        return queryset.update(products_count=F('actual'), last_updated_at=timezone.now())
+
+
 class Collection(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField(null=True, blank=True)
     added_at = models.DateTimeField(auto_now_add=True)
     last_updated_at = models.DateTimeField(auto_now=True)
+    # maintained by the product signal handlers, see `CollectionManager`.
+    products_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = CollectionManager()
 
     def __str__(self):
         return self.name
 
     class Meta:
         ordering = ['name']
-        
+        indexes = [
+            models.Index(fields=['name', 'id']),
+        ]
+
 
 class Product(models.Model):
     name = models.CharField(max_length=255)
@@ -47,11 +118,20 @@ class Product(models.Model):
     
     class Meta:
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['name', 'id']),
+            # a collection's products in listing order.
+            models.Index(fields=['collection', 'name']),
+            # incremental exports (`updated_since`) in (last_updated_at, id) keyset order.
+            models.Index(fields=['last_updated_at', 'id']),
+        ]
 
 
 class ProductImage(models.Model):
     image = models.ImageField(upload_to=f'store/images/products')
     product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True, related_name='images')
+    # resized copies of `image`, `{size: {format: storage name}}` (see store/images.py).
+    derivatives = models.JSONField(default=dict, editable=False)
 
 
 class Customer(models.Model):
@@ -75,16 +155,105 @@ class Customer(models.Model):
         return self.user.email
     
     class Meta:
+        # across the join to the user: the customers are paginated by the (first_name, last_name) index of
+        # `User`, joined back one row at a time. Kept rather than copying the names onto the customer, as
+        # customers are only listed by the staff.
         ordering = ['user__first_name', 'user__last_name']
 
 
+class CartQuerySet(models.QuerySet):
+    def refresh_totals(self):
+        """
+        Recompute `subtotal` and `items_count` of these carts from their items and the current product
+        prices, in a single UPDATE. Call it inside the transaction that changed the items (or the prices).
+        `updated_at` is touched as well, so the cart's ETag changes with its items.
+        """
+        items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+        subtotal = items.annotate(total=Sum(F('quantity') * F('product__price'))).values('total')
+        items_count = items.annotate(count=Count('pk')).values('count')
+        return self.update(
+            subtotal=Coalesce(Subquery(subtotal, output_field=models.DecimalField(max_digits=12, decimal_places=2)), Value(0)),
+            items_count=Coalesce(Subquery(items_count, output_field=models.PositiveIntegerField()), Value(0)),
+            updated_at=timezone.now(),
+        )
+
+    def add_to_totals(self, subtotal, items_count=0):
+        """
+        Add `subtotal` and `items_count` (negative to take them off) to the totals of these carts: the change
+        one write of their items makes, priced by the caller. A single UPDATE reading no item, unlike
+        `refresh_totals()`, which stays the way to repair the totals.
+        """
+        return self.update(
+            subtotal=F('subtotal') + subtotal,
+            items_count=F('items_count') + items_count,
+            updated_at=timezone.now(),
+        )
+
+    def reprice(self, product_id, change):
+        """Apply a `change` of the price of a product to the subtotals of these carts, times the quantity each holds."""
+        quantity = CartItem.objects.filter(cart=OuterRef('pk'), product_id=product_id).values('quantity')
+        return self.update(
+            subtotal=F('subtotal') + Coalesce(Subquery(quantity), Value(0)) * change,
+            updated_at=timezone.now(),
+        )
+
+
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # materialized from the items, see `CartQuerySet.refresh_totals`.
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    items_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = CartQuerySet.as_manager()
 
     class Meta:
         ordering =['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-id']),
+            # the expired carts, oldest first (see store/reaper.py).
+            models.Index(fields=['updated_at', 'id']),
+        ]
+
+
+def insert_adding(manager, key_fields, amount_fields, rows):
+    """
+    INSERT `rows` (the values of `key_fields` then of `amount_fields`) into the table of `manager` in a single
+    statement, adding the amounts to those of the rows that already exist under the same key (`key_fields`
+    must be a unique constraint). The rows are inserted in the given order, which is the order they're locked in.
+    """
+    connection = connections[manager.db]
+    quote = connection.ops.quote_name
+    table = quote(manager.model._meta.db_table)
+    fields = [*key_fields, *amount_fields]
+    columns = [quote(field.column) for field in fields]
+    amount_columns = [quote(field.column) for field in amount_fields]
+
+    params = [field.get_db_prep_save(value, connection) for row in rows for field, value in zip(fields, row)]
+    placeholders = ', '.join([f'({", ".join(["%s"] * len(fields))})'] * len(rows))
+    if connection.vendor == 'mysql':
+        conflict = 'ON DUPLICATE KEY UPDATE ' + ', '.join(f'{column} = {column} + VALUES({column})' for column in amount_columns)
+    else:
+        conflict = (
+            f'ON CONFLICT ({", ".join(quote(field.column) for field in key_fields)}) DO UPDATE SET '
+            + ', '.join(f'{column} = {table}.{column} + excluded.{column}' for column in amount_columns)
+        )
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {table} ({", ".join(columns)}) VALUES {placeholders} {conflict}', params)
+
+
+class CartItemManager(models.Manager):
+    def add_quantities(self, cart_id, quantities):
+        """
+        Add `quantities` ({product_id: quantity}) to the cart in a single INSERT, incrementing the
+        quantity of the lines that already exist through the (product, cart) unique constraint.
+        """
+        meta = self.model._meta
+        insert_adding(
+            self, [meta.get_field('product'), meta.get_field('cart')], [meta.get_field('quantity')],
+            [(product_id, cart_id, quantity) for product_id, quantity in quantities.items()],
+        )
 
 
 class CartItem(models.Model):
@@ -92,6 +261,8 @@ class CartItem(models.Model):
     quantity = models.PositiveSmallIntegerField(validators=[MinValueValidator(1)])
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
 
+    objects = CartItemManager()
+
     class Meta:
         unique_together = [
             ['product', 'cart']
@@ -112,10 +283,77 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-placed_at']
+        indexes = [
+            models.Index(fields=['-placed_at', '-id']),
+            # a customer's order history, newest first.
+            models.Index(fields=['customer', '-placed_at', '-id']),
+        ]
 
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='orderitems')
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
-    quantity = models.PositiveSmallIntegerField()
\ No newline at end of file
+    quantity = models.PositiveSmallIntegerField()
+
+
+class SalesRollupManager(models.Manager):
+    def add(self, amounts):
+        """
+        Add `amounts` ({key: (orders_count, quantity, revenue)}, the key being the values of the rollup's
+        unique fields) to the rollup in a single INSERT, summing them into the rows that already exist.
+        Amounts may be negative, to take an order back out.
+        """
+        if not amounts:
+            return
+        meta = self.model._meta
+        # in key order, so concurrent orders lock the rows they share in the same order.
+        insert_adding(
+            self, [meta.get_field(name) for name in meta.unique_together[0]],
+            [meta.get_field(name) for name in SalesRollup.AMOUNT_FIELDS],
+            [(*key, *amounts[key]) for key in sorted(amounts)],
+        )
+
+
+class SalesRollup(models.Model):
+    """
+    Sales of a day, summed from the order items by order status (see store/sales.py): how many orders,
+    how many units and how much revenue (`unit_price * quantity`). Orders are counted on the day they were placed.
+    """
+    AMOUNT_FIELDS = ('orders_count', 'quantity', 'revenue')
+
+    day = models.DateField()
+    status = models.CharField(max_length=1, choices=Order.STATUS_CHOICES)
+    orders_count = models.IntegerField(default=0)
+    quantity = models.BigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    objects = SalesRollupManager()
+
+    class Meta:
+        abstract = True
+
+
+class DailySales(SalesRollup):
+    class Meta:
+        unique_together = [
+            ['day', 'status']
+        ]
+
+
+class DailyProductSales(SalesRollup):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        unique_together = [
+            ['day', 'product', 'status']
+        ]
+
+
+class DailyCollectionSales(SalesRollup):
+    collection = models.ForeignKey(Collection, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        unique_together = [
+            ['day', 'collection', 'status']
+        ]
@@ -0,0 +1,150 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from functools import reduce
+from operator import or_
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+def keyset_filter(ordering, position):
+    """
+    Build the lexicographic "row comes after position" condition for `ordering`:
+        (a > x) OR (a = x AND b > y) OR (a = x AND b = y AND c > z) ...
+    """
+    conditions = []
+    for index, field in enumerate(ordering):
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition = {previous.lstrip('-'): position[i] for i, previous in enumerate(ordering[:index])}
+        condition[f'{field.lstrip("-")}__{lookup}'] = position[index]
+        conditions.append(Q(**condition))
+    return reduce(or_, conditions)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Opaque cursor pagination that seeks on the full ordering key of the last row.
+
+    The ordering is taken from the queryset (falling back to the model `Meta.ordering`)
+    and always ends with the primary key, so every row has a unique position and the
+    next page is a plain index range scan no matter how deep the client is.
+
+    That holds as long as the ordering fields share one table: an ordering across a join (e.g.
+    customers by `user__first_name`) seeks in the joined table's index, then joins back per row.
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.get_page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request):
+        """`paginate_queryset` for async views, the rows are read with the async ORM."""
+        return self.set_page([row async for row in self.get_page_queryset(queryset, request)])
+
+    def get_page_queryset(self, queryset, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        self.pk_name = queryset.model._meta.pk.name
+        self.base_url = request.build_absolute_uri()
+
+        position = self.decode_cursor(request)
+        queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.get_keyset_filter(position))
+            except (ValueError, TypeError, DjangoValidationError):
+                # a tampered cursor, whose values don't fit the ordering fields (e.g. text for an integer key).
+                raise NotFound(self.invalid_cursor_message)
+
+        # fetch one extra row to know if there is a following page without a COUNT(*).
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, queryset):
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        fields = {field.lstrip('-') for field in ordering}
+        if not fields & {'pk', 'id', queryset.model._meta.pk.name}:
+            # the tiebreaker follows the direction of the leading field so a single composite index serves both.
+            descending = bool(ordering) and ordering[0].startswith('-')
+            ordering.append('-pk' if descending else 'pk')
+        return ordering
+
+    def get_keyset_filter(self, position):
+        if len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return keyset_filter(self.ordering, position)
+
+    def get_position(self, instance):
+        position = []
+        for field in self.ordering:
+            field = field.lstrip('-')
+            if isinstance(instance, dict):
+                # a `.values()` row, keyed by lookup.
+                position.append(instance[self.pk_name if field == 'pk' else field])
+                continue
+            value = instance
+            for attr in field.split('__'):
+                value = getattr(value, attr)
+            position.append(value)
+        return position
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        cursor = self.encode_cursor(self.get_position(self.page[-1]))
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def encode_cursor(self, position):
+        data = json.dumps(position, default=str, separators=(',', ':'))
+        return urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            position = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list):
+            raise NotFound(self.invalid_cursor_message)
+        return position
@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+
+
+class HashingPoolFull(Exception):
+    """Raised by `PasswordHashingPool.verify()` when its queue is full."""
+
+
+class PasswordHashingPool:
+    """
+    Verify passwords off the event loop, in a bounded thread pool of its own.
+
+    At most `max_workers` hashes run at once (PBKDF2 releases the GIL, so they run in parallel)
+    and at most `max_queue` more wait for a thread; past that `verify()` fails fast with
+    `HashingPoolFull` instead of letting a burst of sign-ins queue up without bound.
+    The pool is per process, and so are its `metrics()`.
+    """
+    def __init__(self, max_workers, max_queue):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._peak_queued = 0
+        self._completed = 0
+        self._rejected = 0
+        self._upgraded = 0
+        self._wait_seconds = 0.0
+        self._hash_seconds = 0.0
+
+    @classmethod
+    def from_settings(cls):
+        options = getattr(settings, 'STORE_PASSWORD_HASHING', {})
+        return cls(options.get('MAX_WORKERS', 4), options.get('MAX_QUEUE', 64))
+
+    @property
+    def executor(self):
+        # created on first use, so a process forked by the server doesn't inherit the threads.
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='password-hashing')
+            return self._executor
+
+    async def verify(self, password, encoded):
+        """
+        Return `(valid, upgraded)`: whether `password` matches the `encoded` hash, and a new hash of it
+        when `encoded` was made with another hasher or fewer iterations than the current settings
+        (None otherwise). With `encoded=None` (no such user) a hash is still computed, so the response
+        time doesn't tell whether the account exists.
+        """
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                raise HashingPoolFull()
+            self._pending += 1
+            self._peak_queued = max(self._peak_queued, self._pending - self.max_workers)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._verify, password, encoded, time.perf_counter())
+
+    def _verify(self, password, encoded, submitted_at):
+        started_at = time.perf_counter()
+        with self._lock:
+            self._running += 1
+            self._wait_seconds += started_at - submitted_at
+        upgraded = []
+        try:
+            if encoded is None:
+                make_password(password)
+                return False, None
+            # `check_password` calls the setter exactly when Django's own login would rehash.
+            valid = check_password(password, encoded, setter=lambda raw: upgraded.append(make_password(raw)))
+            return valid, upgraded[0] if valid and upgraded else None
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._running -= 1
+                self._completed += 1
+                self._upgraded += bool(upgraded)
+                self._hash_seconds += time.perf_counter() - started_at
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'running': self._running,
+                'queued': self._pending - self._running,
+                'peak_queued': self._peak_queued,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'upgraded': self._upgraded,
+                'avg_wait_ms': round(self._wait_seconds / self._completed * 1000, 2) if self._completed else None,
+                'avg_hash_ms': round(self._hash_seconds / self._completed * 1000, 2) if self._completed else None,
+            }
+
+
+password_hashing_pool = PasswordHashingPool.from_settings()
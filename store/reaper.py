@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from .pagination import keyset_filter
+from . import models
+
+
+logger = logging.getLogger(__name__)
+
+ORDERING = ['updated_at', 'pk']
+
+
+class CartReaper:
+    """
+    Delete the anonymous carts nobody touched (`updated_at`) for longer than `ttl`, with their items.
+
+    The expired carts are walked in (updated_at, id) order, `batch_size` at a time, each batch deleted in
+    a transaction of its own followed by a `pause`, so live checkouts never wait long on the reaper.
+    A batch only locks carts no one else holds (SKIP LOCKED) and spares the ones touched since they were read.
+    An interrupted run loses its current batch at most: the carts it already deleted are gone, so the next
+    run starts right after them.
+    """
+    def __init__(self, ttl, batch_size, pause):
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.pause = pause
+        self._thread = None
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_settings(cls):
+        options = getattr(settings, 'STORE_CART_REAPER', {})
+        return cls(
+            ttl=timedelta(days=options.get('TTL_DAYS', 14)),
+            batch_size=options.get('BATCH_SIZE', 500),
+            pause=options.get('PAUSE', 0.1),
+        )
+
+    def run(self, stop=None, max_batches=None):
+        """
+        Delete the carts that expired by now, yielding `(carts, items, last (updated_at, id))` per batch.
+        Stops early once `stop` (a `threading.Event`) is set or after `max_batches`.
+        """
+        stop = stop or threading.Event()
+        cutoff = timezone.now() - self.ttl
+        position = None
+        batches = 0
+        while not stop.is_set() and (max_batches is None or batches < max_batches):
+            queryset = models.Cart.objects.filter(updated_at__lt=cutoff).order_by(*ORDERING)
+            if position is not None:
+                # the redundant lower bound keeps the walk a single range of the (updated_at, id) index.
+                queryset = queryset.filter(keyset_filter(ORDERING, position), updated_at__gte=position[0])
+            rows = list(queryset.values_list(*ORDERING)[:self.batch_size])
+            if not rows:
+                return
+            position = rows[-1]
+            carts, items = self.delete([cart_id for _, cart_id in rows], cutoff)
+            batches += 1
+            yield carts, items, position
+            if self.pause:
+                stop.wait(self.pause)
+
+    def delete(self, cart_ids, cutoff):
+        with transaction.atomic():
+            # a cart being written right now is skipped rather than waited for, one touched since it was read is kept.
+            expired = list(
+                models.Cart.objects
+                .select_for_update(skip_locked=True)
+                .filter(pk__in=cart_ids, updated_at__lt=cutoff)
+                .order_by()
+                .values_list('pk', flat=True)
+            )
+            if not expired:
+                return 0, 0
+            # no signal receiver listens to the carts or their items, so the items go in one DELETE by cart
+            # rather than being read one by one.
+            _, deleted = models.Cart.objects.filter(pk__in=expired).delete()
+            return deleted.get(models.Cart._meta.label, 0), deleted.get(models.CartItem._meta.label, 0)
+
+    def start(self, interval):
+        """Reap the expired carts every `interval` seconds in a daemon thread of this process."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run_every, args=(interval, self._stop), name='cart-reaper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def run_every(self, interval, stop):
+        while not stop.is_set():
+            started = time.perf_counter()
+            carts = items = 0
+            try:
+                for batch_carts, batch_items, _ in self.run(stop):
+                    carts += batch_carts
+                    items += batch_items
+            except Exception:
+                logger.exception('Could not reap the expired carts.')
+            finally:
+                connections.close_all()
+            if carts:
+                elapsed = time.perf_counter() - started
+                logger.info('Reaped %d expired carts and %d items (%.0f rows/sec).', carts, items, (carts + items) / elapsed)
+            stop.wait(interval)
+
+
+cart_reaper = CartReaper.from_settings()
+
+
+def start_scheduled_reaper():
+    """Start reaping in this process if STORE_CART_REAPER sets an INTERVAL, called by the server entry points."""
+    interval = getattr(settings, 'STORE_CART_REAPER', {}).get('INTERVAL')
+    if interval:
+        cart_reaper.start(interval)
@@ -0,0 +1,175 @@
+import logging
+import math
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections, DatabaseError, DEFAULT_DB_ALIAS
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework.permissions import SAFE_METHODS
+
+
+logger = logging.getLogger(__name__)
+
+# the database the reads of the current request go to, None for the primary.
+current_read_alias = ContextVar('current_read_alias', default=None)
+
+
+class ReadReplicas:
+    """
+    The read replicas (aliases of `DATABASES`) and whether each is fit to serve reads.
+
+    A replica is checked at most every `check_interval` seconds, by the first request to need it:
+    one more than `max_lag` seconds behind the primary (or whose replication stopped) is left out
+    until a later check finds it caught up, one that can't be reached is left out for `retry_after`
+    seconds. With no replica fit, the reads go to the primary.
+    """
+    def __init__(self, aliases=(), max_lag=5, check_interval=2, retry_after=30):
+        self.aliases = list(aliases)
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+        # alias: (usable, next check)
+        self._state = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        options = getattr(settings, 'STORE_READ_REPLICAS', {})
+        return cls(
+            aliases=options.get('ALIASES', []),
+            max_lag=options.get('MAX_LAG', 5),
+            check_interval=options.get('LAG_CHECK_INTERVAL', 2),
+            retry_after=options.get('RETRY_AFTER', 30),
+        )
+
+    def choose(self):
+        """A replica fit to serve reads, picked at random, or None."""
+        usable = [alias for alias in self.aliases if self.is_usable(alias)]
+        return random.choice(usable) if usable else None
+
+    def is_usable(self, alias):
+        now = time.monotonic()
+        usable, next_check = self._state.get(alias, (False, 0))
+        if now < next_check:
+            return usable
+        with self._lock:
+            # another thread may have checked it meanwhile, the others keep the last answer until then.
+            usable, next_check = self._state.get(alias, (False, 0))
+            if now < next_check:
+                return usable
+            self._state[alias] = (usable, now + self.check_interval)
+        try:
+            lag = self.get_lag(alias)
+        except DatabaseError:
+            logger.warning('Read replica %r is unreachable, reading from the primary for %ss.', alias, self.retry_after, exc_info=True)
+            self._state[alias] = (False, time.monotonic() + self.retry_after)
+            return False
+        usable = lag <= self.max_lag
+        if not usable:
+            logger.warning('Read replica %r is %ss behind, over MAX_LAG (%ss).', alias, lag, self.max_lag)
+        self._state[alias] = (usable, time.monotonic() + self.check_interval)
+        return usable
+
+    def get_lag(self, alias):
+        """Seconds `alias` is behind the primary, `inf` if its replication stopped."""
+        connection = connections[alias]
+        if connection.vendor != 'mysql':
+            # nothing to ask (e.g. a SQLite copy standing in for a replica), a query shows it's reachable.
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return 0
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute('SHOW REPLICA STATUS')
+            except DatabaseError:
+                # before MySQL 8.0.22.
+                cursor.execute('SHOW SLAVE STATUS')
+            row = cursor.fetchone()
+            if row is None:
+                # not replicating: a stand-in for a replica, always current.
+                return 0
+            status = dict(zip((column[0] for column in cursor.description), row))
+        lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+        return math.inf if lag is None else lag
+
+
+read_replicas = ReadReplicas.from_settings()
+
+
+class ReplicaRouter:
+    """
+    Send the reads of the requests served from a replica (see `ReplicaReadMixin`) there, everything
+    else (and every write) to the primary, 'default'.
+    """
+    def db_for_read(self, model, **hints):
+        return current_read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        # explicitly, an instance read from a replica would otherwise be saved back to it.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *read_replicas.aliases}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+@contextmanager
+def primary_reads():
+    """Read from the primary within the block, even in a request served from a replica."""
+    token = current_read_alias.set(None)
+    try:
+        yield
+    finally:
+        current_read_alias.reset(token)
+
+
+def get_cookie_name():
+    return getattr(settings, 'STORE_READ_REPLICAS', {}).get('COOKIE_NAME', 'store_primary_until')
+
+
+def is_pinned(request):
+    """Whether the client wrote recently enough to read its writes from the primary."""
+    try:
+        return float(request.COOKIES[get_cookie_name()]) > time.time()
+    except (KeyError, ValueError):
+        return False
+
+
+class ReplicaReadMixin:
+    """
+    Serve the safe requests (GET, HEAD, OPTIONS) of a viewset from a read replica, unless the client
+    is pinned to the primary after a write (see `ReadYourWritesMiddleware`) or no replica is fit.
+    One replica serves all the reads of a request.
+    """
+    def dispatch(self, request, *args, **kwargs):
+        alias = None
+        if read_replicas.aliases and request.method in SAFE_METHODS and not is_pinned(request):
+            alias = read_replicas.choose()
+        if alias is None:
+            return super().dispatch(request, *args, **kwargs)
+        token = current_read_alias.set(alias)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            current_read_alias.reset(token)
+
+
+class ReadYourWritesMiddleware(MiddlewareMixin):
+    """
+    After a successful write (any unsafe method answered below 400, e.g. to a cart or an order), pin the
+    client to the primary for STICKY_SECONDS with a cookie holding the time the pin ends, so its next
+    reads see the write even while the replicas catch up.
+    """
+    def process_response(self, request, response):
+        if not read_replicas.aliases or request.method in SAFE_METHODS or response.status_code >= 400:
+            return response
+        sticky = getattr(settings, 'STORE_READ_REPLICAS', {}).get('STICKY_SECONDS', 10)
+        response.set_cookie(
+            get_cookie_name(), f'{time.time() + sticky:.3f}', max_age=math.ceil(sticky), httponly=True, samesite='Lax',
+        )
+        return response
@@ -0,0 +1,128 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from . import models
+
+
+# The rollups and the order item field each of them is keyed by, besides the day and the status.
+ROLLUPS = [
+    (models.DailySales, None),
+    (models.DailyProductSales, 'product_id'),
+    (models.DailyCollectionSales, 'product__collection_id'),
+]
+
+REVENUE = Sum(F('unit_price') * F('quantity'), output_field=DecimalField(max_digits=20, decimal_places=2))
+
+
+def get_order_lines(order_id):
+    """`(product_id, collection_id, quantity, unit_price)` of the items of an order, as `record_sales()` takes them."""
+    return list(
+        models.OrderItem.objects
+        .filter(order_id=order_id)
+        .order_by()
+        .values_list('product_id', 'product__collection_id', 'quantity', 'unit_price')
+    )
+
+
+def record_sales(day, lines, changes):
+    """
+    Add the order made of `lines` to the rollups of `day`, under each status of `changes`
+    ([(status, 1 or -1)]): `[(status, 1)]` counts a new order, `[(old, -1), (new, 1)]` moves it.
+    Runs one upsert per rollup; call it last in the transaction writing the order, as the rows of a
+    busy day are shared by every order and stay locked until it commits.
+    """
+    amounts = {model: defaultdict(lambda: [0, 0, 0]) for model, _ in ROLLUPS}
+    daily, products, collections = (amounts[model] for model, _ in ROLLUPS)
+    for status, sign in changes:
+        counted = set()
+        for product_id, collection_id, quantity, unit_price in lines:
+            # the order counts once per day, per product (an order has one line per product) and per collection.
+            for amount, first in (
+                (daily[(day, status)], not counted),
+                (products[(day, product_id, status)], True),
+                (collections[(day, collection_id, status)], collection_id not in counted),
+            ):
+                amount[0] += sign if first else 0
+                amount[1] += sign * quantity
+                amount[2] += sign * unit_price * quantity
+            counted.add(collection_id)
+
+    # the rollups in a fixed order and the rows of each in key order, so concurrent orders lock the rows they share in the same order.
+    for model, rows in amounts.items():
+        model.objects.add({key: tuple(amount) for key, amount in rows.items()})
+
+
+def get_sales_day(order):
+    return timezone.localdate(order.placed_at)
+
+
+def set_order_status(order, status):
+    """Change the status of `order` and move its sales to the new status in the rollups."""
+    with transaction.atomic():
+        # locked, so two concurrent changes can't both move the sales out of the same status.
+        previous = models.Order.objects.select_for_update().filter(pk=order.pk).values_list('status', flat=True).first()
+        order.status = status
+        order.save(update_fields=['status'])
+        if previous is not None and previous != status:
+            record_sales(get_sales_day(order), get_order_lines(order.pk), [(previous, -1), (status, 1)])
+    return order
+
+
+def delete_order(order):
+    """Delete `order` and take its sales back out of the rollups."""
+    with transaction.atomic():
+        status = models.Order.objects.select_for_update().filter(pk=order.pk).values_list('status', flat=True).first()
+        lines = get_order_lines(order.pk)
+        order.delete()
+        if status is not None:
+            record_sales(get_sales_day(order), lines, [(status, -1)])
+
+
+def rebuild_sales(start, end, batch_days=7):
+    """
+    Recompute the rollups of the days from `start` to `end` (included) from the orders, `batch_days`
+    days per transaction so the order tables are never read in one long transaction.
+    Yields `(first day, last day, rollup rows written)` per batch.
+    """
+    day = start
+    while day <= end:
+        last = min(day + timedelta(days=batch_days - 1), end)
+        yield day, last, rebuild_days(day, last)
+        day = last + timedelta(days=1)
+
+
+def rebuild_days(start, end):
+    # the placed_at range (rather than the day of placed_at) is what the orders index can serve.
+    placed_from = timezone.make_aware(datetime.combine(start, time.min))
+    placed_until = timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min))
+    items = models.OrderItem.objects \
+        .filter(order__placed_at__gte=placed_from, order__placed_at__lt=placed_until) \
+        .order_by() \
+        .annotate(day=TruncDate('order__placed_at'), status=F('order__status'))
+
+    written = 0
+    with transaction.atomic():
+        # deleted before the orders are read: under REPEATABLE READ, an order placed meanwhile waits on the
+        # locks of the deleted rows to add itself, so it's counted either by the rebuild or on top of it, never twice.
+        for model, _ in ROLLUPS:
+            model.objects.filter(day__range=(start, end)).delete()
+        for model, field in ROLLUPS:
+            groups = ['day', 'status', *([field] if field else [])]
+            rows = items.values(*groups).annotate(
+                orders_count=Count('order', distinct=True), total_quantity=Sum('quantity'), revenue=REVENUE,
+            )
+            key_name = field and model._meta.unique_together[0][1]
+            objects = [
+                model(
+                    day=row['day'], status=row['status'], orders_count=row['orders_count'],
+                    quantity=row['total_quantity'], revenue=row['revenue'],
+                    **({f'{key_name}_id': row[field]} if field else {}),
+                )
+                for row in rows.iterator(chunk_size=2000)
+            ]
+            model.objects.bulk_create(objects, batch_size=1000)
+            written += len(objects)
+    return written
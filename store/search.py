@@ -0,0 +1,279 @@
+import heapq
+import math
+import re
+import sys
+import threading
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import BooleanField, Count, FloatField, Q
+from django.db.models.expressions import RawSQL
+from . import models
+
+
+# InnoDB ignores shorter words (`innodb_ft_min_token_size`), the inverted index does too so both match alike.
+MIN_TOKEN_LENGTH = 3
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """The distinct, lowercased words of `text` that are long enough to be indexed, in order."""
+    if not text:
+        return []
+    return list(dict.fromkeys(token for token in TOKEN_RE.findall(text.lower()) if len(token) >= MIN_TOKEN_LENGTH))
+
+
+class ProductSearch(ABC):
+    """
+    Search products by the words of their `name` and `description`, all of which must match,
+    ranked with name matches weighing twice as much. `search()` filters by collection, price range
+    and stock, and counts the matches per collection and per price bucket (each facet ignoring its
+    own filter, so a client can widen it).
+
+    `price_buckets` are the bucket bounds, e.g. [10, 50] makes the buckets 0-10, 10-50 and 50+.
+    Only the first `max_results` matches can be paged through.
+    """
+    def __init__(self, price_buckets, max_results):
+        self.price_buckets = list(price_buckets)
+        self.max_results = max_results
+
+    def get_buckets(self):
+        bounds = [0, *self.price_buckets, None]
+        return list(zip(bounds, bounds[1:]))
+
+    @abstractmethod
+    def search(self, text, collection=None, min_price=None, max_price=None, in_stock=False, offset=0, limit=50):
+        """
+        Return `{'ids', 'count', 'collections', 'prices'}`: the ids of the requested slice of the ranked
+        matches, how many there are, `{collection_id: count}` and a count per price bucket.
+        """
+
+    # The index updates, called on commit by the product signal handlers and the importer.
+
+    @abstractmethod
+    def index(self, product_id, name, description, collection_id, price, stock):
+        """Add the product, or replace what the index holds about it."""
+
+    @abstractmethod
+    def remove(self, product_id):
+        """Take the product out of the index."""
+
+    @abstractmethod
+    def refresh(self, queryset):
+        """`index()` the products of `queryset` as they are in the database."""
+
+    @abstractmethod
+    def rebuild(self):
+        """Build the index again from the products table."""
+
+    @abstractmethod
+    def reset(self):
+        """Drop what the index holds in this process."""
+
+
+class FullTextSearch(ProductSearch):
+    """
+    Search with the FULLTEXT indexes on the products table (MySQL, see migration 0017), which InnoDB
+    maintains on every committed write, so there is nothing to update here.
+    A search runs four queries: the page of ids, the count and one per facet.
+    """
+    def search(self, text, collection=None, min_price=None, max_price=None, in_stock=False, offset=0, limit=50):
+        queryset = models.Product.objects.order_by()
+        ordering = ['pk']
+        if tokens := tokenize(text):
+            connection = connections[queryset.db]
+            table = connection.ops.quote_name(models.Product._meta.db_table)
+            name, description = (f'{table}.{connection.ops.quote_name(column)}' for column in ('name', 'description'))
+            # every word is required, as in the inverted index.
+            against = ' '.join(f'+{token}' for token in tokens)
+            match = f'MATCH ({name}, {description}) AGAINST (%s IN BOOLEAN MODE)'
+            # a bare MATCH in the WHERE clause is what lets MySQL use the FULLTEXT index.
+            queryset = queryset.filter(RawSQL(match, [against], output_field=BooleanField()))
+            rank = RawSQL(f'{match} + MATCH ({name}) AGAINST (%s IN BOOLEAN MODE)', [against, against], output_field=FloatField())
+            ordering = [rank.desc(), 'pk']
+
+        collection_filter = Q(collection_id=collection) if collection is not None else Q()
+        price_filter = Q()
+        if min_price is not None:
+            price_filter &= Q(price__gte=min_price)
+        if max_price is not None:
+            price_filter &= Q(price__lte=max_price)
+        stock_filter = Q(stock__gt=0) if in_stock else Q()
+
+        results = queryset.filter(collection_filter & price_filter & stock_filter)
+        collections = queryset.filter(price_filter & stock_filter) \
+            .values('collection_id') \
+            .annotate(count=Count('pk')) \
+            .values_list('collection_id', 'count')
+        buckets = self.get_buckets()
+        prices = queryset.filter(collection_filter & stock_filter).aggregate(**{
+            f'bucket_{index}': Count('pk', filter=Q(price__gte=low) & (Q(price__lt=high) if high is not None else Q()))
+            for index, (low, high) in enumerate(buckets)
+        })
+        return {
+            'ids': list(results.order_by(*ordering).values_list('pk', flat=True)[offset:offset + limit]),
+            'count': results.count(),
+            'collections': dict(collections),
+            'prices': [prices[f'bucket_{index}'] for index in range(len(buckets))],
+        }
+
+    # InnoDB maintains the FULLTEXT indexes itself.
+
+    def index(self, product_id, name, description, collection_id, price, stock):
+        pass
+
+    def remove(self, product_id):
+        pass
+
+    def refresh(self, queryset):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def reset(self):
+        pass
+
+
+class InvertedIndexSearch(ProductSearch):
+    """
+    Search with an in-process inverted index, for databases without a full-text index (SQLite in tests
+    and development). The index is built from the products table on first use and kept up to date by
+    the product signals, so every process holds a copy that only follows the writes made by itself.
+
+    Each word maps to a sorted array of the ids of the products holding it, so a product is found in it
+    (to be reindexed or removed) by bisection; each product keeps its words
+    (name first), collection, price in cents and whether it's in stock. A search walks the ids of its
+    rarest word and checks the other words on each product, ranking the matches by the BM25 weight
+    of the words, so it costs no query at all.
+    """
+    def __init__(self, price_buckets, max_results):
+        super().__init__(price_buckets, max_results)
+        self._lock = threading.RLock()
+        self.products = None
+        self.postings = None
+
+    def search(self, text, collection=None, min_price=None, max_price=None, in_stock=False, offset=0, limit=50):
+        self.ensure_built()
+        tokens = tokenize(text)
+        min_cents = to_cents(min_price) if min_price is not None else None
+        max_cents = to_cents(max_price) if max_price is not None else None
+        bucket_bounds = [to_cents(bound) for bound in self.price_buckets]
+        matches = []
+        collections = Counter()
+        prices = [0] * (len(bucket_bounds) + 1)
+
+        with self._lock:
+            if tokens:
+                postings = [self.postings.get(token, ()) for token in tokens]
+                # the ids of the rarest word, the other words are checked on each product.
+                candidates, *_ = sorted(postings, key=len)
+                others = [token for token, ids in zip(tokens, postings) if ids is not candidates]
+                total = len(self.products)
+                weights = {
+                    token: math.log(1 + (total - len(ids) + 0.5) / (len(ids) + 0.5))
+                    for token, ids in zip(tokens, postings)
+                }
+            else:
+                candidates, others = self.products, []
+
+            for product_id in candidates:
+                words, name_length, collection_id, cents, stocked = self.products[product_id]
+                if others and not all(token in words for token in others):
+                    continue
+                price_matches = (min_cents is None or cents >= min_cents) and (max_cents is None or cents <= max_cents)
+                stock_matches = stocked or not in_stock
+                collection_matches = collection is None or collection_id == collection
+                if price_matches and stock_matches:
+                    collections[collection_id] += 1
+                if collection_matches and stock_matches:
+                    prices[bisect_right(bucket_bounds, cents)] += 1
+                if price_matches and stock_matches and collection_matches:
+                    # name words weigh twice as much as description words.
+                    score = sum(weights[token] * (2 if words.index(token) < name_length else 1) for token in tokens) if tokens else 0
+                    matches.append((-score, product_id))
+
+        page = heapq.nsmallest(offset + limit, matches)[offset:]
+        return {'ids': [product_id for _, product_id in page], 'count': len(matches), 'collections': dict(collections), 'prices': prices}
+
+    def ensure_built(self):
+        if self.products is None:
+            with self._lock:
+                if self.products is None:
+                    self.rebuild()
+
+    def rebuild(self):
+        # under the lock, so no product saved meanwhile is skipped.
+        with self._lock:
+            products, postings = {}, {}
+            # by id, so every id is appended at the end of its arrays.
+            rows = models.Product.objects.order_by('pk').values_list('pk', 'name', 'description', 'collection_id', 'price', 'stock')
+            for product_id, *fields in rows.iterator(chunk_size=10000):
+                self.add(products, postings, product_id, *fields)
+            self.products, self.postings = products, postings
+
+    def reset(self):
+        with self._lock:
+            self.products, self.postings = None, None
+
+    def index(self, product_id, name, description, collection_id, price, stock):
+        with self._lock:
+            if self.products is None:
+                # not built yet, it will read the product from the database.
+                return
+            self.discard(product_id)
+            self.add(self.products, self.postings, product_id, name, description, collection_id, price, stock)
+
+    def remove(self, product_id):
+        with self._lock:
+            if self.products is not None:
+                self.discard(product_id)
+
+    def refresh(self, queryset):
+        if self.products is None:
+            return
+        rows = queryset.order_by().values_list('pk', 'name', 'description', 'collection_id', 'price', 'stock')
+        for row in rows.iterator(chunk_size=10000):
+            self.index(*row)
+
+    def add(self, products, postings, product_id, name, description, collection_id, price, stock):
+        name_words = tokenize(name)
+        # interned, so the products share one copy of each word with the postings.
+        words = tuple(sys.intern(word) for word in dict.fromkeys([*name_words, *tokenize(description)]))
+        products[product_id] = (words, len(name_words), collection_id, to_cents(price), stock > 0)
+        for word in words:
+            if (ids := postings.get(word)) is None:
+                ids = postings[word] = array('q')
+            if not ids or ids[-1] < product_id:
+                ids.append(product_id)
+            else:
+                insort(ids, product_id)
+
+    def discard(self, product_id):
+        product = self.products.pop(product_id, None)
+        if product is None:
+            return
+        for word in product[0]:
+            ids = self.postings[word]
+            del ids[bisect_left(ids, product_id)]
+            if not ids:
+                del self.postings[word]
+
+
+def to_cents(price):
+    return int(round(price * 100))
+
+
+def get_product_search():
+    options = getattr(settings, 'STORE_PRODUCT_SEARCH', {})
+    backend = options.get('BACKEND')
+    if backend is None:
+        backend = 'fulltext' if connections[DEFAULT_DB_ALIAS].vendor == 'mysql' else 'inverted-index'
+    search_class = {'fulltext': FullTextSearch, 'inverted-index': InvertedIndexSearch}[backend]
+    return search_class(options.get('PRICE_BUCKETS', [10, 50, 100, 500]), options.get('MAX_RESULTS', 10000))
+
+
+product_search = get_product_search()
@@ -1,9 +1,25 @@
+from collections import defaultdict
+from datetime import timedelta
 from django.contrib.auth import authenticate
-from django.db import transaction
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction, DataError, IntegrityError
+from django.db.models import Case, When, Value, F, Sum, Window, DecimalField, PositiveIntegerField, Exists, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from rest_framework import serializers
+from rest_framework.exceptions import NotFound
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
 from rest_framework_simplejwt.tokens import RefreshToken
 from djoser.serializers import UserSerializer as BaseUserSerializer, UserCreateSerializer as BaseUserCreateSerializer
 from . import models
+from .authentication import deny_list, get_token_for_user
+from .cache import catalog_cache
+from .fieldsets import SparseFieldsetMixin
+from .images import get_requested_variant, select_image
+from .instrumentation import TimedSerializerMixin
+from .sales import get_sales_day, record_sales, set_order_status
+from .search import product_search
 
 
 class SignUpSerializer(BaseUserCreateSerializer):
@@ -17,7 +33,8 @@ class UserToken(serializers.Serializer):
     access = serializers.CharField(read_only=True)
 
     def create_user_token(self, user):
-        refresh = RefreshToken.for_user(user)
+        # the claims let `ClaimsJWTAuthentication` skip loading the user on every request.
+        refresh = get_token_for_user(user)
         access = refresh.access_token
         return {
             "refresh": str(refresh),
@@ -37,38 +54,88 @@ class SignInSerializer(UserToken, serializers.Serializer):
         raise serializers.ValidationError("Invalid email or password!!")
     
 
+class SignOutSerializer(serializers.Serializer):
+    refresh = serializers.CharField(write_only=True)
+
+    def validate_refresh(self, refresh):
+        try:
+            token = RefreshToken(refresh)
+        except TokenError as error:
+            raise serializers.ValidationError(str(error))
+        if str(token.get(jwt_settings.USER_ID_CLAIM)) != str(self.context['user'].id):
+            raise serializers.ValidationError('The token belongs to another user.')
+        return token
+
+    def save(self, **kwargs):
+        # revoke the refresh token and the access token of the request.
+        deny_list.revoke(self.validated_data['refresh'])
+        if access := self.context.get('access'):
+            deny_list.revoke(access)
+
+
 class UserSerializer(BaseUserSerializer):
     class Meta(BaseUserSerializer.Meta):
         model = models.User
         fields = ['id', 'username', 'email', 'first_name', 'last_name']
 
 
-class CollectionSerializer(serializers.ModelSerializer):
-    products_count = serializers.SerializerMethodField()
-
+class CollectionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = models.Collection
         fields = ['id', 'name', 'description', 'products_count']
 
-    def get_products_count(self, collection):
-        return collection.products.count()
-
 
 class ProductImageSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         product_id = self.context['product_id']
         return models.ProductImage.objects.create(product_id=product_id, **validated_data)
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # `?size=thumbnail` (and `&image_format=webp`) point the URL at a derivative instead of the upload.
+        request = self.context.get('request')
+        variant = self.context['image_variant'] if 'image_variant' in self.context else get_requested_variant(request)
+        if variant is not None and data['image']:
+            url = instance.image.storage.url(select_image(instance.image.name, instance.derivatives, variant))
+            data['image'] = request.build_absolute_uri(url) if request is not None else url
+        return data
+
     class Meta:
         model = models.ProductImage
         fields = ['id', 'image']
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsetMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    expandable = ('images',)
+    # the first image alone, for listings (`?fields=id,name,price,image`).
+    optional_fields = ('image',)
+
     images = ProductImageSerializer(many=True, read_only=True)
+    image = serializers.SerializerMethodField()
+
+    def get_image(self, product):
+        # `first_images` is prefetched by `ProductViewSet` when the image is asked for.
+        images = product.first_images if hasattr(product, 'first_images') else product.images.order_by('pk')[:1]
+        return ProductImageSerializer(images[0], context=self.context).data if images else None
+
     class Meta:
         model = models.Product
-        fields = ['id', 'name', 'slug', 'description', 'price', 'stock', 'collection', 'images']
+        fields = ['id', 'name', 'slug', 'description', 'price', 'stock', 'collection', 'images', 'image']
+
+
+class ProductSearchSerializer(serializers.Serializer):
+    """The query parameters of the product search."""
+    q = serializers.CharField(required=False, allow_blank=True, max_length=200)
+    collection = serializers.IntegerField(required=False, min_value=1)
+    min_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, min_value=0)
+    max_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, min_value=0)
+    in_stock = serializers.BooleanField(required=False, default=False)
+    page = serializers.IntegerField(required=False, min_value=1, default=1)
+
+    def validate(self, attrs):
+        if 'min_price' in attrs and 'max_price' in attrs and attrs['min_price'] > attrs['max_price']:
+            raise serializers.ValidationError({'max_price': 'Must not be lower than min_price.'})
+        return attrs
 
 
 class CustomerSerializer(serializers.ModelSerializer):
@@ -98,27 +165,44 @@ class RetrieveCartItemSerializer(serializers.ModelSerializer):
 class AddCartItemSerializer(serializers.ModelSerializer):
     product_id = serializers.IntegerField()
 
-    def validate_product_id(self, id):
-        if not models.Product.objects.filter(pk=id).exists():
-            raise serializers.ValidationError('No product with the given id is exist.')
-        return id
+    def validate(self, data):
+        try:
+            cart_id = models.Cart._meta.pk.to_python(self.context['cart_id'])
+        except DjangoValidationError:
+            raise NotFound('No cart with the given id is exist.')
+        # the product's price and the cart's line of it, if any, with one query.
+        line = models.CartItem.objects.filter(cart_id=cart_id, product_id=OuterRef('pk'))
+        self.product = models.Product.objects \
+            .filter(pk=data['product_id']) \
+            .annotate(line_id=Subquery(line.values('pk')), line_quantity=Subquery(line.values('quantity'))) \
+            .values('price', 'line_id', 'line_quantity') \
+            .first()
+        if self.product is None:
+            raise serializers.ValidationError({'product_id': ['No product with the given id is exist.']})
+        max_quantity = self.fields['quantity'].max_value
+        if (self.product['line_quantity'] or 0) + data['quantity'] > max_quantity:
+            raise serializers.ValidationError({'quantity': [f'A cart holds at most {max_quantity} units of a product.']})
+        return data
 
     def save(self, **kwargs):
         cart_id = self.context['cart_id']
         product_id = self.validated_data['product_id']
         quantity = self.validated_data['quantity']
-        try:
-            # check for the existance of a product in a cart as a cart item.
-            cart_item = models.CartItem.objects.get(cart_id=cart_id, product_id=product_id)
-            # update the quantity for an existing product
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-
-        except models.CartItem.DoesNotExist:
-            # add the given product to the cart as a new cart item
-            self.instance =  models.CartItem.objects.create(cart_id=cart_id, **self.validated_data)
-        
+        line_id = self.product['line_id']
+        with transaction.atomic():
+            if line_id is None:
+                # add the given product to the cart as a new cart item
+                self.instance = models.CartItem.objects.create(cart_id=cart_id, product_id=product_id, quantity=quantity)
+            else:
+                # update the quantity for an existing product
+                models.CartItem.objects.filter(pk=line_id).update(quantity=F('quantity') + quantity)
+                self.instance = models.CartItem(
+                    pk=line_id, cart_id=cart_id, product_id=product_id, quantity=self.product['line_quantity'] + quantity,
+                )
+            models.Cart.objects \
+                .filter(pk=cart_id) \
+                .add_to_totals(quantity * self.product['price'], items_count=1 if line_id is None else 0)
+
         return self.instance
 
     class Meta:
@@ -126,37 +210,106 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product_id', 'quantity']
 
 
+class BulkAddCartItemListSerializer(serializers.ListSerializer):
+    def get_quantities(self, lines):
+        quantities = defaultdict(int)
+        for line in lines:
+            quantities[line['product_id']] += line['quantity']
+        return quantities
+
+    def validate(self, lines):
+        # validate every product id, and the quantity each line of the cart would end up with,
+        # with one query instead of one `exists()` per line.
+        quantities = self.get_quantities(lines)
+        try:
+            cart_id = models.Cart._meta.pk.to_python(self.context['cart_id'])
+        except DjangoValidationError:
+            raise NotFound('No cart with the given id is exist.')
+        in_cart = models.CartItem.objects.filter(cart_id=cart_id, product_id=OuterRef('pk')).values('quantity')
+        self.products = {
+            product['pk']: product for product in models.Product.objects
+            .filter(pk__in=quantities.keys())
+            .annotate(in_cart=Coalesce(Subquery(in_cart), 0))
+            .values('pk', 'price', 'in_cart')
+        }
+        if missing_ids := quantities.keys() - self.products.keys():
+            raise serializers.ValidationError(
+                f'No products exist with the given ids: {", ".join(str(id) for id in sorted(missing_ids))}.'
+            )
+        max_quantity = self.child.fields['quantity'].max_value
+        if over_ids := [product_id for product_id, quantity in quantities.items() if self.products[product_id]['in_cart'] + quantity > max_quantity]:
+            raise serializers.ValidationError(
+                f'A cart holds at most {max_quantity} units of a product, exceeded for the ids: {", ".join(str(id) for id in sorted(over_ids))}.'
+            )
+        return lines
+
+    def save(self, **kwargs):
+        cart_id = self.context['cart_id']
+        quantities = self.get_quantities(self.validated_data)
+
+        subtotal = sum(quantity * self.products[product_id]['price'] for product_id, quantity in quantities.items())
+        # a line added concurrently since `validate()` is counted twice, until `refresh_totals()` repairs it.
+        new_lines = sum(1 for product_id in quantities if self.products[product_id]['in_cart'] == 0)
+        try:
+            with transaction.atomic():
+                models.CartItem.objects.add_quantities(cart_id, quantities)
+                models.Cart.objects.filter(pk=cart_id).add_to_totals(subtotal, items_count=new_lines)
+        except (IntegrityError, DjangoValidationError):
+            raise NotFound('No cart with the given id is exist.')
+        except DataError:
+            # a concurrent addition to the same lines since `validate()` went over the limit.
+            max_quantity = self.child.fields['quantity'].max_value
+            raise serializers.ValidationError(f'A cart holds at most {max_quantity} units of a product.')
+
+        self.instance = models.CartItem.objects \
+            .filter(cart_id=cart_id, product_id__in=quantities.keys()) \
+            .select_related('product')
+        return self.instance
+
+
+class BulkAddCartItemSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, max_value=32767)
+
+    class Meta:
+        list_serializer_class = BulkAddCartItemListSerializer
+
+
 class UpdateCartItemSerializer(serializers.ModelSerializer):
+    def update(self, instance, validated_data):
+        previous_quantity = instance.quantity
+        with transaction.atomic():
+            cart_item = super().update(instance, validated_data)
+            # the product is loaded with the item, see `CartItemViewSet.get_queryset()`.
+            change = (cart_item.quantity - previous_quantity) * cart_item.product.price
+            models.Cart.objects.filter(pk=cart_item.cart_id).add_to_totals(change)
+        return cart_item
+
     class Meta:
         model = models.CartItem
         fields = ['quantity']
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     id = serializers.UUIDField(read_only=True)
     items = RetrieveCartItemSerializer(many=True, read_only=True)
-    total_price = serializers.SerializerMethodField()
-    items_count = serializers.SerializerMethodField()
-
-    def get_total_price(self, cart:models.Cart):
-        return sum([(item.quantity * item.product.price) for item in cart.items.all()])
-    
-    def get_items_count(self, cart:models.Cart):
-        return cart.items.count()
+    total_price = serializers.DecimalField(source='subtotal', max_digits=12, decimal_places=2, coerce_to_string=False, read_only=True)
 
     class Meta:
         model = models.Cart
         fields = ['id', 'items', 'total_price', 'items_count']
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     product = SimpleProductSerializer()
     class Meta:
         model = models.OrderItem
         fields = ['id', 'product', 'unit_price', 'quantity']
 
 
-class RetrieveOrderSerializer(serializers.ModelSerializer):
+class RetrieveOrderSerializer(SparseFieldsetMixin, TimedSerializerMixin, serializers.ModelSerializer):
+    expandable = ('items', 'items.product')
+
     items = OrderItemSerializer(many=True)
     class Meta:
         model = models.Order
@@ -173,47 +326,103 @@ class CreateOrderSerializer(serializers.Serializer):
             - No cart with the given id
             - The cart with the given id is empty
         """
-        if not models.Cart.objects.filter(pk=cart_id).exists():
+        # a single query answers both: no row means no cart, no item an empty one. The items themselves are
+        # checked rather than the materialized `items_count`, which a missed total would leave off.
+        has_items = models.Cart.objects \
+            .filter(pk=cart_id) \
+            .annotate(has_items=Exists(models.CartItem.objects.filter(cart=OuterRef('pk')))) \
+            .values_list('has_items', flat=True) \
+            .first()
+        if has_items is None:
             raise serializers.ValidationError('There is no cart exist with the given cart id!')
-        elif models.Cart.objects.get(pk=cart_id).items.count() == 0:
+        elif not has_items:
             raise serializers.ValidationError('Can not create an order with an empty cart!')
         return cart_id
 
     def save(self, **kwargs):
         with transaction.atomic():
             cart_id = self.validated_data['cart_id']
-            customer = models.Customer.objects.get(user_id = self.context['user_id'])
-
-            cart_items = models.CartItem.objects.select_related('product').filter(cart_id=cart_id)
-            items_cost = sum([item.product.price * item.quantity for item in cart_items])
+            # the customer comes from the token claims, see `store.authentication`.
+            customer_id = self.context['customer_id']
+
+            # fetch the cart lines once, with the order cost summed by the database over the same rows.
+            cart_items = list(
+                models.CartItem.objects
+                .filter(cart_id=cart_id)
+                .annotate(cost=Window(Sum(F('quantity') * F('product__price'), output_field=DecimalField(max_digits=20, decimal_places=5))))
+                .values_list('product_id', 'quantity', 'product__price', 'cost', 'product__collection_id')
+            )
+            if not cart_items:
+                raise serializers.ValidationError({'cart_id': ['Can not create an order with an empty cart!']})
+            self.reserve_stock({product_id: quantity for product_id, quantity, *_ in cart_items})
 
             # Creating an order
-            order = models.Order.objects.create(customer = customer, cost=items_cost)
+            order = models.Order.objects.create(customer_id = customer_id, cost=cart_items[0][3])
 
             # creating order item instance for each cart item and associate it with the created order.
             order_items = [
                 models.OrderItem(
                     order=order,
-                    product = item.product,
-                    unit_price = item.product.price,
-                    quantity= item.quantity,
-                ) for item in cart_items
+                    product_id = product_id,
+                    unit_price = price,
+                    quantity= quantity,
+                ) for product_id, quantity, price, *_ in cart_items
             ]
 
             # Save the order items in the database
             models.OrderItem.objects.bulk_create(order_items)
 
-            # deleting the cart will delete its cart items.
-            models.Cart.objects.get(pk=cart_id).delete()
+            # deleting the cart will delete its cart items (an unsaved instance spares reading the cart row first).
+            models.Cart(pk=cart_id).delete()
 
+            record_sales(
+                get_sales_day(order),
+                [(product_id, collection_id, quantity, price) for product_id, quantity, price, _, collection_id in cart_items],
+                [(order.status, 1)],
+            )
             return order
-        
+
+    def reserve_stock(self, quantities):
+        """
+        Take the ordered quantities out of stock with a single conditional UPDATE.
+        Each row is only decremented if it holds enough stock, and the rows are locked in product id
+        order so concurrent checkouts over the same products can't deadlock each other.
+        If any product falls short, the whole order is rejected and the surrounding transaction rolls back.
+        """
+        requested = Case(
+            *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+            output_field=PositiveIntegerField(),
+        )
+        reserved = models.Product.objects \
+            .filter(pk__in=quantities.keys(), stock__gte=requested) \
+            .order_by('pk') \
+            .update(stock=F('stock') - requested, last_updated_at=timezone.now())
+
+        if reserved != len(quantities):
+            short = models.Product.objects \
+                .filter(pk__in=quantities.keys(), stock__lt=requested) \
+                .values_list('name', flat=True)
+            raise serializers.ValidationError({'cart_id': [f'Not enough stock for: {", ".join(short)}.']})
+
+        # `update()` skips the model signals, so once the order commits, invalidate the cached product payloads
+        # and refresh the search index, whose `in_stock` filter follows the stock.
+        product_ids = list(quantities)
+
+        def on_commit():
+            catalog_cache.bump(*[f'product:{product_id}' for product_id in product_ids], 'product-list')
+            product_search.refresh(models.Product.objects.filter(pk__in=product_ids))
+
+        transaction.on_commit(on_commit)
+
 
 class AdminUpdateOrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Order
         fields = ['status']
 
+    def update(self, instance, validated_data):
+        return set_order_status(instance, validated_data.get('status', instance.status))
+
 
 class UserCancelOrderSerializer(serializers.ModelSerializer):
     class Meta:
@@ -221,6 +430,49 @@ class UserCancelOrderSerializer(serializers.ModelSerializer):
         fields = ['status']
 
     def update(self, instance, validated_data):
-        instance.status = 'C'
-        instance.save()
-        return instance
\ No newline at end of file
+        return set_order_status(instance, 'C')
+
+class SalesReportSerializer(serializers.Serializer):
+    """The query parameters of the sales reports."""
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    status = serializers.MultipleChoiceField(choices=models.Order.STATUS_CHOICES, required=False)
+    limit = serializers.IntegerField(required=False, min_value=1, max_value=1000, default=100)
+
+    def validate(self, attrs):
+        # the last 30 days, and the orders that weren't canceled, by default.
+        attrs.setdefault('end', timezone.localdate())
+        attrs.setdefault('start', attrs['end'] - timedelta(days=29))
+        if attrs['start'] > attrs['end']:
+            raise serializers.ValidationError({'end': 'Must not be before start.'})
+        attrs['status'] = sorted(attrs.get('status') or [code for code, _ in models.Order.STATUS_CHOICES if code != 'C'])
+        return attrs
+
+
+class SalesTotalsSerializer(serializers.Serializer):
+    orders = serializers.IntegerField(source='total_orders')
+    quantity = serializers.IntegerField(source='total_quantity')
+    revenue = serializers.DecimalField(max_digits=20, decimal_places=2, source='total_revenue')
+
+
+class DailySalesSerializer(serializers.Serializer):
+    day = serializers.DateField()
+    orders = serializers.IntegerField(source='total_orders')
+    quantity = serializers.IntegerField(source='total_quantity')
+    revenue = serializers.DecimalField(max_digits=20, decimal_places=2, source='total_revenue')
+
+
+class ProductSalesSerializer(serializers.Serializer):
+    id = serializers.IntegerField(source='product_id')
+    name = serializers.CharField(source='product__name')
+    orders = serializers.IntegerField(source='total_orders')
+    quantity = serializers.IntegerField(source='total_quantity')
+    revenue = serializers.DecimalField(max_digits=20, decimal_places=2, source='total_revenue')
+
+
+class CollectionSalesSerializer(serializers.Serializer):
+    id = serializers.IntegerField(source='collection_id')
+    name = serializers.CharField(source='collection__name')
+    orders = serializers.IntegerField(source='total_orders')
+    quantity = serializers.IntegerField(source='total_quantity')
+    revenue = serializers.DecimalField(max_digits=20, decimal_places=2, source='total_revenue')
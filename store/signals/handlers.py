@@ -1,10 +1,163 @@
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
-from store.models import Customer
+from django.utils import timezone
+from store.authentication import deny_list
+from store.cache import catalog_cache
+from store.images import derivative_pipeline, delete_derivatives
+from store.instrumentation import record_query
+from store.search import product_search
+from store.models import Customer, Collection, Product, ProductImage, Cart, CartItem
+
+
+TOKEN_SENSITIVE_FIELDS = ('is_staff', 'is_active', 'password')
+
 
 @receiver(signal=post_save, sender= settings.AUTH_USER_MODEL)
 def create_cutomer_for_new_user(sender, **kwargs):
     if kwargs['created']:
         user = kwargs['instance']
-        Customer.objects.create(user=user)
\ No newline at end of file
+        Customer.objects.create(user=user)
+
+
+@receiver(signal=pre_save, sender=settings.AUTH_USER_MODEL)
+def remember_user_credentials(sender, **kwargs):
+    user = kwargs['instance']
+    update_fields = kwargs['update_fields']
+    # only the fields being saved can change, a save of none of them (e.g. `last_login` at sign-in) reads nothing.
+    fields = [field for field in TOKEN_SENSITIVE_FIELDS if update_fields is None or field in update_fields]
+    user._previous_credentials = (
+        (fields, sender.objects.filter(pk=user.pk).values_list(*fields).first())
+        if user.pk and fields else None
+    )
+
+
+@receiver(signal=post_save, sender=settings.AUTH_USER_MODEL)
+def revoke_stale_tokens(sender, **kwargs):
+    user = kwargs['instance']
+    fields, previous = getattr(user, '_previous_credentials', None) or (None, None)
+    # the tokens carry `is_staff` and are trusted without checking `is_active` or the password again.
+    if previous is not None and previous != tuple(getattr(user, field) for field in fields):
+        deny_list.revoke_user(user.pk)
+
+
+@receiver(signal=post_delete, sender=settings.AUTH_USER_MODEL)
+def revoke_deleted_user_tokens(sender, **kwargs):
+    deny_list.revoke_user(kwargs['instance'].pk)
+
+
+@receiver(signal=pre_save, sender=Product)
+def remember_product_state(sender, **kwargs):
+    product = kwargs['instance']
+    # keep the collection the product is being moved out of, so both collections get invalidated,
+    # and its previous price, so the carts holding it are only repriced when it changed.
+    product._previous_collection_id, product._previous_price = (
+        Product.objects.filter(pk=product.pk).values_list('collection_id', 'price').first()
+        if product.pk else None
+    ) or (None, None)
+
+
+# registered ahead of the cache invalidation, so a payload is never re-cached with the old count.
+@receiver(signal=post_save, sender=Product)
+def count_saved_product(sender, **kwargs):
+    product = kwargs['instance']
+    previous_collection_id = getattr(product, '_previous_collection_id', None)
+    if kwargs['created'] or previous_collection_id != product.collection_id:
+        Collection.objects.adjust_products_count({product.collection_id: 1, previous_collection_id: -1})
+
+
+@receiver(signal=post_delete, sender=Product)
+def count_deleted_product(sender, **kwargs):
+    Collection.objects.adjust_products_count({kwargs['instance'].collection_id: -1})
+
+
+@receiver(signal=post_save, sender=Product)
+def reprice_carts(sender, **kwargs):
+    product = kwargs['instance']
+    previous_price = getattr(product, '_previous_price', None)
+    if previous_price is not None and previous_price != product.price:
+        Cart.objects \
+            .filter(pk__in=CartItem.objects.filter(product_id=product.pk).values('cart_id')) \
+            .reprice(product.pk, product.price - previous_price)
+
+
+@receiver(signal=post_save, sender=Product)
+def index_saved_product(sender, **kwargs):
+    product = kwargs['instance']
+    fields = (product.pk, product.name, product.description, product.collection_id, product.price, product.stock)
+    # on commit, so a rolled back write never reaches the search index.
+    transaction.on_commit(lambda: product_search.index(*fields))
+
+
+@receiver(signal=post_delete, sender=Product)
+def unindex_deleted_product(sender, **kwargs):
+    product_id = kwargs['instance'].pk
+    transaction.on_commit(lambda: product_search.remove(product_id))
+
+
+@receiver(signal=post_save, sender=Product)
+@receiver(signal=post_delete, sender=Product)
+def invalidate_product_cache(sender, **kwargs):
+    product = kwargs['instance']
+    collection_ids = {product.collection_id, getattr(product, '_previous_collection_id', None)} - {None}
+    catalog_cache.bump_on_commit(
+        f'product:{product.pk}', 'product-list',
+        *[f'collection:{collection_id}' for collection_id in collection_ids], 'collection-list',
+    )
+
+
+@receiver(signal=pre_save, sender=ProductImage)
+def forget_stale_derivatives(sender, **kwargs):
+    image = kwargs['instance']
+    # the file of a new upload is only written after this signal, the derivatives of the replaced one are dropped.
+    image._stale_derivatives = None
+    if image.image and not image.image._committed:
+        image._stale_derivatives, image.derivatives = image.derivatives, {}
+
+
+@receiver(signal=post_save, sender=ProductImage)
+def schedule_derivatives(sender, **kwargs):
+    image = kwargs['instance']
+    stale = getattr(image, '_stale_derivatives', None)
+    if stale is not None:
+        transaction.on_commit(lambda: delete_derivatives(stale))
+        derivative_pipeline.schedule(image)
+
+
+@receiver(signal=post_delete, sender=ProductImage)
+def delete_image_derivatives(sender, **kwargs):
+    derivatives = kwargs['instance'].derivatives
+    transaction.on_commit(lambda: delete_derivatives(derivatives))
+
+
+@receiver(signal=post_save, sender=ProductImage)
+@receiver(signal=post_delete, sender=ProductImage)
+def touch_product_of_image(sender, **kwargs):
+    image = kwargs['instance']
+    # the images are part of the product payload, its `last_updated_at` validates them too.
+    if image.product_id is not None:
+        Product.objects.filter(pk=image.product_id).update(last_updated_at=timezone.now())
+
+
+@receiver(signal=post_save, sender=ProductImage)
+@receiver(signal=post_delete, sender=ProductImage)
+def invalidate_product_image_cache(sender, **kwargs):
+    image = kwargs['instance']
+    if image.product_id is not None:
+        catalog_cache.bump_on_commit(f'product:{image.product_id}', 'product-list')
+
+
+@receiver(signal=post_save, sender=Collection)
+@receiver(signal=post_delete, sender=Collection)
+def invalidate_collection_cache(sender, **kwargs):
+    collection = kwargs['instance']
+    catalog_cache.bump_on_commit(f'collection:{collection.pk}', 'collection-list')
+
+
+@receiver(signal=connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    # a reconnection of the same connection fires the signal again.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
@@ -1,3 +1,1136 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import skipUnless
+from asgiref.sync import sync_to_async
+from PIL import Image
+from django.contrib.auth.hashers import get_hasher, make_password
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.db.models import Sum
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from .authentication import TokenDenyList, get_token_for_user
+from .cache import CatalogCache, catalog_cache
+from .exports import EXPORT_FIELDS, iter_products, render_csv
+from .checks import check_deny_list_cache
+from .factories import create_catalog, create_carts, create_customers, create_orders
+from .images import derivative_pipeline
+from .imaging import render_derivatives
+from .metrics import MetricsRegistry
+from .models import User, Customer, Collection, Product, ProductImage, Cart, Order, OrderItem, DailySales, DailyProductSales, DailyCollectionSales
+from .pagination import KeysetPagination
+from .passwords import HashingPoolFull, PasswordHashingPool
+from .reaper import CartReaper
+from .replicas import get_cookie_name, read_replicas
+from .sales import rebuild_sales
+from .search import InvertedIndexSearch, ProductSearch, product_search
+from .serializers import CreateOrderSerializer, ProductSerializer
 
-# Create your tests here.
+
+SAVEPOINT_RE = re.compile(r'^\s*(SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b', re.IGNORECASE)
+
+# Maximum number of SQL statements each endpoint may run, keyed by (route name, method).
+# The budgets must not depend on the number of rows involved, so they're measured against
+# a fixture with several rows per relation.
+# The cart reads include the timestamp query of their ETag (see store/conditional.py), the catalog reads
+# validate theirs by the versions of the catalog cache; the deletes include the queries of the cascade.
+QUERY_BUDGETS = {
+    ('sign-up-list', 'POST'): 4,
+    ('sign-in-list', 'POST'): 2,
+    ('sign-in-async', 'POST'): 1,
+    ('sign-in-metrics', 'GET'): 0,
+    ('sign-out-list', 'POST'): 0,
+    ('profile-detail', 'GET'): 1,
+    ('profile-detail', 'PUT'): 4,
+    ('profile-detail', 'PATCH'): 3,
+    ('collection-list', 'GET'): 1,
+    ('collection-list', 'POST'): 1,
+    ('collection-detail', 'GET'): 1,
+    ('collection-detail', 'PUT'): 2,
+    ('collection-detail', 'PATCH'): 2,
+    ('collection-detail', 'DELETE'): 10,
+    ('product-list', 'GET'): 2,
+    ('product-list', 'POST'): 5,
+    ('product-detail', 'GET'): 2,
+    ('product-detail', 'PUT'): 8,
+    ('product-detail', 'PATCH'): 6,
+    ('product-detail', 'DELETE'): 11,
+    ('product-export', 'GET'): 3,
+    # the page of products, their images and the facet collection names, plus the four search queries on MySQL.
+    ('product-search', 'GET'): 7,
+    ('product-image-list', 'GET'): 1,
+    ('product-image-detail', 'GET'): 1,
+    ('product-image-detail', 'DELETE'): 3,
+    ('async-product-list', 'GET'): 2,
+    ('async-product-detail', 'GET'): 2,
+    ('async-collection-list', 'GET'): 1,
+    ('async-collection-detail', 'GET'): 1,
+    ('async-cart-detail', 'GET'): 3,
+    ('customer-list', 'GET'): 1,
+    ('customer-detail', 'GET'): 1,
+    ('customer-detail', 'PUT'): 2,
+    ('customer-detail', 'PATCH'): 2,
+    ('customer-detail', 'DELETE'): 3,
+    ('customer-me', 'GET'): 1,
+    ('customer-me', 'PUT'): 2,
+    ('cart-list', 'GET'): 3,
+    ('cart-list', 'POST'): 4,
+    ('cart-detail', 'GET'): 3,
+    ('cart-detail', 'DELETE'): 4,
+    ('cart-item-list', 'GET'): 1,
+    ('cart-item-list', 'POST'): 3,
+    ('cart-item-bulk', 'POST'): 4,
+    ('cart-item-detail', 'GET'): 1,
+    ('cart-item-detail', 'PATCH'): 3,
+    ('cart-item-detail', 'DELETE'): 3,
+    ('order-list', 'GET'): 2,
+    ('order-detail', 'GET'): 2,
+    # the order writes end with one upsert per sales rollup, in the order's transaction (see store/sales.py).
+    ('order-list', 'POST'): 11,
+    ('order-detail', 'PATCH'): 8,
+    ('order-detail', 'DELETE'): 9,
+    ('sales-report-list', 'GET'): 1,
+    ('sales-report-products', 'GET'): 1,
+    ('sales-report-collections', 'GET'): 1,
+    ('metrics-list', 'GET'): 0,
+}
+
+# Routes ranking grouped rows (e.g. the best sellers of the sales rollups): their sort runs over the
+# groups, which no index can hold in order, so only their table accesses are checked.
+RANKED_ROUTES = {'sales-report-products', 'sales-report-collections'}
+
+
+def get_statements(recorded):
+    # savepoints are left out, so the counts don't depend on whether the request is nested in a transaction.
+    return [query['sql'] for query in recorded.captured_queries if not SAVEPOINT_RE.match(query['sql'])]
+
+
+class StoreTestCase(APITestCase):
+    """A catalog of `rows` products with `rows` images each, two carts holding all of them and `rows` orders."""
+    rows = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username='test-staff', email='test-staff@example.com', password='test', is_staff=True)
+        cls.user = User.objects.create_user(username='test-user', email='test-user@example.com', password='test')
+        cls.customer = cls.user.customer
+        (cls.collection,), cls.products = create_catalog('test', cls.rows, images=cls.rows)
+        cls.product, cls.other_product = cls.products[0], cls.products[-1]
+        cls.image = cls.product.images.first()
+        cls.cart, cls.order_cart = create_carts(2, lambda index: [(product, 2) for product in cls.products])
+        cls.cart_item = cls.cart.items.first()
+        cls.order = create_orders(cls.customer, cls.products, cls.rows)[-1]
+        # in no cart or order, so it can be deleted.
+        (_,), (cls.spare_product,) = create_catalog('spare', 1)
+
+    def setUp(self):
+        catalog_cache.clear()
+        # the in-process search index is built here rather than by the first search.
+        product_search.rebuild()
+
+    def tearDown(self):
+        product_search.reset()
+
+    def authenticate(self, user):
+        if user is None:
+            self.client.credentials()
+        else:
+            # a real token rather than `force_authenticate()`, so authenticating the request is measured too.
+            self.client.credentials(HTTP_AUTHORIZATION=f'JWT {get_token_for_user(user).access_token}')
+
+    def send(self, method, url, data=None):
+        response = getattr(self.client, method.lower())(url, data=data, format='json')
+        if response.streaming:
+            # the body of a streaming response is only produced (and queried for) while it's consumed.
+            b''.join(response.streaming_content)
+        return response
+
+
+class QueryBudgetTests(StoreTestCase):
+    def get_cases(self):
+        staff, user, product, cart = self.staff, self.user, self.product, self.cart
+        product_data = {'name': 'test new', 'slug': 'test-new', 'price': 12, 'stock': 3, 'collection': self.collection.pk}
+        customer_data = {'phone': '555', 'address': 'test street'}
+        return [
+            ('sign-up-list', 'POST', None, {'username': 'test-new', 'email': 'test-new@example.com', 'password': 'Budget-pass-123'}, None),
+            ('sign-in-list', 'POST', None, {'email': user.email, 'password': 'test'}, None),
+            ('sign-in-async', 'POST', None, {'email': user.email, 'password': 'test'}, None),
+            ('sign-in-metrics', 'GET', None, None, staff),
+            ('sign-out-list', 'POST', None, {'refresh': str(get_token_for_user(user))}, user),
+            ('profile-detail', 'GET', {'pk': user.pk}, None, user),
+            ('profile-detail', 'PUT', {'pk': user.pk}, {'username': 'test-user', 'email': user.email, 'first_name': 'Test'}, user),
+            ('profile-detail', 'PATCH', {'pk': user.pk}, {'first_name': 'Budget'}, user),
+            ('collection-list', 'GET', None, None, None),
+            ('collection-list', 'POST', None, {'name': 'test new'}, None),
+            ('collection-detail', 'GET', {'pk': self.collection.pk}, None, None),
+            ('collection-detail', 'PUT', {'pk': self.collection.pk}, {'name': 'test renamed'}, None),
+            ('collection-detail', 'PATCH', {'pk': self.collection.pk}, {'description': 'test'}, None),
+            ('collection-detail', 'DELETE', {'pk': self.spare_product.collection_id}, None, None),
+            ('product-list', 'GET', None, None, None),
+            ('product-list', 'GET', None, {'fields': 'id,name,price,image'}, None),
+            ('product-list', 'POST', None, product_data, None),
+            ('product-detail', 'GET', {'pk': product.pk}, None, None),
+            ('product-detail', 'PUT', {'pk': product.pk}, {**product_data, 'price': 13}, None),
+            ('product-detail', 'PATCH', {'pk': product.pk}, {'price': 14}, None),
+            ('product-detail', 'DELETE', {'pk': self.spare_product.pk}, None, None),
+            ('product-export', 'GET', None, None, staff),
+            ('product-search', 'GET', None, {'q': 'test product', 'in_stock': 'true'}, None),
+            ('product-image-list', 'GET', {'product_pk': product.pk}, None, None),
+            ('product-image-detail', 'GET', {'product_pk': product.pk, 'pk': self.image.pk}, None, None),
+            ('product-image-detail', 'DELETE', {'product_pk': product.pk, 'pk': self.image.pk}, None, None),
+            ('async-product-list', 'GET', None, None, None),
+            ('async-product-list', 'GET', None, {'fields': 'id,name,price,image'}, None),
+            ('async-product-detail', 'GET', {'pk': product.pk}, None, None),
+            ('async-collection-list', 'GET', None, None, None),
+            ('async-collection-detail', 'GET', {'pk': self.collection.pk}, None, None),
+            ('async-cart-detail', 'GET', {'pk': cart.pk}, None, None),
+            ('customer-list', 'GET', None, None, staff),
+            ('customer-detail', 'GET', {'pk': self.customer.pk}, None, staff),
+            ('customer-detail', 'PUT', {'pk': self.customer.pk}, customer_data, staff),
+            ('customer-detail', 'PATCH', {'pk': self.customer.pk}, {'phone': '556'}, staff),
+            ('customer-detail', 'DELETE', {'pk': self.staff.customer.pk}, None, staff),
+            ('customer-me', 'GET', None, None, user),
+            ('customer-me', 'PUT', None, customer_data, user),
+            ('cart-list', 'GET', None, None, staff),
+            ('cart-list', 'POST', None, {}, None),
+            ('cart-detail', 'GET', {'pk': cart.pk}, None, None),
+            ('cart-detail', 'DELETE', {'pk': cart.pk}, None, None),
+            ('cart-item-list', 'GET', {'cart_pk': cart.pk}, None, None),
+            ('cart-item-list', 'POST', {'cart_pk': cart.pk}, {'product_id': product.pk, 'quantity': 1}, None),
+            ('cart-item-bulk', 'POST', {'cart_pk': cart.pk}, [{'product_id': product.pk, 'quantity': 1}, {'product_id': self.other_product.pk, 'quantity': 2}], None),
+            ('cart-item-detail', 'GET', {'cart_pk': cart.pk, 'pk': self.cart_item.pk}, None, None),
+            ('cart-item-detail', 'PATCH', {'cart_pk': cart.pk, 'pk': self.cart_item.pk}, {'quantity': 3}, None),
+            ('cart-item-detail', 'DELETE', {'cart_pk': cart.pk, 'pk': self.cart_item.pk}, None, None),
+            ('order-list', 'GET', None, None, user),
+            ('order-list', 'GET', None, {'fields': 'id,status,cost'}, user),
+            ('order-detail', 'GET', {'pk': self.order.pk}, None, user),
+            ('order-list', 'POST', None, {'cart_id': str(self.order_cart.pk)}, user),
+            ('order-detail', 'PATCH', {'pk': self.order.pk}, {'status': 'S'}, staff),
+            ('order-detail', 'DELETE', {'pk': self.order.pk}, None, staff),
+            ('sales-report-list', 'GET', None, None, staff),
+            ('sales-report-products', 'GET', None, None, staff),
+            ('sales-report-collections', 'GET', None, None, staff),
+            ('metrics-list', 'GET', None, None, staff),
+        ]
+
+    def test_every_budget_is_checked(self):
+        self.assertEqual({(route, method) for route, method, *_ in self.get_cases()}, set(QUERY_BUDGETS))
+
+    def test_query_budgets(self):
+        for route, method, kwargs, data, user in self.get_cases():
+            with self.subTest(route=route, method=method, data=data):
+                self.authenticate(user)
+                # the cold path, not a catalog cache hit.
+                catalog_cache.clear()
+                # every case starts from the same fixture.
+                with transaction.atomic():
+                    with CaptureQueriesContext(connection) as recorded:
+                        response = self.send(method, reverse(route, kwargs=kwargs), data)
+                    transaction.set_rollback(True)
+                self.assertLess(response.status_code, 400, getattr(response, 'data', None))
+                statements = get_statements(recorded)
+                self.assertLessEqual(
+                    len(statements), QUERY_BUDGETS[(route, method)],
+                    '\n'.join(f'{i}. {sql}' for i, sql in enumerate(statements, start=1)),
+                )
+
+
+class SparseFieldsetTests(StoreTestCase):
+    def get(self, route, kwargs=None, **params):
+        with CaptureQueriesContext(connection) as recorded:
+            response = self.client.get(reverse(route, kwargs=kwargs), params)
+        return response, get_statements(recorded)
+
+    def get_select(self, statements, table):
+        return next(sql for sql in statements if re.match(rf'SELECT .* FROM "{table}"', sql))
+
+    def test_fields_narrow_the_select(self):
+        response, statements = self.get('product-list', fields='id,name')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name'})
+        select = self.get_select(statements, 'store_product')
+        self.assertIn('"store_product"."name"', select)
+        self.assertNotIn('"store_product"."description"', select)
+        # the images aren't asked for, so they aren't prefetched.
+        self.assertFalse([sql for sql in statements if 'store_productimage' in sql])
+
+    def test_expand_prefetches_the_relations(self):
+        kwargs = {'pk': self.product.pk}
+        response, statements = self.get('product-detail', kwargs, fields='id,images', expand='')
+        # collapsed to primary keys, loaded without the image columns.
+        self.assertEqual(response.data['images'], sorted(self.product.images.values_list('pk', flat=True)))
+        self.assertNotIn('"store_productimage"."image"', self.get_select(statements, 'store_productimage'))
+        response, statements = self.get('product-detail', kwargs, fields='id,images', expand='images')
+        self.assertEqual(len(response.data['images']), self.rows)
+        self.assertEqual(set(response.data['images'][0]), {'id', 'image'})
+        self.assertIn('"store_productimage"."image"', self.get_select(statements, 'store_productimage'))
+
+        self.authenticate(self.user)
+        kwargs = {'pk': self.order.pk}
+        response, statements = self.get('order-detail', kwargs, fields='id,items', expand='items')
+        self.assertIsInstance(response.data['items'][0]['product'], int)
+        self.assertNotIn('"store_product"', self.get_select(statements, 'store_orderitem'))
+        response, statements = self.get('order-detail', kwargs, fields='id,items', expand='items.product')
+        self.assertEqual(set(response.data['items'][0]['product']), {'id', 'name', 'price'})
+        # the products are joined to the prefetched items, not queried one by one.
+        self.assertIn('JOIN "store_product"', self.get_select(statements, 'store_orderitem'))
+        self.assertFalse([sql for sql in statements if re.match(r'SELECT .* FROM "store_product"', sql)])
+
+    def test_unknown_fields_are_rejected(self):
+        for params, field in [
+            ({'fields': 'id,secret'}, 'fields'),
+            ({'fields': ','}, 'fields'),
+            ({'expand': 'collection'}, 'expand'),
+        ]:
+            with self.subTest(**params):
+                response, _ = self.get('product-list', **params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(field, response.data)
+
+    def test_plain_django_requests_have_fieldsets(self):
+        # e.g. a serializer given the request outside a view, which has `GET` but no `query_params`.
+        request = RequestFactory().get('/', {'fields': 'id,name'})
+        self.assertEqual(set(ProductSerializer(self.product, context={'request': request}).data), {'id', 'name'})
+
+
+class FastSerializerParityTests(StoreTestCase):
+    """The `.values()` read serializers (STORE_FAST_READ_SERIALIZERS) render the same JSON as the ModelSerializers."""
+    rows = 12
+
+    def follow(self, url):
+        # every page, so the cursors are compared too.
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content[:200])
+            pages.append(response.content)
+            url = response.json().get('next') if isinstance(response.json(), dict) else None
+        return pages
+
+    def test_parity(self):
+        self.authenticate(self.staff)
+        urls = [
+            reverse('product-list') + '?page_size=500',
+            reverse('product-list') + '?page_size=5',
+            reverse('product-list') + '?page_size=5&fields=id,name,price,image',
+            reverse('product-detail', kwargs={'pk': self.product.pk}),
+            reverse('product-detail', kwargs={'pk': self.product.pk}) + '?fields=id,name,images',
+            reverse('collection-list'),
+            reverse('collection-detail', kwargs={'pk': self.collection.pk}),
+            reverse('cart-list') + '?page_size=1',
+            reverse('cart-detail', kwargs={'pk': self.cart.pk}),
+            reverse('cart-item-list', kwargs={'cart_pk': self.cart.pk}),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                contents = []
+                for enabled in (False, True):
+                    with override_settings(STORE_FAST_READ_SERIALIZERS=enabled):
+                        catalog_cache.clear()
+                        contents.append(self.follow(url))
+                self.assertEqual(contents[0], contents[1])
+
+
+@skipUnless(connection.vendor in ('mysql', 'sqlite'), 'EXPLAIN is only parsed for MySQL and SQLite.')
+class QueryPlanTests(StoreTestCase):
+    """
+    Every SELECT the read endpoints issue (first and next cursor pages) is served by an index, neither scanning
+    a whole table nor sorting without one. Run against the engine used in production to check its plans.
+    """
+    rows = 50
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                details = [row[-1] for row in cursor.fetchall()]
+                # scanning or sorting the rows of a subquery (e.g. the first image of each product of a page,
+                # picked by a window function) reads no table: the subquery's own steps are checked.
+                derived = {detail.split(' ', 1)[1] for detail in details if detail.startswith(('CO-ROUTINE ', 'MATERIALIZE '))}
+                filesort = not derived and any(detail.startswith('USE TEMP B-TREE FOR ORDER BY') for detail in details)
+                # a bare SCAN is only acceptable as an ordered walk that the LIMIT cuts short (the first page).
+                page_walk = not filesort and re.search(r'\bORDER BY\b.*\bLIMIT \d+$', sql, re.DOTALL)
+                problems = [
+                    f'full scan ({detail})' for detail in details
+                    if re.match(r'^SCAN \S+$', detail) and detail[5:] not in derived and not page_walk
+                ]
+                if filesort:
+                    problems.append('filesort')
+                return problems, '\n'.join(details)
+
+            cursor.execute(f'EXPLAIN {sql}')
+            columns = [column[0].lower() for column in cursor.description]
+            plan = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            problems = []
+            for step in plan:
+                if step.get('type') == 'ALL':
+                    problems.append(f'full scan of {step.get("table")}')
+                if 'Using filesort' in (step.get('extra') or ''):
+                    problems.append(f'filesort on {step.get("table")}')
+            return problems, '\n'.join(str(step) for step in plan)
+
+    def test_read_queries_use_indexes(self):
+        for route, method, kwargs, data, user in QueryBudgetTests.get_cases(self):
+            if method != 'GET':
+                continue
+            self.authenticate(user)
+            url, params = reverse(route, kwargs=kwargs), {**(data or {}), 'page_size': 2}
+            # the first page, then the next one, which seeks through the keyset cursor.
+            for page in (1, 2):
+                catalog_cache.clear()
+                with CaptureQueriesContext(connection) as recorded:
+                    response = self.send('GET', url, params)
+                for sql in get_statements(recorded):
+                    if not sql.lstrip().upper().startswith('SELECT'):
+                        continue
+                    problems, plan = self.explain(sql)
+                    if route in RANKED_ROUTES:
+                        problems = [problem for problem in problems if not problem.startswith('filesort')]
+                    with self.subTest(route=route, page=page, sql=sql):
+                        self.assertEqual(problems, [], plan)
+
+                is_json = not response.streaming and response['Content-Type'].startswith('application/json')
+                url = response.json().get('next') if is_json and isinstance(response.json(), dict) else None
+                if not url:
+                    break
+                params = None
+
+
+class StockReservationTests(StoreTestCase):
+    def checkout(self, cart):
+        self.authenticate(self.user)
+        return self.client.post(reverse('order-list'), {'cart_id': str(cart.pk)}, format='json')
+
+    def test_checkout_reserves_stock(self):
+        stock = dict(Product.objects.values_list('pk', 'stock'))
+        response = self.checkout(self.order_cart)
+        self.assertEqual(response.status_code, 201, response.content[:200])
+        for product in self.products:
+            self.assertEqual(Product.objects.get(pk=product.pk).stock, stock[product.pk] - 2)
+
+    def test_checkout_refreshes_the_search_index(self):
+        Product.objects.filter(pk=self.other_product.pk).update(stock=2)
+        product_search.rebuild()
+        search = lambda: product_search.search(self.other_product.name, in_stock=True)['ids']
+        self.assertIn(self.other_product.pk, search())
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.checkout(self.order_cart)
+        self.assertEqual(response.status_code, 201, response.content[:200])
+        self.assertNotIn(self.other_product.pk, search())
+
+    def test_checkout_beyond_stock_is_rejected(self):
+        Product.objects.filter(pk=self.other_product.pk).update(stock=1)
+        stock, orders = dict(Product.objects.values_list('pk', 'stock')), Order.objects.count()
+        response = self.checkout(self.order_cart)
+        self.assertEqual(response.status_code, 400, response.content[:200])
+        # the units reserved before the short product are released with the rolled back order.
+        self.assertEqual(dict(Product.objects.values_list('pk', 'stock')), stock)
+        self.assertEqual(Order.objects.count(), orders)
+
+
+class SalesRollupTests(StoreTestCase):
+    def get_rollups(self):
+        return [
+            # a rebuild writes no row for the statuses left without orders.
+            sorted(model.objects.exclude(orders_count=0).values_list('day', 'status', 'orders_count', 'quantity', 'revenue'))
+            for model in (DailySales, DailyProductSales, DailyCollectionSales)
+        ]
+
+    def test_order_writes_match_a_rebuild(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.authenticate(self.user)
+            response = self.client.post(reverse('order-list'), {'cart_id': str(self.order_cart.pk)}, format='json')
+            self.assertEqual(response.status_code, 201, response.content[:200])
+            order_id = response.data['id']
+            self.authenticate(self.staff)
+            response = self.client.patch(reverse('order-detail', args=[self.order.pk]), {'status': 'C'}, format='json')
+            self.assertEqual(response.status_code, 200, response.content[:200])
+            response = self.client.delete(reverse('order-detail', args=[order_id]))
+            self.assertEqual(response.status_code, 204, response.content[:200])
+        rollups = self.get_rollups()
+        day = DailySales.objects.values_list('day', flat=True).first()
+        list(rebuild_sales(day, day))
+        self.assertEqual(rollups, self.get_rollups())
+
+    def test_rolled_back_order_adds_nothing(self):
+        Product.objects.filter(pk=self.other_product.pk).update(stock=1)
+        rollups = self.get_rollups()
+        self.authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('order-list'), {'cart_id': str(self.order_cart.pk)}, format='json')
+        self.assertEqual(response.status_code, 400, response.content[:200])
+        self.assertEqual(self.get_rollups(), rollups)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentCheckoutTests(TransactionTestCase):
+    """Concurrent checkouts of a few hot products never oversell them, nor lose a reserved unit."""
+    threads = 8
+    checkouts = 40
+    stock = 30
+
+    def test_stock_matches_orders(self):
+        rng = random.Random(0)
+        _, products = create_catalog('stress', 3, stock=self.stock)
+        customers = create_customers('stress', self.threads)
+        carts = create_carts(self.checkouts, lambda index: [(product, rng.randint(1, 3)) for product in rng.sample(products, rng.randint(1, 3))])
+
+        def checkout(index):
+            try:
+                serializer = CreateOrderSerializer(data={'cart_id': carts[index].pk}, context={'customer_id': customers[index % len(customers)].pk})
+                serializer.is_valid(raise_exception=True)
+                serializer.save()
+            except serializers.ValidationError:
+                pass
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            list(executor.map(checkout, range(self.checkouts)))
+
+        ordered = dict(
+            OrderItem.objects.filter(product__in=products).values('product_id')
+            .annotate(total=Sum('quantity')).values_list('product_id', 'total')
+        )
+        for product in Product.objects.filter(pk__in=[product.pk for product in products]):
+            self.assertGreaterEqual(product.stock, 0)
+            self.assertEqual(self.stock - product.stock, ordered.get(product.pk, 0))
+
+
+class CartReaperTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.expired = create_carts(5, lambda index: [(self.product, 1), (self.other_product, 2)])
+        Cart.objects.filter(pk__in=[cart.pk for cart in self.expired]).update(updated_at=timezone.now() - timedelta(days=30))
+        self.reaper = CartReaper(ttl=timedelta(days=14), batch_size=2, pause=0)
+
+    def test_expired_carts_are_deleted_in_batches(self):
+        batches = [(carts, items) for carts, items, _ in self.reaper.run()]
+        self.assertEqual(batches, [(2, 4), (2, 4), (1, 2)])
+        self.assertFalse(Cart.objects.filter(pk__in=[cart.pk for cart in self.expired]).exists())
+        # the carts in use are kept, with their items.
+        self.assertEqual(Cart.objects.filter(pk__in=[self.cart.pk, self.order_cart.pk]).count(), 2)
+        self.assertEqual(self.cart.items.count(), self.rows)
+
+    def test_a_run_stops_and_resumes(self):
+        self.assertEqual(len(list(self.reaper.run(max_batches=1))), 1)
+        self.assertEqual(Cart.objects.filter(pk__in=[cart.pk for cart in self.expired]).count(), 3)
+        stop = threading.Event()
+        stop.set()
+        self.assertEqual(list(self.reaper.run(stop)), [])
+        self.assertEqual(sum(carts for carts, _, _ in self.reaper.run()), 3)
+
+    def test_carts_touched_since_they_were_read_are_kept(self):
+        touched = self.expired[0]
+        Cart.objects.filter(pk=touched.pk).update(updated_at=timezone.now())
+        cutoff = timezone.now() - self.reaper.ttl
+        self.assertEqual(self.reaper.delete([cart.pk for cart in self.expired], cutoff), (4, 8))
+        self.assertTrue(Cart.objects.filter(pk=touched.pk).exists())
+
+
+@skipUnlessDBFeature('has_select_for_update_skip_locked')
+class LockedCartReaperTests(TransactionTestCase):
+    def test_locked_carts_are_skipped(self):
+        _, products = create_catalog('reaper', 1)
+        carts = create_carts(3, lambda index: [(products[0], 1)])
+        Cart.objects.update(updated_at=timezone.now() - timedelta(days=30))
+        locked, released = threading.Event(), threading.Event()
+
+        def hold_lock():
+            try:
+                with transaction.atomic():
+                    list(Cart.objects.select_for_update().filter(pk=carts[0].pk))
+                    locked.set()
+                    released.wait(10)
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            holder = executor.submit(hold_lock)
+            locked.wait(10)
+            try:
+                reaped = sum(count for count, _, _ in CartReaper(ttl=timedelta(days=14), batch_size=10, pause=0).run())
+            finally:
+                released.set()
+            holder.result()
+        self.assertEqual(reaped, 2)
+        self.assertEqual(list(Cart.objects.values_list('pk', flat=True)), [carts[0].pk])
+
+
+class KeysetPaginationTests(StoreTestCase):
+    def test_tampered_cursor_is_not_found(self):
+        self.authenticate(self.staff)
+        for route in ('product-list', 'collection-list', 'cart-list', 'customer-list', 'order-list'):
+            for position in (['x', 'x'], [['x'], {}], [None, 'x']):
+                with self.subTest(route=route, position=position):
+                    cursor = KeysetPagination().encode_cursor(position)
+                    response = self.client.get(reverse(route), {'cursor': cursor})
+                    self.assertEqual(response.status_code, 404, response.content[:200])
+
+
+class CatalogCacheTests(StoreTestCase):
+    def test_bumped_on_commit(self):
+        scopes = [f'product:{self.product.pk}']
+        versions = catalog_cache.get_versions(scopes)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.get(pk=self.product.pk).save()
+            # a concurrent read until the commit still sees the previous row, it must not be cached as current.
+            self.assertEqual(catalog_cache.get_versions(scopes), versions)
+        self.assertNotEqual(catalog_cache.get_versions(scopes), versions)
+
+    def test_local_versions_are_bounded(self):
+        cache = CatalogCache(max_entries=10, timeout=300, shared_alias=None)
+        for index in range(100):
+            cache.bump(f'product:{index}')
+        self.assertEqual(len(cache._versions._entries), 10)
+
+
+class RecountCollectionProductsTests(StoreTestCase):
+    def recount(self, *args):
+        output = StringIO()
+        call_command('recount_collection_products', *args, stdout=output)
+        return output.getvalue()
+
+    def test_drifted_counts_are_reported_and_repaired(self):
+        # a write going around the signals, as raw SQL or `bulk_create()` would.
+        Collection.objects.filter(pk=self.collection.pk).update(products_count=self.rows + 7)
+        scopes = [f'collection:{self.collection.pk}', 'collection-list']
+        versions = catalog_cache.get_versions(scopes)
+
+        output = self.recount('--dry-run')
+        self.assertIn(f'stored {self.rows + 7:>8} actual {self.rows:>8}', output)
+        self.assertIn('1 collections drifted.', output)
+        self.assertEqual(Collection.objects.get(pk=self.collection.pk).products_count, self.rows + 7)
+        self.assertEqual(catalog_cache.get_versions(scopes), versions)
+
+        self.assertIn('1 collections repaired.', self.recount())
+        self.assertEqual(Collection.objects.get(pk=self.collection.pk).products_count, self.rows)
+        new_versions = catalog_cache.get_versions(scopes)
+        self.assertTrue(all(new != old for new, old in zip(new_versions, versions)), (versions, new_versions))
+        self.assertIn('0 collections drifted.', self.recount())
+
+
+class ReplicaRoutingTests(StoreTestCase):
+    """The replica is an empty database of its own here, only the statements each side runs are compared."""
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        super().setUp()
+        for name, value in (('aliases', ['replica']), ('max_lag', 0), ('_state', {})):
+            self.addCleanup(setattr, read_replicas, name, getattr(read_replicas, name))
+            setattr(read_replicas, name, value)
+        # checked up front, so the statements counted are the requests' own.
+        self.assertTrue(read_replicas.is_usable('replica'))
+
+    def count_queries(self, method, url, data=None):
+        """The response and the number of statements run on the primary and on the replica."""
+        with CaptureQueriesContext(connections['default']) as primary, CaptureQueriesContext(connections['replica']) as replica:
+            response = self.send(method, url, data)
+        return response, len(primary), len(replica)
+
+    def test_safe_reads_go_to_the_replica(self):
+        self.authenticate(self.user)
+        for url in (reverse('product-list'), reverse('order-list')):
+            with self.subTest(url=url):
+                response, primary, replica = self.count_queries('GET', url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(primary, 0)
+                self.assertGreater(replica, 0)
+
+    def test_writes_go_to_the_primary_and_pin_the_client(self):
+        self.authenticate(self.staff)
+        url = reverse('product-detail', args=[self.product.pk])
+        response, primary, replica = self.count_queries('PATCH', url, {'price': '99.00'})
+        self.assertEqual(response.status_code, 200, response.content[:200])
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+        self.assertIn(get_cookie_name(), response.cookies)
+
+        # the test client sends the cookie back.
+        response, primary, replica = self.count_queries('GET', url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['price'], Decimal('99.00'))
+        self.assertEqual(replica, 0)
+
+    def test_recent_writes_are_cached_from_the_primary(self):
+        read_replicas.max_lag = 60
+        response, primary, replica = self.count_queries('GET', reverse('product-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+
+class ProductExportTests(StoreTestCase):
+    def export(self, query=''):
+        self.authenticate(self.staff)
+        response = self.client.get(f'{reverse("product-export")}{query}')
+        self.assertEqual(response.status_code, 200, getattr(response, 'data', None))
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_chunks_continue_past_the_last_row(self):
+        ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+        for chunk_size in (1, 2, len(ids), len(ids) + 1):
+            with self.subTest(chunk_size=chunk_size):
+                rows = list(iter_products(Product.objects.all(), chunk_size=chunk_size))
+                self.assertEqual([row['id'] for row in rows], ids)
+        self.assertEqual(len(rows[0]['images']), self.rows)
+
+    def test_updated_since_orders_equal_timestamps_by_id(self):
+        since = timezone.now() + timedelta(days=1)
+        changed = [self.other_product.pk, self.product.pk, self.spare_product.pk]
+        Product.objects.filter(pk__in=changed).update(last_updated_at=since)
+        lines = self.export(f'?updated_since={since.isoformat().replace("+", "%2B")}').splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], sorted(changed))
+        # across chunks too.
+        rows = iter_products(Product.objects.filter(last_updated_at__gte=since), ordering=('last_updated_at', 'pk'), chunk_size=1)
+        self.assertEqual([row['id'] for row in rows], sorted(changed))
+
+    def test_invalid_updated_since_is_rejected(self):
+        self.authenticate(self.staff)
+        response = self.client.get(f'{reverse("product-export")}?updated_since=yesterday')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('updated_since', response.data)
+
+    def test_csv_and_ndjson_hold_the_same_rows(self):
+        ndjson = [json.loads(line) for line in self.export().splitlines()]
+        header, *rows = csv.reader(self.export('?type=csv').splitlines())
+        self.assertEqual(header, EXPORT_FIELDS)
+        self.assertEqual(len(rows), len(ndjson))
+        for row, product in zip(rows, ndjson):
+            self.assertEqual(row[header.index('slug')], product['slug'])
+            self.assertEqual(row[header.index('images')].split(), product['images'])
+        self.assertTrue(ndjson[0]['images'][0].startswith('http://testserver/'))
+
+    def test_csv_leaves_the_rows_untouched(self):
+        rows = list(iter_products(Product.objects.filter(pk=self.product.pk)))
+        list(render_csv(rows))
+        self.assertIsInstance(rows[0]['images'], list)
+
+
+class BulkImportTests(StoreTestCase):
+    """The imports write in bulk, bypassing the model signals: what those maintain is checked here."""
+    def upload(self, route, text, feed_type='csv'):
+        self.authenticate(self.staff)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f'{reverse(route)}?type={feed_type}',
+                {'file': SimpleUploadedFile(f'feed.{feed_type}', text.encode('utf-8'))},
+                format='multipart',
+            )
+        self.assertEqual(response.status_code, 200, response.content[:200])
+        return response.data
+
+    def import_products(self, *rows):
+        lines = ['name,slug,description,price,stock,collection', *[','.join(row) for row in rows]]
+        return self.upload('product-import', '\n'.join(lines) + '\n')
+
+    def test_products_are_upserted_by_slug(self):
+        spare_collection = self.spare_product.collection
+        report = self.import_products(
+            ('Renamed', self.product.slug, '', '99.00', '7', spare_collection.name),
+            ('Imported lamp', 'imported-lamp', 'a lamp', '15.50', '3', self.collection.name),
+        )
+        self.assertEqual((report['imported'], report['rejected']), (2, 0))
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.name, product.price, product.stock), ('Renamed', Decimal('99.00'), 7))
+        self.assertEqual(product.collection_id, spare_collection.pk)
+        self.assertEqual(Product.objects.get(slug='imported-lamp').collection_id, self.collection.pk)
+        # one product moved out of the collection and one came in, one moved into the spare collection.
+        self.assertFalse(Collection.objects.drifted().exists())
+        self.assertEqual(Collection.objects.get(pk=spare_collection.pk).products_count, 2)
+
+    def test_invalid_rows_are_reported_by_line(self):
+        report = self.import_products(
+            ('Lamp', 'lamp', '', 'cheap', '1', self.collection.name),
+            ('Lamp', 'lamp', '', '10.00', '1', 'no such collection'),
+            ('Lamp', 'lamp', '', '10.00', '1', self.collection.name),
+            ('Lamp', 'lamp', '', '11.00', '1', self.collection.name),
+        )
+        self.assertEqual((report['imported'], report['rejected']), (1, 3))
+        self.assertEqual([(error['line'], list(error['errors'])) for error in report['errors']], [
+            (2, ['price']), (3, ['collection']), (5, ['slug']),
+        ])
+        self.assertEqual(Product.objects.get(slug='lamp').price, Decimal('10.00'))
+
+    def test_carts_are_repriced(self):
+        self.import_products((self.product.name, self.product.slug, '', '99.00', '7', self.collection.name))
+        cart = Cart.objects.get(pk=self.cart.pk)
+        expected = sum(item.quantity * item.product.price for item in cart.items.select_related('product'))
+        self.assertEqual(cart.subtotal, expected)
+
+    def test_search_index_and_cache_follow_the_import(self):
+        url = reverse('product-detail', args=[self.product.pk])
+        self.assertEqual(self.client.get(url).data['price'], self.product.price)
+        self.import_products(
+            ('Cerulean teapot', self.product.slug, '', '99.00', '7', self.collection.name),
+            ('Vermilion teapot', 'vermilion-teapot', '', '12.00', '3', self.collection.name),
+        )
+        self.assertEqual(self.client.get(url).data['price'], Decimal('99.00'))
+        self.assertEqual(product_search.search('cerulean')['ids'], [self.product.pk])
+        self.assertEqual(product_search.search('vermilion')['ids'], [Product.objects.get(slug='vermilion-teapot').pk])
+
+    def test_users_are_created_with_their_customers(self):
+        password = make_password('imported-password')
+        rows = [
+            {'username': 'imported', 'email': 'imported@example.com', 'password': password, 'phone': '555-0100'},
+            {'username': 'taken', 'email': self.user.email, 'password': password},
+            {'username': 'raw', 'email': 'raw@example.com', 'password': 'imported-password'},
+        ]
+        report = self.upload('customer-import', '\n'.join(json.dumps(row) for row in rows) + '\n', 'ndjson')
+        self.assertEqual((report['imported'], report['rejected']), (1, 2))
+        self.assertEqual([(error['line'], list(error['errors'])) for error in report['errors']], [(3, ['password']), (2, ['email'])])
+        user = User.objects.get(username='imported')
+        self.assertTrue(user.check_password('imported-password'))
+        self.assertEqual(Customer.objects.get(user=user).phone, '555-0100')
+
+
+class InvertedIndexSearchTests(StoreTestCase):
+    def test_reindexed_products_keep_the_postings_sorted(self):
+        search = InvertedIndexSearch([10, 50], 100)
+        search.rebuild()
+        search.index(self.product.pk, 'Cobalt teapot', '', self.collection.pk, Decimal('12.00'), 3)
+        search.index(self.other_product.pk, 'Cobalt kettle', '', self.collection.pk, Decimal('12.00'), 3)
+        self.assertEqual(search.search('cobalt')['ids'], sorted([self.product.pk, self.other_product.pk]))
+        search.index(self.other_product.pk, 'Amber kettle', '', self.collection.pk, Decimal('12.00'), 3)
+        # the words the product lost no longer find it.
+        self.assertEqual(search.search('cobalt')['ids'], [self.product.pk])
+        search.remove(self.product.pk)
+        self.assertEqual(search.search('cobalt')['ids'], [])
+        for ids in search.postings.values():
+            self.assertEqual(list(ids), sorted(ids))
+
+    def test_backends_implement_every_method(self):
+        class PartialSearch(ProductSearch):
+            def search(self, text, **filters):
+                return {}
+
+        with self.assertRaises(TypeError):
+            PartialSearch([10, 50], 100)
+
+
+def create_image_file(size, mode='RGB', fmt='JPEG'):
+    buffer = BytesIO()
+    Image.new(mode, size, 'red').save(buffer, fmt)
+    return buffer.getvalue()
+
+
+class ImageDerivativeTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # rendered and recorded in-process, once the upload's transaction commits, instead of in the pool.
+        self.addCleanup(setattr, derivative_pipeline, 'max_workers', derivative_pipeline.max_workers)
+        derivative_pipeline.max_workers = 0
+
+    def upload(self, content, name='upload.jpg'):
+        url = reverse('product-image-list', kwargs={'product_pk': self.product.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {'image': SimpleUploadedFile(name, content)}, format='multipart')
+        self.assertEqual(response.status_code, 201, response.data)
+        return ProductImage.objects.get(pk=response.data['id'])
+
+    def test_derivatives_fit_their_boxes_in_each_format(self):
+        rendered = render_derivatives(create_image_file((400, 200)), {'small': 100, 'big': 800}, ['jpeg', 'webp'], 80)
+        self.assertEqual(set(rendered), {'small', 'big'})
+        for name, expected_size in [('small', (100, 50)), ('big', (400, 200))]:
+            for fmt, (extension, content) in rendered[name].items():
+                with Image.open(BytesIO(content)) as image:
+                    # an image smaller than the box isn't enlarged.
+                    self.assertEqual((image.format, image.size), ({'jpeg': 'JPEG', 'webp': 'WEBP'}[fmt], expected_size))
+                self.assertEqual(extension, {'jpeg': 'jpg', 'webp': 'webp'}[fmt])
+
+    def test_transparent_images_are_not_encoded_as_jpeg(self):
+        rendered = render_derivatives(create_image_file((40, 40), 'RGBA', 'PNG'), {'small': 20}, ['jpeg'], 80)
+        extension, content = rendered['small']['jpeg']
+        with Image.open(BytesIO(content)) as image:
+            self.assertEqual((extension, image.format, image.mode), ('png', 'PNG', 'RGBA'))
+
+    def test_uploads_record_their_derivatives(self):
+        image = self.upload(create_image_file((300, 200)))
+        self.assertEqual(set(image.derivatives), set(derivative_pipeline.sizes))
+        for size, names in image.derivatives.items():
+            self.assertEqual(set(names), set(derivative_pipeline.formats))
+            for name in names.values():
+                self.assertTrue(image.image.storage.exists(name))
+
+        url = reverse('product-image-detail', kwargs={'product_pk': self.product.pk, 'pk': image.pk})
+        response = self.client.get(url)
+        self.assertTrue(response.data['image'].endswith(image.image.url))
+        response = self.client.get(url, {'size': 'thumbnail'})
+        self.assertTrue(response.data['image'].endswith(image.image.storage.url(image.derivatives['thumbnail']['jpeg'])))
+        response = self.client.get(url, {'size': 'thumbnail', 'image_format': 'webp'})
+        self.assertTrue(response.data['image'].endswith(image.image.storage.url(image.derivatives['thumbnail']['webp'])))
+
+    def test_invalid_variants_are_rejected(self):
+        url = reverse('product-image-list', kwargs={'product_pk': self.product.pk})
+        response = self.client.get(url, {'size': 'huge'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('size', response.data)
+        response = self.client.get(url, {'size': 'thumbnail', 'image_format': 'gif'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image_format', response.data)
+
+    def test_images_without_derivatives_serve_the_original(self):
+        url = reverse('product-image-detail', kwargs={'product_pk': self.product.pk, 'pk': self.image.pk})
+        response = self.client.get(url, {'size': 'thumbnail'})
+        self.assertTrue(response.data['image'].endswith(self.image.image.url))
+
+    def test_replaced_images_drop_the_late_derivatives(self):
+        image = self.upload(create_image_file((300, 200)))
+        rendered = derivative_pipeline.submit(image.pk, image.image.name).result()
+        self.assertFalse(derivative_pipeline.record(image.pk, 'store/images/products/replaced.jpg', rendered))
+        # the files rendered for the replaced upload are deleted, the recorded ones are kept.
+        storage = image.image.storage
+        self.assertEqual(sorted(storage.listdir('store/images/products/derivatives')[1]), sorted(
+            name.rsplit('/', 1)[1] for names in image.derivatives.values() for name in names.values()
+        ))
+
+    def test_backfill_renders_the_images_without_derivatives(self):
+        image = self.upload(create_image_file((300, 200)))
+        ProductImage.objects.filter(pk=image.pk).update(derivatives={})
+        # the other images of the catalog have no file.
+        ProductImage.objects.exclude(pk=image.pk).delete()
+        output = StringIO()
+        call_command('build_image_derivatives', stdout=output)
+        self.assertIn('1 of 1 images rendered', output.getvalue())
+        image.refresh_from_db()
+        self.assertEqual(set(image.derivatives), set(derivative_pipeline.sizes))
+
+
+class BulkAddCartItemTests(StoreTestCase):
+    def test_quantity_over_the_limit_is_rejected(self):
+        url = reverse('cart-item-bulk', kwargs={'cart_pk': self.cart.pk})
+        # the cart already holds 2 units of each product.
+        response = self.client.post(url, [
+            {'product_id': self.product.pk, 'quantity': 32000},
+            {'product_id': self.product.pk, 'quantity': 766},
+        ], format='json')
+        self.assertEqual(response.status_code, 400, response.content[:200])
+        self.assertEqual(self.cart.items.get(product=self.product).quantity, 2)
+
+    def test_quantity_up_to_the_limit_is_added(self):
+        url = reverse('cart-item-bulk', kwargs={'cart_pk': self.cart.pk})
+        response = self.client.post(url, [{'product_id': self.product.pk, 'quantity': 32765}], format='json')
+        self.assertEqual(response.status_code, 201, response.content[:200])
+        self.assertEqual(self.cart.items.get(product=self.product).quantity, 32767)
+
+
+class CartTotalsTests(StoreTestCase):
+    def assertTotalsRepaired(self):
+        # the totals applied as deltas agree with the ones recomputed from the items.
+        totals = Cart.objects.values_list('pk', 'subtotal', 'items_count').order_by('pk')
+        before = list(totals)
+        Cart.objects.refresh_totals()
+        self.assertEqual(before, list(totals))
+
+    def test_item_writes_keep_totals(self):
+        cart_pk = self.cart.pk
+        items_url = reverse('cart-item-list', kwargs={'cart_pk': cart_pk})
+        responses = [
+            self.client.post(items_url, {'product_id': self.product.pk, 'quantity': 3}, format='json'),
+            self.client.post(items_url, {'product_id': self.spare_product.pk, 'quantity': 2}, format='json'),
+            self.client.post(reverse('cart-item-bulk', kwargs={'cart_pk': cart_pk}), [
+                {'product_id': self.spare_product.pk, 'quantity': 1}, {'product_id': self.other_product.pk, 'quantity': 4},
+            ], format='json'),
+            self.client.patch(reverse('cart-item-detail', kwargs={'cart_pk': cart_pk, 'pk': self.cart_item.pk}), {'quantity': 7}, format='json'),
+        ]
+        item = self.cart.items.get(product=self.spare_product)
+        self.assertEqual(item.quantity, 3)
+        responses.append(self.client.delete(reverse('cart-item-detail', kwargs={'cart_pk': cart_pk, 'pk': item.pk})))
+        for response in responses:
+            self.assertLess(response.status_code, 400, response.content[:200])
+        self.assertTotalsRepaired()
+
+    def test_repricing_keeps_totals(self):
+        product = Product.objects.get(pk=self.product.pk)
+        product.price += 3
+        product.save()
+        self.assertTotalsRepaired()
+
+    def test_checkout_checks_the_items_not_the_count(self):
+        Cart.objects.filter(pk=self.order_cart.pk).update(items_count=0)
+        self.authenticate(self.user)
+        response = self.client.post(reverse('order-list'), {'cart_id': str(self.order_cart.pk)}, format='json')
+        self.assertEqual(response.status_code, 201, response.content[:200])
+
+
+class TokenRefreshTests(StoreTestCase):
+    def test_claims_are_minted_from_the_user(self):
+        refresh = str(get_token_for_user(self.user))
+        # `update()` skips the signal revoking the tokens, only the refresh sees the change.
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        with self.assertNumQueries(1):
+            response = self.client.post(reverse('jwt-refresh'), {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, 200, response.content[:200])
+        access = AccessToken(response.data['access'])
+        self.assertIs(access['is_staff'], True)
+        self.assertEqual(access['customer_id'], self.customer.pk)
+
+    def test_inactive_user_is_rejected(self):
+        refresh = str(get_token_for_user(self.user))
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        response = self.client.post(reverse('jwt-refresh'), {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, 401, response.content[:200])
+
+    def test_unknown_user_is_rejected(self):
+        refresh = RefreshToken()
+        refresh['user_id'] = str(User.objects.order_by('pk').last().pk + 1)
+        response = self.client.post(reverse('jwt-refresh'), {'refresh': str(refresh)}, format='json')
+        self.assertEqual(response.status_code, 401, response.content[:200])
+
+    def test_deny_list_requires_a_shared_cache(self):
+        self.assertFalse(TokenDenyList('default').is_shared())
+        self.assertEqual([warning.id for warning in check_deny_list_cache(None)], ['store.W001'])
+        with override_settings(CACHES={'shared': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://'}}):
+            self.assertTrue(TokenDenyList('shared').is_shared())
+
+    def test_rehash_at_sign_in_keeps_the_tokens(self):
+        # the hash of a password made with fewer iterations than the hasher's current count.
+        hasher = get_hasher()
+        User.objects.filter(pk=self.user.pk).update(password=hasher.encode('test', hasher.salt(), hasher.iterations - 1))
+        refresh = str(get_token_for_user(self.user))
+        response = self.client.post(reverse('sign-in-list'), {'email': self.user.email, 'password': 'test'}, format='json')
+        self.assertEqual(response.status_code, 201, response.content[:200])
+        self.assertNotEqual(User.objects.get(pk=self.user.pk).password.split('$')[1], str(hasher.iterations - 1))
+        response = self.client.post(reverse('jwt-refresh'), {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, 200, response.content[:200])
+
+    def test_password_change_revokes_the_tokens(self):
+        refresh = str(get_token_for_user(self.user))
+        time.sleep(1)
+        self.user.set_password('changed')
+        self.user.save(update_fields=['password'])
+        response = self.client.post(reverse('jwt-refresh'), {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, 401, response.content[:200])
+
+
+class PasswordHashingPoolTests(SimpleTestCase):
+    async def test_a_full_pool_rejects_the_overflow(self):
+        pool = PasswordHashingPool(max_workers=1, max_queue=1)
+        encoded = make_password('secret')
+        release = threading.Event()
+        # the only worker is busy, so the next sign-ins queue.
+        pool.executor.submit(release.wait, 10)
+        queued = [asyncio.ensure_future(pool.verify('secret', encoded)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with self.assertRaises(HashingPoolFull):
+            await pool.verify('secret', encoded)
+        release.set()
+        self.assertEqual(await asyncio.gather(*queued), [(True, None), (True, None)])
+        metrics = pool.metrics()
+        self.assertEqual((metrics['completed'], metrics['rejected'], metrics['peak_queued']), (2, 1, 1))
+
+
+class AsyncSignInTests(StoreTestCase):
+    async def test_tokens_authenticate_the_sync_views(self):
+        response = await self.async_client.post(
+            reverse('sign-in-async'), {'email': self.user.email, 'password': 'test'}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201, response.content[:200])
+        access = response.json()['access']
+        self.assertEqual(AccessToken(access)['customer_id'], self.customer.pk)
+        response = await sync_to_async(self.client.get)(reverse('customer-me'), HTTP_AUTHORIZATION=f'JWT {access}')
+        self.assertEqual(response.status_code, 200, response.content[:200])
+        self.assertEqual(response.data['id'], self.customer.pk)
+
+    async def test_wrong_password_is_rejected(self):
+        response = await self.async_client.post(
+            reverse('sign-in-async'), {'email': self.user.email, 'password': 'wrong'}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class ConditionalGetTests(StoreTestCase):
+    def test_catalog_cache_hits_take_no_query(self):
+        for route, kwargs in [
+            ('product-list', None), ('product-detail', {'pk': self.product.pk}),
+            ('collection-list', None), ('collection-detail', {'pk': self.collection.pk}),
+            ('async-product-list', None), ('async-product-detail', {'pk': self.product.pk}),
+        ]:
+            with self.subTest(route=route):
+                url = reverse(route, kwargs=kwargs)
+                etag = self.client.get(url)['ETag']
+                with self.assertNumQueries(0):
+                    self.assertEqual(self.client.get(url)['ETag'], etag)
+                with self.assertNumQueries(0):
+                    self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_write_changes_the_etag(self):
+        url = reverse('product-detail', kwargs={'pk': self.product.pk})
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url, {'price': 99}, format='json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['price'], 99)
+
+
+class InstrumentationTests(StoreTestCase):
+    def test_server_timing_counts_the_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('product-list'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn(f'desc="{len(queries)} queries"', response['Server-Timing'])
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+    def test_requests_are_logged_when_enabled(self):
+        with override_settings(STORE_INSTRUMENTATION={'LOG': True}), self.assertLogs('store.instrumentation') as logs:
+            self.client.get(reverse('product-list'))
+        self.assertEqual(json.loads(logs.records[0].getMessage())['route'], 'product-list')
+
+    def get_sampled(self, sample_rate, directory):
+        profile = {'SAMPLE_RATE': sample_rate, 'SLOW_MS': 0, 'DIRECTORY': directory}
+        with override_settings(STORE_INSTRUMENTATION={'PROFILE': profile}):
+            # a new client, whose handler builds the middleware from these settings.
+            self.client_class().get(reverse('product-list'))
+
+    def test_sampled_slow_requests_are_profiled(self):
+        with tempfile.TemporaryDirectory() as directory:
+            route = os.path.join(directory, 'product-list')
+            self.get_sampled(0, directory)
+            self.assertFalse(os.path.exists(route))
+            with self.assertLogs('store.instrumentation', 'WARNING'):
+                self.get_sampled(1, directory)
+            self.assertEqual(len(os.listdir(route)), 1)
+
+
+class MetricsRegistryTests(SimpleTestCase):
+    def observe_in_threads(self, registry, count):
+        for _ in range(count):
+            thread = threading.Thread(target=registry.observe_request, args=('product-list', 'GET', 200, 0.01, 2))
+            thread.start()
+            thread.join()
+
+    def test_ended_threads_hand_their_shard_on(self):
+        registry = MetricsRegistry()
+        self.observe_in_threads(registry, 10)
+        self.assertEqual(len(registry._shards), 1)
+        self.assertEqual(registry.collect()['["store_http_requests_total",["product-list","GET"]]'], 10)
+
+    def test_ended_threads_hand_their_file_on(self):
+        with tempfile.TemporaryDirectory() as directory:
+            registry = MetricsRegistry(mode='file', directory=directory)
+            self.observe_in_threads(registry, 10)
+            self.assertEqual(len(os.listdir(directory)), 1)
+            self.assertEqual(registry.collect()['["store_http_requests_total",["product-list","GET"]]'], 10)
@@ -1,21 +1,26 @@
 from django.urls import path, include
 from rest_framework_nested.routers import DefaultRouter, NestedDefaultRouter
-from .views import (SignUpViewSet, SignInViewSet,
+from . import async_views
+from .views import (SignUpViewSet, SignInViewSet, SignOutViewSet,
                     ProfileViewSet, CollectionViewSet,
                     ProductViewSet, ProductImageViewSet,
                     CustomerViewSet, CartViewSet,
-                    CartItemViewSet, OrderViewSet)
+                    CartItemViewSet, OrderViewSet,
+                    SalesReportViewSet, MetricsViewSet)
 
 
 router = DefaultRouter()
 router.register("signup", SignUpViewSet, basename="sign-up")
 router.register("signin", SignInViewSet, basename="sign-in")
+router.register("signout", SignOutViewSet, basename="sign-out")
 router.register("profile", ProfileViewSet, basename="profile")
 router.register('collections', viewset=CollectionViewSet, basename='collection')
 router.register('products', viewset=ProductViewSet, basename='product')
 router.register('customers', viewset=CustomerViewSet, basename='customer')
 router.register('carts', viewset=CartViewSet, basename='cart')
 router.register('orders', viewset=OrderViewSet, basename='order')
+router.register('reports/sales', viewset=SalesReportViewSet, basename='sales-report')
+router.register('metrics', viewset=MetricsViewSet, basename='metrics')
 
 products_router = NestedDefaultRouter(router, 'products', lookup='product')
 products_router.register('images', viewset=ProductImageViewSet, basename='product-image')
@@ -24,6 +29,12 @@ carts_router = NestedDefaultRouter(router, 'carts', lookup='cart')
 carts_router.register('items', viewset=CartItemViewSet, basename='cart-item')
 
 urlpatterns = [
+    path('signin/async/', async_views.sign_in, name='sign-in-async'),
+    path('async/products/', async_views.product_list, name='async-product-list'),
+    path('async/products/<int:pk>/', async_views.product_detail, name='async-product-detail'),
+    path('async/collections/', async_views.collection_list, name='async-collection-list'),
+    path('async/collections/<int:pk>/', async_views.collection_detail, name='async-collection-detail'),
+    path('async/carts/<uuid:pk>/', async_views.cart_detail, name='async-cart-detail'),
     path('', include(router.urls)),
     path('', include(products_router.urls)),
     path('', include(carts_router.urls)),
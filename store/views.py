@@ -1,17 +1,42 @@
-from rest_framework import status
+from io import TextIOWrapper
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import transaction
+from django.db.models import Prefetch, Sum, prefetch_related_objects
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import status, serializers
 from rest_framework.response import Response
 from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin, UpdateModelMixin, DestroyModelMixin
 from rest_framework.viewsets import GenericViewSet, ModelViewSet
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.decorators import action
-from .models import User, Collection, Product, ProductImage, Customer, Cart, CartItem, Order, OrderItem
-from .serializers import (SignUpSerializer, SignInSerializer,
+from rest_framework.exceptions import NotFound
+from rest_framework.parsers import MultiPartParser
+from rest_framework.utils.urls import replace_query_param
+from .cache import CatalogCacheMixin
+from .conditional import CART_LAST_MODIFIED, ConditionalGetMixin
+from .exports import EXPORT_FORMATS, iter_products
+from .images import get_requested_variant
+from .imports import READERS, ProductImporter, UserImporter
+from .metrics import PrometheusRenderer, metrics
+from .passwords import password_hashing_pool
+from .replicas import ReplicaReadMixin
+from .sales import delete_order
+from .search import product_search
+from .fast_serializers import (fast_serializers_enabled, FastReadMixin, ProductValuesSerializer, CollectionValuesSerializer,
+                               CartValuesSerializer, CartItemValuesSerializer)
+from .models import (User, Collection, Product, ProductImage, Customer, Cart, CartItem, Order, OrderItem,
+                     DailySales, DailyProductSales, DailyCollectionSales)
+from .serializers import (SignUpSerializer, SignInSerializer, SignOutSerializer,
                           UserSerializer, CollectionSerializer,
-                          ProductSerializer, ProductImageSerializer,
+                          ProductSerializer, ProductImageSerializer, ProductSearchSerializer,
                           CustomerSerializer, CartSerializer,
                           RetrieveCartItemSerializer, AddCartItemSerializer, UpdateCartItemSerializer,
+                          BulkAddCartItemSerializer,
                           RetrieveOrderSerializer, CreateOrderSerializer,
-                          AdminUpdateOrderSerializer, UserCancelOrderSerializer)
+                          AdminUpdateOrderSerializer, UserCancelOrderSerializer,
+                          SalesReportSerializer, SalesTotalsSerializer, DailySalesSerializer, ProductSalesSerializer, CollectionSalesSerializer)
 
 
 class SignUpViewSet(CreateModelMixin, GenericViewSet):
@@ -23,6 +48,26 @@ class SignInViewSet(CreateModelMixin, GenericViewSet):
     queryset = User.objects.all()
     serializer_class = SignInSerializer
 
+    @action(detail=False, methods=['GET'], permission_classes=[IsAdminUser])
+    def metrics(self, request):
+        """Queue depth and timings of the password hashing pool of the async sign-in, for this worker process."""
+        return Response(password_hashing_pool.metrics())
+
+
+class SignOutViewSet(GenericViewSet):
+    serializer_class = SignOutSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_serializer_context(self):
+        return {'user': self.request.user, 'access': self.request.auth}
+
+    def create(self, request):
+        """Revoke the given refresh token and the access token used for this request."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
 class ProfileViewSet(RetrieveModelMixin, UpdateModelMixin, DestroyModelMixin, GenericViewSet):
     serializer_class = UserSerializer
@@ -34,45 +79,160 @@ class ProfileViewSet(RetrieveModelMixin, UpdateModelMixin, DestroyModelMixin, Ge
         return User.objects.all()
     
 
-class CollectionViewSet(ModelViewSet):
-    queryset = Collection.objects.prefetch_related('products').all()
+class CollectionViewSet(ReplicaReadMixin, ConditionalGetMixin, CatalogCacheMixin, FastReadMixin, ModelViewSet):
+    cache_scope = 'collection'
+    last_modified = 'last_updated_at'
+    queryset = Collection.objects.all()
     serializer_class = CollectionSerializer
+    values_serializer_class = CollectionValuesSerializer
 
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(ReplicaReadMixin, ConditionalGetMixin, CatalogCacheMixin, FastReadMixin, ModelViewSet):
+    cache_scope = 'product'
+    last_modified = 'last_updated_at'
     queryset = Product.objects.prefetch_related('images').all()
     serializer_class = ProductSerializer
+    values_serializer_class = ProductValuesSerializer
+
+    def get_queryset(self):
+        fieldset = ProductSerializer.get_fieldset(self.request)
+        if fieldset is None:
+            return super().get_queryset()
+        queryset = fieldset.only(Product.objects.all())
+        if 'images' in fieldset:
+            images = ProductImage.objects.all() if fieldset.expands('images') else ProductImage.objects.only('product')
+            queryset = queryset.prefetch_related(Prefetch('images', queryset=images))
+        if 'image' in fieldset:
+            queryset = queryset.prefetch_related(Prefetch('images', queryset=ProductImage.objects.order_by('pk')[:1], to_attr='first_images'))
+        return queryset
 
     def destroy(self, request, pk):
         product = Product.objects.get(pk=pk)
-        if product.orderitems.count() > 0:
+        if product.orderitems.exists():
             return Response({'error' : 'That product can not be deleted yet as it is included in some orders!'})
         
-        elif product.cartitems.count() > 0:
+        elif product.cartitems.exists():
             return Response({'error' : 'That product can not be deleted now as it is being added to a shopping cart!'})
         
         return super().destroy(request, pk)
 
+    @action(detail=False, methods=['GET'])
+    def search(self, request):
+        """
+        Search products by `q` (every word must appear in the name or description, ranked by relevance),
+        filtered by `collection`, `min_price`, `max_price` and `in_stock=true`, paged by `page`.
+        Answers with the `count` of matches, a page of products and `facets`: the matches per collection
+        and per price bucket, each ignoring its own filter.
+        """
+        params = ProductSearchSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        filters = dict(params.validated_data)
+        page, text = filters.pop('page'), filters.pop('q', '')
+        page_size = self.paginator.get_page_size(request)
+        offset = (page - 1) * page_size
+        if offset >= product_search.max_results:
+            raise NotFound(f'Only the first {product_search.max_results} results can be paged through.')
+        found = product_search.search(text, offset=offset, limit=page_size, **filters)
+
+        # the products are read by id, and put back in rank order (before serializing, `?fields=` may leave out the id).
+        rank = {product_id: index for index, product_id in enumerate(found['ids'])}
+        if fast_serializers_enabled():
+            values_serializer = ProductValuesSerializer(request)
+            rows = sorted(values_serializer.get_rows(Product.objects.filter(pk__in=found['ids']).order_by()), key=lambda row: rank[row['id']])
+            products = values_serializer.serialize(rows)
+        else:
+            instances = sorted(self.get_queryset().filter(pk__in=found['ids']).order_by(), key=lambda product: rank[product.pk])
+            products = ProductSerializer(instances, many=True, context=self.get_serializer_context()).data
+        collection_names = dict(Collection.objects.filter(pk__in=found['collections']).order_by().values_list('id', 'name'))
+
+        has_next = offset + page_size < min(found['count'], product_search.max_results)
+        return Response({
+            'count': found['count'],
+            'next': replace_query_param(request.build_absolute_uri(), 'page', page + 1) if has_next else None,
+            'results': products,
+            'facets': {
+                'collection': [
+                    {'id': collection_id, 'name': collection_names.get(collection_id), 'count': count}
+                    for collection_id, count in sorted(found['collections'].items(), key=lambda item: (-item[1], item[0]))
+                ],
+                'price': [
+                    {'min': low, 'max': high, 'count': count}
+                    for (low, high), count in zip(product_search.get_buckets(), found['prices'])
+                ],
+            },
+        })
+
+    @action(detail=False, methods=['GET'], permission_classes=[IsAdminUser])
+    def export(self, request):
+        """
+        Stream the whole catalog as NDJSON (default) or CSV with `?type=csv`.
+        `?updated_since=<ISO datetime>` only exports the products changed since then, for incremental pulls.
+        """
+        export_type = request.query_params.get('type', 'ndjson')
+        if export_type not in EXPORT_FORMATS:
+            raise serializers.ValidationError({'type': f'Must be one of: {", ".join(EXPORT_FORMATS)}.'})
+
+        queryset = Product.objects.all()
+        ordering = ('pk',)
+        if updated_since := request.query_params.get('updated_since'):
+            since = parse_datetime(updated_since)
+            if since is None:
+                raise serializers.ValidationError({'updated_since': 'Must be an ISO 8601 datetime.'})
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            # walk the (last_updated_at, id) index instead of scanning the whole table by primary key.
+            queryset = queryset.filter(last_updated_at__gte=since)
+            ordering = ('last_updated_at', 'pk')
+
+        render, content_type = EXPORT_FORMATS[export_type]
+        response = StreamingHttpResponse(render(iter_products(queryset, request, ordering)), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="products.{export_type}"'
+        return response
+
+    @action(detail=False, methods=['POST'], url_path='import', url_name='import',
+            permission_classes=[IsAdminUser], parser_classes=[MultiPartParser])
+    def bulk_import(self, request):
+        """
+        Upsert products by slug from an uploaded CSV or NDJSON `file` (`?type=ndjson`, csv by default).
+        Answers with the import report; rows that fail validation are listed and skipped.
+        Large supplier feeds are better loaded with `manage.py import_products`.
+        """
+        feed_type = request.query_params.get('type', 'csv')
+        if feed_type not in READERS:
+            raise serializers.ValidationError({'type': f'Must be one of: {", ".join(READERS)}.'})
+        if 'file' not in request.FILES:
+            raise serializers.ValidationError({'file': 'No file was submitted.'})
+
+        stream = TextIOWrapper(request.FILES['file'].file, encoding='utf-8', newline='')
+        report = ProductImporter().run(READERS[feed_type](stream))
+        return Response(report, status=status.HTTP_200_OK)
+
 
 class ProductImageViewSet(ModelViewSet):
     serializer_class = ProductImageSerializer
 
+    def initialize_request(self, request, *args, **kwargs):
+        # uploads are streamed to a temporary file, which the storage then moves in place, instead of
+        # being buffered in memory when they are under FILE_UPLOAD_MAX_MEMORY_SIZE.
+        request.upload_handlers = [TemporaryFileUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
     def get_queryset(self):
         product_id = self.kwargs['product_pk']
         return ProductImage.objects.filter(product_id=product_id)
     
     def get_serializer_context(self):
-        return {'product_id': self.kwargs['product_pk']}
+        return {'product_id': self.kwargs['product_pk'], 'image_variant': get_requested_variant(self.request)}
 
 
 class CustomerViewSet(ModelViewSet):
-    queryset = Customer.objects.all()
+    queryset = Customer.objects.select_related('user').all()
     serializer_class = CustomerSerializer
     permission_classes = [IsAdminUser]
 
     @action(detail=False,  methods= ['GET', 'PUT'], permission_classes = [IsAuthenticated])
     def me(self, request):
-        customer = Customer.objects.get(user_id = request.user.id)
+        customer = Customer.objects.select_related('user').get(pk = request.user.customer_id)
         if request.method == 'GET':
             serializer = CustomerSerializer(customer)
             return Response(serializer.data)
@@ -83,11 +243,32 @@ class CustomerViewSet(ModelViewSet):
             serializer.save()
             return Response(serializer.data)
 
+    @action(detail=False, methods=['POST'], url_path='import', url_name='import', parser_classes=[MultiPartParser])
+    def bulk_import(self, request):
+        """
+        Create users and their customers from an uploaded CSV or NDJSON `file` (`?type=ndjson`, csv by default)
+        of already hashed passwords. Answers with the import report; rejected rows are listed and skipped.
+        Large migrations are better loaded with `manage.py import_users`.
+        """
+        feed_type = request.query_params.get('type', 'csv')
+        if feed_type not in READERS:
+            raise serializers.ValidationError({'type': f'Must be one of: {", ".join(READERS)}.'})
+        if 'file' not in request.FILES:
+            raise serializers.ValidationError({'file': 'No file was submitted.'})
+
+        stream = TextIOWrapper(request.FILES['file'].file, encoding='utf-8', newline='')
+        report = UserImporter().run(READERS[feed_type](stream))
+        return Response(report, status=status.HTTP_200_OK)
 
-class CartViewSet(ModelViewSet):
+
+class CartViewSet(ConditionalGetMixin, FastReadMixin, ModelViewSet):
     http_method_names = ['get', 'post', 'delete', 'head', 'options']
-    queryset = Cart.objects.prefetch_related('items__product').all()
+    last_modified = CART_LAST_MODIFIED
+    queryset = Cart.objects.prefetch_related(
+        Prefetch('items', queryset=CartItem.objects.select_related('product'))
+    ).all()
     serializer_class = CartSerializer
+    values_serializer_class = CartValuesSerializer
 
     def list(self, request, *args, **kwargs):
         if self.request.user.is_staff:
@@ -95,14 +276,17 @@ class CartViewSet(ModelViewSet):
         return Response({"detail": "list all resources is not allowed for this user."}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
-class CartItemViewSet(ModelViewSet):
+class CartItemViewSet(FastReadMixin, ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete']
+    values_serializer_class = CartItemValuesSerializer
 
     def get_queryset(self):
         return CartItem.objects.filter(cart = self.kwargs['cart_pk']).select_related('product')
     
     def get_serializer_class(self):
-        if self.request.method == 'POST':
+        if self.action == 'bulk':
+            return BulkAddCartItemSerializer
+        elif self.request.method == 'POST':
             return AddCartItemSerializer
         elif self.request.method == 'PATCH':
             return UpdateCartItemSerializer
@@ -110,24 +294,58 @@ class CartItemViewSet(ModelViewSet):
         
     def get_serializer_context(self):
         return {'cart_id': self.kwargs['cart_pk']}
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            Cart.objects.filter(pk=instance.cart_id).add_to_totals(-instance.quantity * instance.product.price, items_count=-1)
+
+    @action(detail=False, methods=['POST'])
+    def bulk(self, request, cart_pk):
+        """
+        Add a list of `{product_id, quantity}` lines to the cart at once.
+        Lines for products already in the cart have their quantity increased.
+        """
+        serializer = self.get_serializer(data=request.data, many=True, allow_empty=False, max_length=1000)
+        serializer.is_valid(raise_exception=True)
+        cart_items = serializer.save()
+        serializer = RetrieveCartItemSerializer(cart_items, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
     
 
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(ReplicaReadMixin, ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete', 'head', 'options']
 
     def create(self, request, *args, **kwargs):
-        serializer = CreateOrderSerializer(data=request.data, context= {'user_id': self.request.user.id})
+        serializer = CreateOrderSerializer(data=request.data, context= {'customer_id': self.request.user.customer_id})
         serializer.is_valid(raise_exception=True)
         order = serializer.save()
+        prefetch_related_objects([order], Prefetch('items', queryset=OrderItem.objects.select_related('product')))
         serializer = RetrieveOrderSerializer(order)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
     def get_queryset(self):
         user = self.request.user
+        fieldset = RetrieveOrderSerializer.get_fieldset(self.request)
+        if fieldset is None:
+            queryset = Order.objects.prefetch_related(
+                Prefetch('items', queryset=OrderItem.objects.select_related('product'))
+            )
+        else:
+            queryset = fieldset.only(Order.objects.all())
+            if 'items' in fieldset:
+                if fieldset.expands('items.product'):
+                    # the columns `SimpleProductSerializer` renders, not the descriptions.
+                    items = OrderItem.objects.select_related('product') \
+                        .only('order', 'unit_price', 'quantity', 'product__name', 'product__price')
+                elif fieldset.expands('items'):
+                    items = OrderItem.objects.all()
+                else:
+                    items = OrderItem.objects.only('order')
+                queryset = queryset.prefetch_related(Prefetch('items', queryset=items))
         if user.is_staff:
-            return Order.objects.all()
-        customer_id = Customer.objects.only('id').get(user_id = user.id)
-        return Order.objects.filter(customer_id=customer_id)
+            return queryset.all()
+        return queryset.filter(customer_id=user.customer_id)
     
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -141,4 +359,59 @@ class OrderViewSet(ModelViewSet):
     def get_permissions(self):
         if self.request.method == 'DELETE':
             return [IsAdminUser()]
-        return [IsAuthenticated()]
\ No newline at end of file
+        return [IsAuthenticated()]
+
+    def perform_destroy(self, instance):
+        delete_order(instance)
+
+
+class MetricsViewSet(GenericViewSet):
+    permission_classes = [IsAdminUser]
+    renderer_classes = [PrometheusRenderer]
+
+    def list(self, request):
+        """Request counters and histograms of latency and SQL statements per route, for Prometheus to scrape."""
+        return Response(metrics.render(), content_type=PrometheusRenderer.content_type)
+
+
+class SalesReportViewSet(GenericViewSet):
+    """
+    Sales between `start` and `end` (the last 30 days by default) of the orders in `status` (repeatable,
+    every status but canceled by default), read from the daily rollups alone (see store/sales.py).
+    """
+    permission_classes = [IsAdminUser]
+
+    def get_params(self):
+        params = SalesReportSerializer(data=self.request.query_params)
+        params.is_valid(raise_exception=True)
+        return params.validated_data
+
+    def summarize(self, model, params, *groups):
+        return model.objects \
+            .filter(day__range=(params['start'], params['end']), status__in=params['status'], orders_count__gt=0) \
+            .values(*groups) \
+            .annotate(total_orders=Sum('orders_count'), total_quantity=Sum('quantity'), total_revenue=Sum('revenue'))
+
+    def respond(self, params, results, **extra):
+        return Response({'start': params['start'], 'end': params['end'], 'status': params['status'], **extra, 'results': results})
+
+    def list(self, request):
+        """The sales of each day (the days without any are left out) and their totals."""
+        params = self.get_params()
+        days = list(self.summarize(DailySales, params, 'day').order_by('day'))
+        totals = {field: sum(day[field] for day in days) for field in ('total_orders', 'total_quantity', 'total_revenue')}
+        return self.respond(params, DailySalesSerializer(days, many=True).data, totals=SalesTotalsSerializer(totals).data)
+
+    @action(detail=False, methods=['GET'])
+    def products(self, request):
+        """The `limit` best selling products by revenue."""
+        params = self.get_params()
+        rows = self.summarize(DailyProductSales, params, 'product_id', 'product__name').order_by('-total_revenue', 'product_id')
+        return self.respond(params, ProductSalesSerializer(rows[:params['limit']], many=True).data)
+
+    @action(detail=False, methods=['GET'])
+    def collections(self, request):
+        """The `limit` best selling collections by revenue."""
+        params = self.get_params()
+        rows = self.summarize(DailyCollectionSales, params, 'collection_id', 'collection__name').order_by('-total_revenue', 'collection_id')
+        return self.respond(params, CollectionSalesSerializer(rows[:params['limit']], many=True).data)
\ No newline at end of file